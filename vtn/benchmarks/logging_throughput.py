@@ -0,0 +1,220 @@
+"""
+ログの出力方法ごとの oadrUpdateReport のスループットの比較。
+
+main.py のレポートのコールバック（値ごとにログを出す）を登録した ReportService に、
+--values 個の値を持つ oadrUpdateReport を --concurrency 個のタスクから --duration 秒送り続け、
+req/s・値/s・応答時間（p50 / p99）を出力方法ごとに出力する（rounds 回のうち最もスループットの高かった回）。
+us/value はコールバックを直接呼んだときの値 1 つあたりの時間（イベントループのスレッドで使う時間）。HTTP は通さず MyVTNService.handler を直接呼ぶ。
+
+出力方法:
+    off      openleadr.telemetry のログを無効にする
+    print    値ごとに print する（QueueLogHandler 導入前の main.py 相当。stdout をファイルに向ける）
+    sync     FileHandler をロガーに直接付ける（イベントループで書式化と書き込みを行う）
+    queue    QueueLogHandler 経由で FileHandler に書く
+    sampled  queue に加えて main.telemetry_sampler（SamplingFilter(--sample-rate)）で値を間引く
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.logging_throughput --duration 3 --rounds 3 --values 50
+    python -m benchmarks.logging_throughput --modes off queue --format json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+from openleadr.messaging import create_message
+
+import main as vtn_main
+from benchmarks.prefork_throughput import make_client_certificate
+from benchmarks.stages import update_report_message
+from benchmarks.ven_fleet import percentile
+from openleadr_impl.diagnostics.logs import JsonFormatter, QueueLogHandler, SamplingFilter
+from openleadr_impl.service.report_service import ReportService
+from openleadr_impl.utils import utils as myUtils
+
+MODES = ("off", "print", "sync", "queue", "sampled")
+
+
+class DummyRequest:
+    remote = "127.0.0.1"
+
+    def __init__(self, headers, body):
+        self.headers = headers
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+
+async def print_report_values(
+    data, report_name, r_id, report_specifier_id, item_name, unit
+):
+    for ts, val in data:
+        print(
+            f"[USAGE] {ts} r_id={r_id} rs_id={report_specifier_id} {item_name}={val} {unit} report_name={report_name}"
+        )
+
+
+def make_service(mode, fingerprint):
+    service = ReportService("bench-vtn")
+    service._create_message = create_message
+    service.ven_lookup = lambda ven_id: {
+        "ven_id": ven_id,
+        "registration_id": "reg-1",
+        "fingerprint": fingerprint,
+    }
+    callback = print_report_values if mode == "print" else vtn_main.on_update_report_usage
+    service.report_callbacks[("rr-1", "energy")] = partial(
+        callback,
+        report_name="TELEMETRY_USAGE",
+        r_id="energy",
+        report_specifier_id="TelemetryUsage",
+        item_name="energyReal",
+        unit="Wh",
+    )
+    return service
+
+
+@contextlib.contextmanager
+def logging_mode(mode, path, log_format, sample_rate, max_queue):
+    """
+    mode の出力方法を設定し、QueueLogHandler を使う場合はそれを返す。
+    """
+    logger = logging.getLogger("openleadr")
+    telemetry = logging.getLogger("openleadr.telemetry")
+    file_handler = logging.FileHandler(path)
+    if log_format == "json":
+        file_handler.setFormatter(JsonFormatter())
+    handler = None
+    logger.setLevel(logging.INFO)
+    if mode == "off":
+        telemetry.setLevel(logging.WARNING)
+    elif mode == "sync":
+        handler = file_handler
+    elif mode in ("queue", "sampled"):
+        handler = QueueLogHandler([file_handler], max_queue=max_queue)
+        handler.start()
+        if mode == "sampled":
+            vtn_main.telemetry_sampler = SamplingFilter(sample_rate)
+    if handler is not None:
+        logger.addHandler(handler)
+    try:
+        with open(path, "a") as stdout, contextlib.redirect_stdout(stdout):
+            yield handler
+    finally:
+        if handler is not None:
+            logger.removeHandler(handler)
+            # QueueLogHandler は溜まっているレコードを書き終えてから止まる
+            handler.close()
+        vtn_main.telemetry_sampler = None
+        telemetry.setLevel(logging.NOTSET)
+        file_handler.close()
+
+
+async def run_mode(service, request, concurrency, duration):
+    """
+    (リクエスト数, 経過秒, 応答時間のリスト) を返す。
+    """
+    latencies = []
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+
+    async def worker():
+        while loop.time() < deadline:
+            started = time.perf_counter()
+            response = await service.handler(request)
+            latencies.append(time.perf_counter() - started)
+            if response.status != 200:
+                raise RuntimeError(f"Unexpected response {response.status}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return len(latencies), time.perf_counter() - started, latencies
+
+
+async def measure_callback(service, values, repeat=20):
+    """
+    レポートのコールバックの値 1 つあたりの時間（イベントループのスレッドでかかる時間）を返す。
+    """
+    callback = service.report_callbacks[("rr-1", "energy")]
+    now = datetime.now(timezone.utc)
+    data = [(now, float(i)) for i in range(values)]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await callback(data)
+    return (time.perf_counter() - started) / (repeat * values)
+
+
+async def run(args):
+    request = DummyRequest(
+        {
+            "content-type": "application/xml",
+            "X-Amzn-Mtls-Clientcert-Leaf": make_client_certificate(),
+        },
+        update_report_message("rr-1", args.values),
+    )
+    fingerprint = myUtils.get_certificate_fingerprint_from_alb_header(request)
+    print(
+        f"values/report: {args.values}  concurrency: {args.concurrency}  "
+        f"duration: {args.duration}s x {args.rounds}  format: {args.format}"
+    )
+    print(
+        f"{'mode':<10}{'req/s':>10}{'values/s':>12}{'p50[ms]':>10}{'p99[ms]':>10}"
+        f"{'us/value':>14}{'dropped':>9}"
+    )
+    results = {mode: [] for mode in args.modes}
+    with tempfile.TemporaryDirectory() as directory:
+        # 負荷の揺らぎが出力方法の差に偏らないよう、出力方法を順に切り替えて rounds 回ずつ測る
+        for _round in range(args.rounds):
+            for mode in args.modes:
+                path = os.path.join(directory, f"{mode}.log")
+                service = make_service(mode, fingerprint)
+                with logging_mode(
+                    mode, path, args.format, args.sample_rate, args.max_queue
+                ) as handler:
+                    # 最初のリクエストのテンプレートのコンパイルなどを計測に含めない
+                    await run_mode(service, request, 1, 0.1)
+                    count, elapsed, latencies = await run_mode(
+                        service, request, args.concurrency, args.duration
+                    )
+                    per_value = await measure_callback(service, args.values)
+                dropped = handler.dropped if isinstance(handler, QueueLogHandler) else 0
+                results[mode].append(
+                    (count / elapsed, sorted(latencies), per_value, dropped)
+                )
+                os.remove(path)
+
+    # 各出力方法で最もスループットの高かった回を表示する
+    for mode, runs in results.items():
+        throughput, latencies, _per_value, dropped = max(runs, key=lambda run: run[0])
+        per_value = min(run[2] for run in runs)
+        print(
+            f"{mode:<10}{throughput:>10.1f}{throughput * args.values:>12.0f}"
+            f"{percentile(latencies, 0.50) * 1000:>10.2f}"
+            f"{percentile(latencies, 0.99) * 1000:>10.2f}"
+            f"{per_value * 1e6:>14.1f}{dropped:>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--values", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--max-queue", type=int, default=100_000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
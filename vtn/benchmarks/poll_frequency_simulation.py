@@ -0,0 +1,185 @@
+"""
+ポーリング周期ポリシーのシミュレーション。
+
+VEN 群と DR イベントの発生を離散イベントで模擬し、ポリシーごとに
+「VTN が受けるリクエスト総数（req/s）」と「イベント配信遅延（作成・変更から VEN の次回ポーリングまで）」を比較する。
+
+適応ポリシーでは PollService と同じく、ポーリング時に PollFrequencyPolicy.changed() が True になった VEN に
+oadrRequestReregistration を積む。それを受け取った VEN は再登録（oadrQueryRegistration +
+oadrCreatePartyRegistration の 2 リクエスト）を行い、新しい周期を受け取る。未配信のイベント更新がある場合は
+oadrDistributeEvent が先に返るため、再登録はその次のポーリングになる。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.poll_frequency_simulation --vens 1000 --hours 2
+"""
+
+import argparse
+import heapq
+import random
+import statistics
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from openleadr_impl.control.poll_frequency import PollFrequencyPolicy
+
+BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+class FixedPolicy:
+    def __init__(self, freq):
+        self.freq = freq
+
+    def poll_freq_for(self, ven_id, now=None):
+        return self.freq
+
+    def changed(self, ven_id, now=None):
+        return False
+
+
+def simulate(policy, vens, horizon, event_rate, lead_time, duration, updates, seed):
+    rng = random.Random(seed)
+    events = {}
+    events_updated = {}
+    if isinstance(policy, PollFrequencyPolicy):
+        policy.event_service = SimpleNamespace(events=events)
+        policy.poll_service = SimpleNamespace(events_updated=events_updated)
+
+    # (時刻, 種別, ven_id)  種別: 0=イベント作成, 1=oadrPoll, 2=イベント更新
+    queue = []
+    current_freq = {}
+    for i in range(vens):
+        ven_id = f"ven_{i:05d}"
+        freq = policy.poll_freq_for(ven_id, BASE_TIME).total_seconds()
+        current_freq[ven_id] = freq
+        heapq.heappush(queue, (rng.uniform(0, freq), 1, ven_id))
+        t = rng.expovariate(event_rate)
+        while t < horizon:
+            heapq.heappush(queue, (t, 0, ven_id))
+            t += rng.expovariate(event_rate)
+
+    requests = 0
+    reregistrations = 0
+    reregistration_queued = set()
+    created_at = {}
+    latencies = []
+    while queue:
+        t, kind, ven_id = heapq.heappop(queue)
+        if t >= horizon:
+            break
+        now = BASE_TIME + timedelta(seconds=t)
+
+        if kind == 0:
+            # VTN 側でイベントを追加（events_updated を立てる）
+            dtstart = now + timedelta(seconds=lead_time)
+            events.setdefault(ven_id, []).append(
+                {
+                    "event_descriptor": {"event_status": "far"},
+                    "active_period": {
+                        "dtstart": dtstart,
+                        "duration": timedelta(seconds=duration),
+                    },
+                }
+            )
+            events_updated[ven_id] = True
+            created_at.setdefault(ven_id, []).append(t)
+            # 実施前後に発生する変更（modification / キャンセル）を予約
+            for _ in range(updates):
+                heapq.heappush(
+                    queue, (t + rng.uniform(0, lead_time + duration), 2, ven_id)
+                )
+            continue
+
+        if kind == 2:
+            events_updated[ven_id] = True
+            created_at.setdefault(ven_id, []).append(t)
+            continue
+
+        # oadrPoll
+        requests += 1
+        if ven_id in events:
+            events[ven_id] = [
+                e
+                for e in events[ven_id]
+                if e["active_period"]["dtstart"] + e["active_period"]["duration"]
+                >= now
+            ]
+        if policy.changed(ven_id, now):
+            reregistration_queued.add(ven_id)
+
+        if events_updated.get(ven_id):
+            events_updated[ven_id] = False
+            latencies.extend(t - c for c in created_at.pop(ven_id, []))
+            # oadrCreatedEvent
+            requests += 1
+        elif ven_id in reregistration_queued:
+            # oadrRequestReregistration を受け取って再登録し、新しい周期を受け取る
+            reregistration_queued.discard(ven_id)
+            current_freq[ven_id] = policy.poll_freq_for(ven_id, now).total_seconds()
+            reregistrations += 1
+            requests += 2
+        heapq.heappush(queue, (t + current_freq[ven_id], 1, ven_id))
+
+    return {
+        "requests_per_sec": requests / horizon,
+        "reregistrations": reregistrations,
+        "deliveries": len(latencies),
+        "latency_mean": statistics.fmean(latencies) if latencies else 0.0,
+        "latency_p99": (
+            statistics.quantiles(latencies, n=100)[98]
+            if len(latencies) >= 2
+            else 0.0
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vens", type=int, default=1000)
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument(
+        "--events-per-hour", type=float, default=0.1, help="VEN あたりのイベント発生率"
+    )
+    parser.add_argument("--lead-time", type=float, default=600.0)
+    parser.add_argument("--duration", type=float, default=1800.0)
+    parser.add_argument(
+        "--updates", type=int, default=2, help="イベントあたりの変更回数"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    horizon = args.hours * 3600
+    policies = {
+        "fixed 10s": FixedPolicy(timedelta(seconds=10)),
+        "fixed 60s": FixedPolicy(timedelta(seconds=60)),
+        "adaptive 5s/60s": PollFrequencyPolicy(
+            fast_freq=timedelta(seconds=5), idle_freq=timedelta(seconds=60)
+        ),
+        "adaptive 5s/120s": PollFrequencyPolicy(
+            fast_freq=timedelta(seconds=5), idle_freq=timedelta(seconds=120)
+        ),
+    }
+
+    print(
+        f"{'policy':<18}{'req/s':>10}{'rereg':>8}{'delivered':>11}"
+        f"{'mean[s]':>10}{'p99[s]':>10}"
+    )
+    for name, policy in policies.items():
+        result = simulate(
+            policy,
+            vens=args.vens,
+            horizon=horizon,
+            event_rate=args.events_per_hour / 3600,
+            lead_time=args.lead_time,
+            duration=args.duration,
+            updates=args.updates,
+            seed=args.seed,
+        )
+        print(
+            f"{name:<18}{result['requests_per_sec']:>10.1f}"
+            f"{result['reregistrations']:>8}{result['deliveries']:>11}"
+            f"{result['latency_mean']:>10.1f}{result['latency_p99']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
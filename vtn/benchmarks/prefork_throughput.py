@@ -0,0 +1,195 @@
+"""
+プリフォーク（複数ワーカー）構成のスループット測定。
+
+ワーカー数ごとに serve_prefork で VTN を起動し、一定時間 oadrPoll を送り続けて
+スループット（req/s）と応答時間（p50 / p99）を出力する。
+ワーカー間の状態は SharedStore に置く（本番構成と同じ）。
+--baseline を付けると、状態をプロセス内に置いた 1 ワーカー（VTN_WORKERS=1 と同じ）も測定する。
+
+mTLS は ALB 互換ヘッダーで模擬する。ベンチマーク用の自己署名証明書をその場で作り、
+すべての VEN がその証明書で登録済みとして扱う。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.prefork_throughput --workers 1 2 4 --duration 10 --concurrency 64 --baseline
+"""
+
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import time
+from urllib.parse import quote
+
+import aiohttp
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from openleadr.messaging import create_message
+
+from openleadr_impl.cluster.prefork import serve_prefork
+from openleadr_impl.server import STATE_NAMESPACES, MyOpenADRServer
+from openleadr_impl.state.store import SharedStore
+from openleadr_impl.utils import utils as myUtils
+
+PATH = "/OpenADR2/Simple/2.0b/OadrPoll"
+
+
+def make_client_certificate():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench-ven")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return quote(cert.public_bytes(serialization.Encoding.PEM).decode())
+
+
+def make_server_factory(port, fingerprint, state_store):
+    def ven_lookup(ven_id):
+        return {
+            "ven_id": ven_id,
+            "fingerprint": fingerprint,
+            "registration_id": f"reg-{ven_id}",
+        }
+
+    def make_server(index):
+        return MyOpenADRServer(
+            vtn_id="bench-vtn",
+            http_host="127.0.0.1",
+            http_port=port,
+            ven_lookup=ven_lookup,
+            state_store=state_store,
+        )
+
+    return make_server
+
+
+def run_vtn(port, workers, fingerprint, shared=True):
+    # VTN 側の標準出力（起動バナー）は結果の表示と混ざるため捨てる
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    if not shared:
+        serve_prefork(make_server_factory(port, fingerprint, None), workers=workers)
+        return
+    state_store = SharedStore(STATE_NAMESPACES)
+    try:
+        serve_prefork(
+            make_server_factory(port, fingerprint, state_store), workers=workers
+        )
+    finally:
+        state_store.shutdown()
+
+
+async def wait_until_listening(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"The VTN did not start listening on port {port}")
+
+
+async def load(port, leaf, vens, concurrency, duration):
+    bodies = [create_message("oadrPoll", ven_id=f"ven-{i}") for i in range(vens)]
+    headers = {"Content-Type": "application/xml", "X-Amzn-Mtls-Clientcert-Leaf": leaf}
+    url = f"http://127.0.0.1:{port}{PATH}"
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(session, offset):
+        nonlocal errors
+        i = offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with session.post(
+                    url, data=bodies[i % vens], headers=headers
+                ) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            i += concurrency
+
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency)
+    ) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*[client(session, i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests_per_sec": len(latencies) / elapsed,
+        "errors": errors,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": statistics.quantiles(latencies, n=100)[98] if len(latencies) >= 2 else 0.0,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--vens", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="also measure one worker that keeps the state in process",
+    )
+    args = parser.parse_args()
+
+    leaf = make_client_certificate()
+    fingerprint = myUtils._fingerprint_from_leaf(leaf)
+    print(f"CPU: {os.cpu_count()}")
+    print(f"{'workers':<10}{'store':<8}{'req/s':>10}{'errors':>8}{'p50[ms]':>10}{'p99[ms]':>10}")
+    runs = [(1, False)] if args.baseline else []
+    runs += [(workers, True) for workers in args.workers]
+    for workers, shared in runs:
+        port = free_port()
+        vtn = multiprocessing.get_context("fork").Process(
+            target=run_vtn, args=(port, workers, fingerprint, shared)
+        )
+        vtn.start()
+        try:
+            asyncio.run(wait_until_listening(port))
+            result = asyncio.run(
+                load(port, leaf, args.vens, args.concurrency, args.duration)
+            )
+        finally:
+            os.kill(vtn.pid, signal.SIGTERM)
+            vtn.join()
+        print(
+            f"{workers:<10}{'shared' if shared else 'memory':<8}"
+            f"{result['requests_per_sec']:>10.0f}{result['errors']:>8}"
+            f"{result['p50'] * 1000:>10.1f}{result['p99'] * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+push 配信の fan-out ベンチマーク。
+
+ローカルに VEN 群の代わりとなる HTTP サーバーを立て、MyOpenADRServer.push_events() で
+全 VEN に oadrDistributeEvent を push したときの「イベント登録から各 VEN に届くまでの時間」を測る。
+同時送信数（--concurrency）ごとに、全体の所要時間・配信遅延（p50 / p99）・poll へのフォールバック数を出力する。
+
+VEN 側の応答遅延は --delay、失敗率は --failure-rate で模擬する。失敗した VEN は再試行の後、
+events_updated が残り次回の oadrPoll で配信される（fallback として数える）。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.push_fanout --vens 10000 --concurrency 50 100 200
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from openleadr_impl.delivery.push import PushTransport
+from openleadr_impl.server import MyOpenADRServer
+
+
+class StandInVenFleet:
+    """
+    /{ven_id}/{service} で全 VEN の push を受ける 1 台の HTTP サーバー。
+    """
+
+    def __init__(self, delay, failure_rate, seed):
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.delivered_at = {}
+        self.app = web.Application()
+        self.app.router.add_post("/{ven_id}/{service}", self.handle)
+
+    async def handle(self, request):
+        await request.read()
+        if self.delay:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.delay))
+        if self.rng.random() < self.failure_rate:
+            return web.Response(status=503)
+        self.delivered_at.setdefault(request.match_info["ven_id"], time.perf_counter())
+        return web.Response(status=200)
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+async def run_once(base_url, fleet, vens, concurrency, retries):
+    transport = PushTransport(
+        endpoint_lookup=lambda ven_id: f"{base_url}/{ven_id}",
+        max_concurrency=concurrency,
+        connection_limit=concurrency,
+        retries=retries,
+        retry_backoff=0.05,
+    )
+    server = MyOpenADRServer(
+        vtn_id="bench-vtn", ven_lookup=lambda ven_id: None, push_transport=transport
+    )
+    ven_ids = [f"ven-{i}" for i in range(vens)]
+    dtstart = datetime.now(timezone.utc) + timedelta(minutes=5)
+    for ven_id in ven_ids:
+        server.add_event(
+            ven_id=ven_id,
+            signal_name="simple",
+            signal_type="level",
+            intervals=[
+                {
+                    "dtstart": dtstart,
+                    "duration": timedelta(minutes=30),
+                    "signal_payload": 1,
+                }
+            ],
+            callback=on_event_response,
+        )
+
+    fleet.delivered_at = {}
+    await transport.start()
+    try:
+        started = time.perf_counter()
+        results = await server.push_events(ven_ids)
+        elapsed = time.perf_counter() - started
+    finally:
+        await transport.close()
+
+    latencies = sorted(at - started for at in fleet.delivered_at.values())
+    return {
+        "elapsed": elapsed,
+        "delivered": sum(results.values()),
+        "fallback": len(results) - sum(results.values()),
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": (
+            statistics.quantiles(latencies, n=100)[98] if len(latencies) >= 2 else 0.0
+        ),
+    }
+
+
+async def run(args):
+    fleet = StandInVenFleet(args.delay, args.failure_rate, args.seed)
+    runner = web.AppRunner(fleet.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    base_url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    print(
+        f"{'concurrency':<13}{'total[s]':>10}{'msg/s':>10}{'delivered':>11}"
+        f"{'fallback':>10}{'p50[s]':>10}{'p99[s]':>10}"
+    )
+    try:
+        for concurrency in args.concurrency:
+            result = await run_once(
+                base_url, fleet, args.vens, concurrency, args.retries
+            )
+            print(
+                f"{concurrency:<13}{result['elapsed']:>10.2f}"
+                f"{args.vens / result['elapsed']:>10.0f}"
+                f"{result['delivered']:>11}{result['fallback']:>10}"
+                f"{result['p50']:>10.2f}{result['p99']:>10.2f}"
+            )
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vens", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument(
+        "--delay", type=float, default=0.005, help="VEN の平均応答遅延（秒）"
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="VEN が 503 を返す確率"
+    )
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger("openleadr").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
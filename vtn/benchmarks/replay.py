@@ -0,0 +1,184 @@
+"""
+TrafficRecorder で記録したリクエストを VTN に再生し、応答を記録時の応答と比べる。
+
+記録の受信時刻の間隔を --speed で割った間隔で送る（--speed 1 で記録と同じ速さ、10 で 10 倍速、0 で待たずに送る）。
+終了後にメッセージの種類ごとの件数・応答時間（p50 / p99 / p999）と、記録時の応答と一致しなかった件数を出力し、
+不一致のうち --show-diffs 件の差分を表示する。
+応答は parse_message した内容で比べ、実行ごとに変わる項目（--ignore で追加できる）は除く。
+
+再生先の VTN は記録時と同じ状態から始めること（登録から記録していれば、空の VTN でよい）。
+署名の検証を有効にした VTN では、再生したメッセージは署名の時刻や nonce で拒否されることがある。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.replay captures/worker-* --url http://127.0.0.1:8080 --speed 10
+"""
+
+import argparse
+import asyncio
+import collections
+import difflib
+import pprint
+import time
+
+import aiohttp
+from openleadr.messaging import parse_message
+
+from benchmarks.ven_fleet import Stats
+from openleadr_impl.capture.recorder import read_capture
+from openleadr_impl.messaging import sniff_message_type
+
+# 実行ごとに値が変わる項目
+VOLATILE_KEYS = {
+    "created_date_time",
+    "modification_date_time",
+    "report_request_id",
+    "request_id",
+}
+
+# 再生時に送り直さないヘッダー
+SKIPPED_HEADERS = {"content-length", "host", "transfer-encoding"}
+
+
+def normalize(text, ignore):
+    """
+    応答を比較できる形にする。OpenADR のメッセージでなければ本文をそのまま返す。
+    """
+    if not text:
+        return text
+    try:
+        message_type, payload = parse_message(text.encode())
+    except Exception:
+        return text
+    return message_type, _strip(payload, ignore)
+
+
+def _strip(value, ignore):
+    if isinstance(value, dict):
+        return {
+            key: _strip(item, ignore) for key, item in value.items() if key not in ignore
+        }
+    if isinstance(value, list):
+        return [_strip(item, ignore) for item in value]
+    return value
+
+
+class Replay:
+    def __init__(self, args):
+        self.args = args
+        self.ignore = VOLATILE_KEYS | set(args.ignore)
+        self.stats = Stats()
+        self.matched = collections.Counter()
+        self.mismatched = collections.Counter()
+        self.diffs = []
+        self.max_lag = 0.0
+
+    async def send(self, session, semaphore, record, message_type):
+        headers = {
+            name: value
+            for name, value in record["headers"]
+            if name.lower() not in SKIPPED_HEADERS
+        }
+        started = time.perf_counter()
+        ok = False
+        text = None
+        try:
+            async with semaphore:
+                async with session.post(
+                    self.args.url.rstrip("/") + record["path"],
+                    data=record["body"],
+                    headers=headers,
+                ) as response:
+                    text = await response.text()
+                    ok = response.status == 200
+        except aiohttp.ClientError:
+            pass
+        self.stats.record(message_type, time.perf_counter() - started, ok)
+        self.compare(message_type, record, text)
+
+    def compare(self, message_type, record, text):
+        expected = normalize(record["response"], self.ignore)
+        actual = normalize(text, self.ignore) if text is not None else None
+        if expected == actual:
+            self.matched[message_type] += 1
+            return
+        self.mismatched[message_type] += 1
+        if len(self.diffs) < self.args.show_diffs:
+            self.diffs.append(
+                (
+                    f"{message_type} {record['path']} (recorded at {record['t']:.3f})",
+                    difflib.unified_diff(
+                        pprint.pformat(expected, width=100).splitlines(),
+                        pprint.pformat(actual, width=100).splitlines(),
+                        "recorded",
+                        "replayed",
+                        lineterm="",
+                    ),
+                )
+            )
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        tasks = set()
+        first = None
+        started = loop.time()
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.args.timeout)
+        ) as session:
+            for record in read_capture(self.args.paths):
+                if first is None:
+                    first = record["t"]
+                if self.args.speed > 0:
+                    due = started + (record["t"] - first) / self.args.speed
+                    delay = due - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        # 送信が記録の間隔に追いつかなかった時間
+                        self.max_lag = max(self.max_lag, -delay)
+                message_type = sniff_message_type(record["body"]) or "unknown"
+                task = asyncio.create_task(
+                    self.send(session, semaphore, record, message_type)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        return loop.time() - started
+
+    def report(self, elapsed):
+        self.stats.report(elapsed)
+        print(f"max send lag: {self.max_lag * 1000:.1f}ms")
+        print()
+        print(f"{'message':<28}{'matched':>10}{'differed':>10}")
+        for message_type in sorted(self.matched | self.mismatched):
+            print(
+                f"{message_type:<28}{self.matched[message_type]:>10}"
+                f"{self.mismatched[message_type]:>10}"
+            )
+        for title, diff in self.diffs:
+            print()
+            print(title)
+            for line in diff:
+                print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("paths", nargs="+", help="記録ファイルまたはディレクトリ")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--ignore", nargs="*", default=[], help="比較しない項目の名前")
+    parser.add_argument("--show-diffs", type=int, default=5)
+    args = parser.parse_args()
+
+    replay = Replay(args)
+    elapsed = asyncio.run(replay.run())
+    replay.report(elapsed)
+    if sum(replay.mismatched.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
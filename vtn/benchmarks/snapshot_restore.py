@@ -0,0 +1,126 @@
+"""
+サービス状態のスナップショットの保存・復元時間の測定。
+
+VEN ごとにイベント 1 件・レポート要求 1 件（コールバックは partial）を持つ状態を作り、
+Snapshotter で保存（イベントループ上 / fork した子プロセス）と復元を行って、
+それぞれの所要時間とファイルサイズを出力する。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.snapshot_restore --vens 50000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from openleadr import objects
+
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.state.snapshot import CallbackRegistry, Snapshotter
+
+callbacks = CallbackRegistry()
+
+
+@callbacks.register("report.update")
+async def on_update_report(data, r_id, report_specifier_id):
+    pass
+
+
+@callbacks.register("event.response")
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def build_server(vens):
+    server = MyOpenADRServer(vtn_id="bench-vtn", ven_lookup=lambda ven_id: None)
+    report_service = server.services["report_service"]
+    dtstart = datetime.now(timezone.utc) + timedelta(minutes=10)
+    for i in range(vens):
+        ven_id = f"ven-{i}"
+        server.add_event(
+            ven_id=ven_id,
+            signal_name="simple",
+            signal_type="level",
+            intervals=[
+                {
+                    "dtstart": dtstart,
+                    "duration": timedelta(minutes=30),
+                    "signal_payload": 1,
+                }
+            ],
+            callback=on_event_response,
+        )
+        report_request_id = f"rr-{i}"
+        report_service.requested_reports[ven_id] = [
+            objects.ReportRequest(
+                report_request_id=report_request_id,
+                report_specifier=objects.ReportSpecifier(
+                    report_specifier_id="TelemetryUsage",
+                    granularity=timedelta(seconds=60),
+                    report_back_duration=timedelta(seconds=0),
+                    specifier_payloads=[
+                        objects.SpecifierPayload(r_id="r1", reading_type="Direct Read")
+                    ],
+                ),
+            )
+        ]
+        report_service.report_callbacks[(report_request_id, "r1")] = partial(
+            on_update_report, r_id="r1", report_specifier_id="TelemetryUsage"
+        )
+        report_service.created_reports[ven_id] = [report_request_id]
+    return server
+
+
+async def measure(args):
+    server = build_server(args.vens)
+    with tempfile.TemporaryDirectory() as directory:
+        snapshotter = Snapshotter(os.path.join(directory, "state.snapshot"), callbacks)
+
+        size = await snapshotter.save(server)
+        in_loop = snapshotter.last_duration
+
+        # fork した子プロセスで保存する間にイベントループがどれだけ止まるか
+        lag = 0.0
+
+        async def ticker():
+            nonlocal lag
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lag = max(lag, time.perf_counter() - started - 0.01)
+
+        task = asyncio.create_task(ticker())
+        await snapshotter.save_in_background(server)
+        task.cancel()
+        in_background = snapshotter.last_duration
+
+        restore_times = []
+        for _ in range(args.repeat):
+            restored = MyOpenADRServer(vtn_id="bench-vtn", ven_lookup=lambda ven_id: None)
+            started = time.perf_counter()
+            snapshotter.restore(restored)
+            restore_times.append(time.perf_counter() - started)
+            assert len(restored.events) == args.vens
+
+    print(f"VENs: {args.vens}  snapshot: {size / 1e6:.1f} MB")
+    print(f"save (in the event loop):  {in_loop:.3f}s")
+    print(f"save (forked child):       {in_background:.3f}s  max loop lag {lag * 1000:.1f}ms")
+    print(f"restore (best of {args.repeat}):      {min(restore_times):.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vens", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger("openleadr").setLevel(logging.ERROR)
+    asyncio.run(measure(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+処理段階ごとのマイクロベンチマークと、ベースラインとの比較。
+
+リクエスト処理の各段階（XML スキーマ検証、パース、メッセージ生成、証明書のフィンガープリント計算、
+レポート・イベントのサービス処理、timedelta の整形）を単独で繰り返し実行し、1 回あたりの時間を測る。
+結果は JSON で保存でき、--baseline に指定した JSON（既定は benchmarks/baseline.json）と比べて
+--threshold を超えて遅くなった段階があれば終了コード 1 で終わる。
+
+ベースラインは測定したマシンに依存するため、比較は同じマシン（CI の同じランナーなど）で行うこと。
+ベースラインを更新する場合は --update-baseline を付けて実行する。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.stages
+    python -m benchmarks.stages --output results.json --threshold 0.2
+    python -m benchmarks.stages --update-baseline
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+from datetime import timedelta, timezone
+from types import SimpleNamespace
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from openleadr import enums, objects, utils
+from openleadr.messaging import create_message, parse_message, validate_xml_schema
+
+from benchmarks.prefork_throughput import make_client_certificate
+from benchmarks.ven_fleet import report_template
+from openleadr_impl.patch.patch_timedelta import timedeltaformat_with_zero
+from openleadr_impl.service.event_service import EventService
+from openleadr_impl.service.report_service import ReportService
+from openleadr_impl.utils import utils as myUtils
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def make_signing_pair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench-vtn")])
+    now = datetime.datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        cert.public_bytes(serialization.Encoding.PEM),
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ),
+    )
+
+
+def make_event(i):
+    # 過去の日時だと完了扱いになり、最初の oadrRequestEvent で取り除かれてしまう
+    dtstart = datetime.datetime.now(timezone.utc) + timedelta(days=1, hours=i)
+    return objects.Event(
+        event_descriptor=objects.EventDescriptor(
+            event_id=f"event-{i}",
+            modification_number=0,
+            market_context="oadr://bench",
+            event_status=enums.EVENT_STATUS.FAR,
+            created_date_time=dtstart,
+            priority=0,
+        ),
+        active_period=objects.ActivePeriod(dtstart=dtstart, duration=timedelta(minutes=30)),
+        event_signals=[
+            objects.EventSignal(
+                intervals=[
+                    objects.Interval(
+                        dtstart=dtstart, duration=timedelta(minutes=30), signal_payload=1
+                    )
+                ],
+                signal_name="simple",
+                signal_type="level",
+                signal_id=f"signal-{i}",
+            )
+        ],
+        targets=[objects.Target(ven_id="ven-1")],
+    )
+
+
+def update_report_message(report_request_id, values):
+    dtstart = datetime.datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return create_message(
+        "oadrUpdateReport",
+        request_id="req-1",
+        ven_id="ven-1",
+        reports=[
+            objects.Report(
+                report_request_id=report_request_id,
+                report_specifier_id="TelemetryUsage",
+                report_name=enums.REPORT_NAME.TELEMETRY_USAGE,
+                intervals=[
+                    objects.ReportInterval(
+                        dtstart=dtstart + timedelta(seconds=i),
+                        report_payload=objects.ReportPayload(r_id="energy", value=float(i)),
+                    )
+                    for i in range(values)
+                ],
+            )
+        ],
+    ).encode()
+
+
+async def on_register_report(report):
+    return [
+        (description["r_id"], on_update_report, timedelta(seconds=60))
+        for description in report["report_descriptions"]
+    ]
+
+
+async def on_update_report(data):
+    pass
+
+
+def build_stages():
+    """
+    {段階の名前: 引数なしの callable（コルーチン関数でもよい）} を返す。
+    """
+    stages = {}
+
+    update_report = update_report_message("rr-1", 10)
+    stages["validate_xml_schema"] = lambda: validate_xml_schema(update_report)
+    stages["parse_message"] = lambda: parse_message(update_report)
+
+    events = [make_event(0)]
+    stages["create_message.unsigned"] = lambda: create_message(
+        "oadrDistributeEvent", request_id="req-1", vtn_id="vtn", events=events
+    )
+    cert, key = make_signing_pair()
+    stages["create_message.signed"] = lambda: create_message(
+        "oadrDistributeEvent",
+        cert=cert,
+        key=key,
+        request_id="req-1",
+        vtn_id="vtn",
+        events=events,
+    )
+
+    request = SimpleNamespace(
+        headers={"X-Amzn-Mtls-Clientcert-Leaf": make_client_certificate()}
+    )
+    stages["certificate_fingerprint.cached"] = (
+        lambda: myUtils.get_certificate_fingerprint_from_alb_header(request)
+    )
+    leaf = request.headers["X-Amzn-Mtls-Clientcert-Leaf"]
+    stages["certificate_fingerprint.uncached"] = (
+        lambda: myUtils._fingerprint_from_leaf.__wrapped__(leaf)
+    )
+
+    report_service = ReportService("bench-vtn")
+    report_service.on_register_report = on_register_report
+    _type, register_payload = parse_message(
+        create_message(
+            "oadrRegisterReport",
+            request_id="req-1",
+            ven_id="ven-1",
+            reports=report_template(60),
+        ).encode()
+    )
+
+    def register_report():
+        # 登録済みレポートが繰り返しのたびに溜まらないよう、毎回初めての登録として扱う
+        report_service.registered_reports.clear()
+        return report_service.register_report(register_payload)
+
+    stages["ReportService.register_report"] = register_report
+    report_service.report_callbacks[("rr-1", "energy")] = on_update_report
+    _type, update_payload = parse_message(update_report)
+    stages["ReportService.update_report"] = lambda: report_service.update_report(
+        update_payload
+    )
+
+    for count in (1, 10, 100):
+        event_service = EventService("bench-vtn")
+        event_service.events["ven-1"] = [make_event(i) for i in range(count)]
+        stages[f"EventService.request_event.{count}"] = partial_request_event(
+            event_service
+        )
+
+    stages["timedeltaformat_with_zero"] = lambda: (
+        timedeltaformat_with_zero(timedelta(0)),
+        timedeltaformat_with_zero(timedelta(minutes=5)),
+    )
+    return stages
+
+
+def partial_request_event(event_service):
+    return lambda: event_service.request_event({"ven_id": "ven-1"})
+
+
+async def measure(fn, rounds, min_round_seconds):
+    """
+    fn を繰り返し実行し、1 回あたりの時間（rounds 回の計測の最小値）を返す。
+    """
+
+    async def run(number):
+        started = time.perf_counter()
+        for _ in range(number):
+            result = fn()
+            if asyncio.iscoroutine(result):
+                await result
+        return time.perf_counter() - started
+
+    # 1 回の計測が min_round_seconds 以上になる回数を決める
+    number = 1
+    while True:
+        elapsed = await run(number)
+        if elapsed >= min_round_seconds:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_round_seconds / elapsed * 1.2))
+    return min([elapsed] + [await run(number) for _ in range(rounds - 1)]) / number
+
+
+async def run_stages(only, rounds, min_round_seconds):
+    results = {}
+    for name, fn in build_stages().items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        results[name] = await measure(fn, rounds, min_round_seconds)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    結果を表示し、ベースラインより threshold を超えて遅い段階の名前のリストを返す。
+    """
+    regressions = []
+    print(f"{'stage':<40}{'us/op':>12}{'baseline':>12}{'change':>10}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<40}{seconds * 1e6:>12.1f}{'-':>12}{'-':>10}")
+            continue
+        change = seconds / base - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(
+            f"{name:<40}{seconds * 1e6:>12.1f}{base * 1e6:>12.1f}{change:>+10.1%}{marker}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--output", help="結果を保存する JSON ファイル")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-round-seconds", type=float, default=0.2)
+    parser.add_argument("--only", nargs="*", help="名前にこの文字列を含む段階だけを測る")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    # ベンチマーク中のログ出力（登録の警告など）を測定に含めない
+    utils.logger.setLevel("ERROR")
+    results = asyncio.run(run_stages(args.only, args.rounds, args.min_round_seconds))
+    document = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "stages": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(document, file, indent=2)
+            file.write("\n")
+        print(f"Updated {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["stages"]
+    except FileNotFoundError:
+        baseline = {}
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stage(s) are more than {args.threshold:.0%} slower")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
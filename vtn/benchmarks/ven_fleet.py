@@ -0,0 +1,386 @@
+"""
+VEN 群を模擬した負荷試験。
+
+MyOpenADRServer をローカルのポートで起動し、N 台の VEN を同じプロセスの asyncio タスクとして動かす。
+各 VEN は登録（oadrQueryRegistration / oadrCreatePartyRegistration）、レポート登録
+（oadrRegisterReport / oadrCreatedReport）を行ったあと、VTN が指定した周期で oadrPoll を送り、
+届いたイベントに oadrCreatedEvent で応答し、テレメトリを oadrUpdateReport で送り続ける。
+mTLS は ALB 互換ヘッダー（X-Amzn-Mtls-Clientcert-Leaf）で模擬する。
+
+終了後にメッセージの種類ごとの件数、スループット、応答時間（p50 / p99 / p999）を出力する。
+
+実行例（vtn ディレクトリで）:
+    python -m benchmarks.ven_fleet --vens 1000 --duration 60 --poll-interval 10
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import logging
+import random
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+from openleadr import OpenADRClient, enums, objects
+from openleadr.messaging import create_message, parse_message
+
+from benchmarks.prefork_throughput import make_client_certificate
+from openleadr_impl.server import MyOpenADRServer
+
+PREFIX = "/OpenADR2/Simple/2.0b"
+VTN_ID = "fleet-vtn"
+
+
+class Stats:
+    """
+    メッセージの種類ごとの応答時間とエラー数。
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def record(self, message_type, seconds, ok):
+        self.latencies[message_type].append(seconds)
+        if not ok:
+            self.errors[message_type] += 1
+
+    def report(self, elapsed):
+        print(
+            f"{'message':<28}{'count':>8}{'errors':>8}{'req/s':>9}"
+            f"{'p50[ms]':>10}{'p99[ms]':>10}{'p999[ms]':>10}"
+        )
+        total = 0
+        for message_type in sorted(self.latencies):
+            latencies = sorted(self.latencies[message_type])
+            total += len(latencies)
+            print(
+                f"{message_type:<28}{len(latencies):>8}{self.errors[message_type]:>8}"
+                f"{len(latencies) / elapsed:>9.1f}"
+                f"{percentile(latencies, 0.50) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.999) * 1000:>10.1f}"
+            )
+        print(f"{'total':<28}{total:>8}{sum(self.errors.values()):>8}{total / elapsed:>9.1f}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Fleet:
+    """
+    VTN 側の設定（登録の受け付け、レポートの要求、イベントの追加）と、模擬 VEN 群。
+    """
+
+    def __init__(self, args, port):
+        self.args = args
+        self.url = f"http://127.0.0.1:{port}{PREFIX}"
+        self.stats = Stats()
+        self.vens = {}
+        # 証明書の生成は重いため、certificates 枚を VEN で使い回す
+        self.leaves = [
+            make_client_certificate() for _ in range(min(args.vens, args.certificates))
+        ]
+        self.server = MyOpenADRServer(
+            vtn_id=VTN_ID,
+            http_host="127.0.0.1",
+            http_port=port,
+            requested_poll_freq=timedelta(seconds=args.poll_interval),
+            ven_lookup=self.ven_lookup,
+        )
+        self.server.add_handler(
+            "on_create_party_registration", self.on_create_party_registration
+        )
+        self.server.add_handler("on_register_report", self.on_register_report)
+        self.reports = report_template(args.report_interval)
+
+    # --- VTN 側 ---
+
+    def ven_lookup(self, ven_id):
+        return self.vens.get(ven_id)
+
+    async def on_create_party_registration(self, info):
+        ven_id = info["ven_name"]
+        self.vens[ven_id] = {
+            "ven_id": ven_id,
+            "ven_name": ven_id,
+            "fingerprint": info["fingerprint"],
+            "registration_id": f"reg-{ven_id}",
+        }
+        return ven_id, f"reg-{ven_id}"
+
+    async def on_register_report(self, report):
+        return [
+            (
+                description["r_id"],
+                on_update_report,
+                timedelta(seconds=self.args.report_interval),
+            )
+            for description in report["report_descriptions"]
+        ]
+
+    async def add_events(self):
+        """
+        event_interval 秒ごとに、ランダムに選んだ VEN にイベントを追加する。
+        """
+        while True:
+            await asyncio.sleep(self.args.event_interval)
+            ven_ids = list(self.vens)
+            for ven_id in random.sample(
+                ven_ids, int(len(ven_ids) * self.args.event_fraction)
+            ):
+                self.server.add_event(
+                    ven_id=ven_id,
+                    signal_name="simple",
+                    signal_type="level",
+                    intervals=[
+                        {
+                            "dtstart": datetime.now(timezone.utc) + timedelta(minutes=5),
+                            "duration": timedelta(minutes=30),
+                            "signal_payload": 1,
+                        }
+                    ],
+                    callback=on_event_response,
+                )
+
+    # --- VEN 側 ---
+
+    async def send(self, session, headers, service, message_type, **payload):
+        body = create_message(message_type, **payload)
+        started = time.perf_counter()
+        ok = False
+        try:
+            async with session.post(
+                f"{self.url}/{service}", data=body, headers=headers
+            ) as response:
+                content = await response.read()
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            content = b""
+        self.stats.record(message_type, time.perf_counter() - started, ok)
+        if not ok or not content:
+            return None, {}
+        return parse_message(content)
+
+    async def run_ven(self, session, index, deadline):
+        ven_name = f"ven-{index}"
+        headers = {
+            "Content-Type": "application/xml",
+            "X-Amzn-Mtls-Clientcert-Leaf": self.leaves[index % len(self.leaves)],
+        }
+        # 起動時の登録集中を避けるため、最初の oadrPoll 周期の中でばらけて開始する
+        await asyncio.sleep(random.uniform(0, self.args.poll_interval))
+
+        await self.send(
+            session,
+            headers,
+            "EiRegisterParty",
+            "oadrQueryRegistration",
+            request_id=f"q-{index}",
+        )
+        _type, registration = await self.send(
+            session,
+            headers,
+            "EiRegisterParty",
+            "oadrCreatePartyRegistration",
+            request_id=f"r-{index}",
+            ven_name=ven_name,
+            http_pull_model=True,
+            xml_signature=False,
+            report_only=False,
+            profile_name="2.0b",
+            transport_name="simpleHttp",
+        )
+        ven_id = registration.get("ven_id")
+        if ven_id is None:
+            return
+        poll_interval = registration["requested_oadr_poll_freq"].total_seconds()
+
+        for report in self.reports:
+            report.created_date_time = datetime.now(timezone.utc)
+        _type, registered = await self.send(
+            session,
+            headers,
+            "EiReport",
+            "oadrRegisterReport",
+            request_id=f"rr-{index}",
+            ven_id=ven_id,
+            reports=self.reports,
+        )
+        report_request_ids = [
+            report_request["report_request_id"]
+            for report_request in registered.get("report_requests") or []
+        ]
+        if report_request_ids:
+            await self.send(
+                session,
+                headers,
+                "EiReport",
+                "oadrCreatedReport",
+                ven_id=ven_id,
+                response={
+                    "response_code": 200,
+                    "response_description": "OK",
+                    "request_id": registered["response"]["request_id"],
+                },
+                pending_reports=[
+                    {"report_request_id": report_request_id}
+                    for report_request_id in report_request_ids
+                ],
+            )
+
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        next_report = loop.time() + random.uniform(0, self.args.report_interval)
+        sequence = 0
+        while loop.time() < deadline:
+            await asyncio.sleep(max(0.0, min(next_poll, next_report) - loop.time()))
+            if loop.time() >= deadline:
+                break
+            if loop.time() >= next_poll:
+                next_poll += poll_interval
+                message_type, payload = await self.send(
+                    session, headers, "OadrPoll", "oadrPoll", ven_id=ven_id
+                )
+                if message_type == "oadrDistributeEvent":
+                    await self.acknowledge(session, headers, ven_id, payload)
+            else:
+                next_report += self.args.report_interval
+                sequence += 1
+                await self.send(
+                    session,
+                    headers,
+                    "EiReport",
+                    "oadrUpdateReport",
+                    request_id=f"u-{index}-{sequence}",
+                    ven_id=ven_id,
+                    reports=[
+                        telemetry(report_request_id)
+                        for report_request_id in report_request_ids
+                    ],
+                )
+
+    async def acknowledge(self, session, headers, ven_id, payload):
+        request_id = payload.get("request_id")
+        await self.send(
+            session,
+            headers,
+            "EiEvent",
+            "oadrCreatedEvent",
+            ven_id=ven_id,
+            response={
+                "response_code": 200,
+                "response_description": "OK",
+                "request_id": request_id,
+            },
+            event_responses=[
+                {
+                    "response_code": 200,
+                    "response_description": "OK",
+                    "request_id": request_id,
+                    "event_id": event["event_descriptor"]["event_id"],
+                    "modification_number": event["event_descriptor"]["modification_number"],
+                    "opt_type": "optIn",
+                }
+                for event in payload.get("events", [])
+            ],
+        )
+
+
+async def on_update_report(data):
+    pass
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def report_template(report_interval):
+    """
+    VEN が登録するレポート（電力量の TELEMETRY_USAGE 1 系列）。openleadr の VEN 実装で組み立てる。
+    """
+    client = OpenADRClient(ven_name="template", vtn_url="http://127.0.0.1")
+    client.add_report(
+        callback=lambda: 0.0,
+        resource_id="meter",
+        measurement="energy_real",
+        report_specifier_id="TelemetryUsage",
+        r_id="energy",
+        sampling_rate=timedelta(seconds=report_interval),
+        unit="Wh",
+    )
+    return client.reports
+
+
+def telemetry(report_request_id):
+    now = datetime.now(timezone.utc)
+    return objects.Report(
+        report_request_id=report_request_id,
+        report_specifier_id="TelemetryUsage",
+        report_name=enums.REPORT_NAME.TELEMETRY_USAGE,
+        intervals=[
+            objects.ReportInterval(
+                dtstart=now,
+                report_payload=objects.ReportPayload(r_id="energy", value=random.random()),
+            )
+        ],
+    )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run(args):
+    fleet = Fleet(args, free_port())
+    # VTN の起動バナーは結果の表示と混ざるため捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        await fleet.server.run()
+    events = asyncio.create_task(fleet.add_events())
+    try:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + args.duration
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=args.connections)
+        ) as session:
+            await asyncio.gather(
+                *[fleet.run_ven(session, i, deadline) for i in range(args.vens)]
+            )
+        elapsed = loop.time() - started
+    finally:
+        events.cancel()
+        await fleet.server.stop()
+
+    print(f"VENs: {args.vens} (registered {len(fleet.vens)})  duration: {elapsed:.1f}s")
+    fleet.stats.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vens", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--poll-interval", type=float, default=10.0)
+    parser.add_argument("--report-interval", type=float, default=30.0)
+    parser.add_argument("--event-interval", type=float, default=20.0)
+    parser.add_argument("--event-fraction", type=float, default=0.1)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--certificates", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.getLogger("openleadr").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
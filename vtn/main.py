@@ -1,15 +1,52 @@
 # vtn.py
+import time
+
+# 起動時間の計測の起点（import の時間も含めるため、他の import より前に取る）
+_started = time.perf_counter()
+
 from aiohttp import web
 import asyncio
 from datetime import datetime, timezone, timedelta
 from functools import partial
-from openleadr import enable_default_logging
 import logging
+import os
+import signal
+import sys
 
-import openleadr_impl.patch.patch_timedelta
-from openleadr_impl.server import MyOpenADRServer
+from openleadr import utils
 
-enable_default_logging()
+import openleadr_impl.patch.patch_timedelta
+from openleadr_impl.capture.recorder import TrafficRecorder
+from openleadr_impl.cluster.migration import add_migration_routes
+from openleadr_impl.cluster.prefork import serve_prefork
+from openleadr_impl.control.admission import AdmissionController
+from openleadr_impl.control.deadline import HandlerDeadlines
+from openleadr_impl.control.fair_scheduler import FairScheduler
+from openleadr_impl.control.idempotency import IdempotencyCache
+from openleadr_impl.control.load_monitor import LoadMonitor
+from openleadr_impl.control.poll_frequency import PollFrequencyPolicy
+from openleadr_impl.control.rate_limit import RateLimiter
+from openleadr_impl.delivery.push import PushTransport
+from openleadr_impl.diagnostics.logs import JsonFormatter, QueueLogHandler, SamplingFilter
+from openleadr_impl.diagnostics.loop_monitor import LoopMonitor, add_loop_monitor_routes
+from openleadr_impl.diagnostics.memory import add_memory_routes
+from openleadr_impl.diagnostics.metrics import VtnMetrics, add_metrics_routes
+from openleadr_impl.diagnostics.profiler import add_profiler_routes
+from openleadr_impl.diagnostics.tracing import SpanExporter, Tracer
+from openleadr_impl.registry.liveness import LivenessTracker
+from openleadr_impl.registry.ven_registry import VenRegistry
+from openleadr_impl.repository.ven_repository import VenRepository
+from openleadr_impl.server import STATE_NAMESPACES, MyOpenADRServer
+from openleadr_impl.state.snapshot import CallbackRegistry, Snapshotter
+from openleadr_impl.startup import StartupTimer, prewarm
+from openleadr_impl.state.store import SharedStore
+
+logger = logging.getLogger("openleadr")
+telemetry_logger = logging.getLogger("openleadr.telemetry")
+telemetry_sampler = None
+
+# スナップショットにはコールバックを名前で保存する（再起動後に同じ名前の関数に結び直す）
+callbacks = CallbackRegistry()
 
 # 1) 登録を許可（ven_name が "ven123" の時だけ）
 
@@ -113,87 +150,301 @@ async def on_register_report(report: dict):
     return results
 
 
-def ven_lookup(ven_id):
-    return {
-        "ven_id": "ven_001",
-        "ven_name": "ven123",
-        "fingerprint": "82:9E:30:9D:F3:58:18:D9:04:BA:09:97:58:0B:FF:24:BA:CD:8B:1B:18:EA:59:AD:56:F4:54:B0:64:B9:38:59",
-        "registration_id": "reg_id_123",
-    }
-
-
 # ---- 実際の更新受信 ----
 
 
 # 以降は実際の受信時コールバック（data は [(datetime, value), ...]）
+# 値ごとのログは openleadr.telemetry に出す（configure_logging() で間引きを設定すると telemetry_sampler が入る）
+def _log_report_values(tag, data, report_name, r_id, report_specifier_id, item_name, unit):
+    # ログが無効なら値ごとのレコードを作らない
+    if not telemetry_logger.isEnabledFor(logging.INFO):
+        return
+    sampler = telemetry_sampler
+    for ts, val in data:
+        if sampler is not None and not sampler.sample():
+            continue
+        telemetry_logger.info(
+            "[%s] %s r_id=%s rs_id=%s %s=%s %s",
+            tag,
+            ts,
+            r_id,
+            report_specifier_id,
+            item_name,
+            val,
+            unit,
+            extra={
+                "report_name": report_name,
+                "r_id": r_id,
+                "report_specifier_id": report_specifier_id,
+                "item_name": item_name,
+                "value": val,
+                "unit": unit,
+                "measured_at": ts,
+            },
+        )
+
+
+@callbacks.register("report.usage")
 async def on_update_report_usage(
     data, report_name, r_id, report_specifier_id, item_name, unit
 ):
-    for ts, val in data:
-        print(
-            f"[USAGE] {ts} r_id={r_id} rs_id={report_specifier_id} {item_name}={val} {unit} report_name={report_name}"
-        )
+    _log_report_values(
+        "USAGE", data, report_name, r_id, report_specifier_id, item_name, unit
+    )
 
 
+@callbacks.register("report.status")
 async def on_update_report_status(
     data, report_name, r_id, report_specifier_id, item_name, unit
 ):
-    for ts, val in data:
-        print(
-            f"[STATUS] {ts} r_id={r_id} rs_id={report_specifier_id} {item_name}={val} {unit}"
-        )
+    _log_report_values(
+        "STATUS", data, report_name, r_id, report_specifier_id, item_name, unit
+    )
 
 
+@callbacks.register("report.generic")
 async def on_update_report_generic(
     data, report_name, r_id, report_specifier_id, item_name, unit
 ):
-    for ts, val in data:
-        print(
-            f"[{report_name}] {ts} r_id={r_id} rs_id={report_specifier_id} {item_name}={val} {unit}"
-        )
+    _log_report_values(
+        report_name, data, report_name, r_id, report_specifier_id, item_name, unit
+    )
 
 
 # 3) VENの応答（optIn/optOut）を受け取る
 
 
+@callbacks.register("event.response")
 async def on_event_response(ven_id, event_id, opt_type):
-    print(f"[EVENT-RESP] ven={ven_id} event={event_id} opt={opt_type}")
+    logger.info(
+        "[EVENT-RESP] ven=%s event=%s opt=%s",
+        ven_id,
+        event_id,
+        opt_type,
+        extra={"ven_id": ven_id, "event_id": event_id, "opt_type": opt_type},
+    )
+
+STARTUP_EVENT_ID = "startup-event-ven_001"
+
+
+def _has_event(server, ven_id, event_id):
+    if event_id in server.services["event_service"].completed_event_ids.get(ven_id, ()):
+        return True
+    return any(
+        utils.getmember(event, "event_descriptor.event_id") == event_id
+        for event in server.events.get(ven_id, ())
+    )
+
+
+def create_server(index=0, state_store=None, snapshotter=None, startup_timer=None):
+    # VTN_CAPTURE_DIR を指定すると、受けたリクエストと応答をワーカーごとのディレクトリに記録する
+    # （python -m benchmarks.replay $VTN_CAPTURE_DIR/worker-* で再生できる）
+    capture_dir = os.environ.get("VTN_CAPTURE_DIR")
+
+    # イベントが近い VEN は短い周期、それ以外は長い周期でポーリングさせる
+    poll_frequency_policy = PollFrequencyPolicy(
+        fast_freq=timedelta(seconds=5),
+        idle_freq=timedelta(seconds=60),
+        load_monitor=LoadMonitor(),
+    )
+    # 状態の件数・レポートの値の数・DynamoDB の呼び出し回数と消費キャパシティは、変更のたびに数えておく
+    metrics = VtnMetrics()
+
+    # VEN 情報は DynamoDB から起動時に全件読み込み、以降は差分だけを取り込む
+    ven_registry = VenRegistry(VenRepository(table_name="vens", metrics=metrics))
+    ven_registry.load()
+
+    # VTN_TRACE_DIR（ワーカーごとのファイル）または VTN_TRACE_ENDPOINT（host:port に TCP で送る）を指定すると、
+    # リクエストごとのトレース（ハンドラ・コールバック・DynamoDB の呼び出し）を OTLP JSON で出力する。
+    # VTN_TRACE_SLOW_THRESHOLD 秒を指定すると、それより遅いかエラーになったリクエストのトレースだけを出力する
+    tracer = create_tracer(index)
+
+    # イベントループを 100ms 以上止めたコールバックを、メッセージの種類・ven_id とともに記録する
+    loop_monitor = LoopMonitor(slow_callback_threshold=0.1)
 
-def main():
     server = MyOpenADRServer(
-        vtn_id="myvtn", http_host="0.0.0.0", http_port="8080", ven_lookup=ven_lookup
+        vtn_id="myvtn",
+        http_host="0.0.0.0",
+        http_port="8080",
+        ven_registry=ven_registry,
+        poll_frequency_policy=poll_frequency_policy,
+        # 障害復旧直後の再登録集中に備え、EiRegisterParty の同時処理数を制限する
+        poll_freq_jitter=0.2,
+        admission={
+            "EiRegisterParty": AdmissionController(
+                max_concurrency=50, max_queue=1000, queue_timeout=2.0
+            ),
+            "EiReport": AdmissionController(
+                max_concurrency=100, max_queue=200, queue_timeout=0.5
+            ),
+        },
+        # 過負荷時はイベント応答とポーリングを oadrUpdateReport より先に処理する
+        shared_admission=AdmissionController(
+            max_concurrency=200, max_queue=500, queue_timeout=1.0
+        ),
+        # 1 台の VEN が短い周期でのポーリングやレポートの連続送信で VTN を占有しないようにする
+        rate_limiter=RateLimiter(
+            rates={"oadrPoll": (1.0, 5), "oadrUpdateReport": (2.0, 20)},
+            default_rate=(5.0, 20),
+        ),
+        # 応答が遅れて VEN が再送したレポートやイベント応答は、最初の応答を返して二重に処理しない
+        idempotency_cache=IdempotencyCache(ttl=300.0),
+        # DynamoDB などの遅いハンドラで接続を nginx のタイムアウトまで抱え続けないよう、処理期限を設ける
+        # （登録は途中で止めず期限も設けない。登録は ven_id がなく再送を IdempotencyCache で見分けられないため、
+        # 切り離すと VEN の再送が切り離した登録と並行して動き、別の registration_id を払い出しかねない）
+        handler_deadlines=HandlerDeadlines(
+            deadlines={"oadrUpdateReport": 10.0, "oadrCreatePartyRegistration": None},
+            default=5.0,
+        ),
+        # レポートのコールバックは応答後にワーカーで処理し、大きなレポートを送る VEN が他を待たせないようにする
+        report_scheduler=FairScheduler(workers=4, timeout=30.0),
+        # transport_address を登録している VEN には push でイベントを届ける（届かなければ oadrPoll で配信）
+        push_transport=PushTransport(endpoint_lookup=ven_registry.transport_address),
+        # 最長のポーリング周期（5分）の 3 倍アクセスがなければオフラインとみなす
+        liveness_tracker=LivenessTracker(offline_after=900.0),
+        state_store=state_store,
+        snapshotter=snapshotter,
+        traffic_recorder=(
+            TrafficRecorder(os.path.join(capture_dir, f"worker-{index}"))
+            if capture_dir
+            else None
+        ),
+        loop_monitor=loop_monitor,
+        tracer=tracer,
+        metrics=metrics,
+        startup_timer=startup_timer,
     )
     server.add_handler("on_create_party_registration", on_create_party_registration)
     server.add_handler("on_register_report", on_register_report)
 
     # 起動直後に拾われるイベントを1つ用意（開始=今から60秒後）
-    server.add_event(
-        ven_id="ven_001",
-        signal_name="simple",
-        signal_type="level",
-        intervals=[
-            {
-                "dtstart": datetime.now(timezone.utc) + timedelta(seconds=60),
-                "duration": timedelta(minutes=5),
-                "signal_payload": 1,
-            }
-        ],
-        callback=on_event_response,
-    )
+    # 複数ワーカーの場合はイベントを共有するため、最初のワーカーだけが追加する。
+    # 最初のワーカーが落ちて再起動された場合は、共有の状態に同じイベントがすでにあるため追加しない
+    # （イベント ID を固定して確かめる）
+    if index == 0 and not _has_event(server, "ven_001", STARTUP_EVENT_ID):
+        server.add_event(
+            ven_id="ven_001",
+            event_id=STARTUP_EVENT_ID,
+            signal_name="simple",
+            signal_type="level",
+            intervals=[
+                {
+                    "dtstart": datetime.now(timezone.utc) + timedelta(seconds=60),
+                    "duration": timedelta(minutes=5),
+                    "signal_payload": 1,
+                }
+            ],
+            callback=on_event_response,
+        )
 
 
     async def debug_headers(request):
         for k, v in request.headers.items():
             if k.startswith("X-Amzn-Mtls") or k == "AMZN-MTLS-CLIENT-CERT":
-                print(k, "=", v[:80], "...")
+                logger.info("%s = %s ...", k, v[:80])
         return web.Response(text="ok")
 
 
     server.app.router.add_get("/debug/headers", debug_headers)
 
-    loop = asyncio.get_event_loop()
-    loop.create_task(server.run())
-    loop.run_forever()
+    # VTN_ADMIN_TOKEN を指定すると、稼働中のイベントループをプロファイルする /debug/profile と
+    # ループ遅延・遅いコールバック・リクエスト処理時間を返す /debug/loop、
+    # サービスの状態のメモリ使用量（状態ごと・VEN ごと）と tracemalloc の差分を返す /debug/memory、
+    # Prometheus のテキスト形式でメトリクスを返す /metrics を有効にする
+    # （curl -H "Authorization: Bearer $VTN_ADMIN_TOKEN" "http://localhost:8080/debug/profile?seconds=10"）
+    # 複数ワーカーの場合、/metrics の状態のゲージはすべてのワーカーで共有する値（SharedStore に持つ）、
+    # カウンタとヒストグラムは応答したワーカーが自分で数えた分だけになる
+    admin_token = os.environ.get("VTN_ADMIN_TOKEN")
+    if admin_token:
+        add_profiler_routes(server, admin_token)
+        add_loop_monitor_routes(server, admin_token, loop_monitor)
+        add_memory_routes(server, admin_token)
+        add_metrics_routes(server, admin_token, metrics)
+        # ShardRouter の前段で複数の VTN に VEN を分ける場合に、rebalance() が VEN の状態を移す /cluster/*
+        # （移行中の VEN の凍結はワーカーごとのため、状態を共有する複数ワーカーの構成では有効にしない）
+        if state_store is None:
+            add_migration_routes(server, admin_token)
+    return server
+
+
+def create_tracer(index):
+    trace_dir = os.environ.get("VTN_TRACE_DIR")
+    trace_endpoint = os.environ.get("VTN_TRACE_ENDPOINT")
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+        exporter = SpanExporter(path=os.path.join(trace_dir, f"worker-{index}.jsonl"))
+    elif trace_endpoint:
+        host, _, port = trace_endpoint.rpartition(":")
+        exporter = SpanExporter(address=(host, int(port)))
+    else:
+        return None
+    return Tracer(
+        exporter,
+        sample_rate=float(os.environ.get("VTN_TRACE_SAMPLE_RATE", "1")),
+        slow_threshold=float(os.environ.get("VTN_TRACE_SLOW_THRESHOLD", "0")),
+    )
+
+
+def configure_logging():
+    """
+    openleadr のロガーの出力を QueueLogHandler 経由にする（書式化と stdout への書き込みは専用のスレッドで行う）。
+
+    - VTN_LOG_FORMAT=json で 1 行 1 件の JSON（既定はメッセージのみのテキスト）
+    - VTN_TELEMETRY_LOG_SAMPLE_RATE（0〜1、既定 1）でレポートの値ごとのログを間引く
+    """
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get("VTN_LOG_FORMAT") == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    queue_handler = QueueLogHandler([stream_handler])
+    queue_handler.start()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(queue_handler)
+    global telemetry_sampler
+    sample_rate = float(os.environ.get("VTN_TELEMETRY_LOG_SAMPLE_RATE", "1"))
+    if sample_rate < 1:
+        telemetry_sampler = SamplingFilter(sample_rate)
+    return queue_handler
+
+
+def main():
+    # ログは専用のスレッドで書き出す（終了時は atexit の logging.shutdown() で溜まっている分を書き終える）
+    configure_logging()
+
+    # 起動の段階（import・サーバーの作成・状態の復元・事前準備・待ち受け開始）ごとの時間をログに出す
+    startup_timer = StartupTimer(_started)
+    startup_timer.mark("import")
+
+    # VTN_WORKERS に 2 以上を指定すると、ワーカーを fork して同じポートで待ち受ける
+    # （共有するのはイベントなどの状態だけで、再送の検出・レート制限・オフラインの判定・VEN 情報は
+    # ワーカーごとになる。SharedStore を参照）
+    workers = int(os.environ.get("VTN_WORKERS", "1"))
+    if workers > 1:
+        # テンプレートのコンパイルと boto3 の読み込みを fork 前に済ませ、ワーカー間でメモリを共有する
+        prewarm(modules=("boto3",))
+        state_store = SharedStore(STATE_NAMESPACES)
+        try:
+            serve_prefork(partial(create_server, state_store=state_store), workers)
+        finally:
+            state_store.shutdown()
+        return
+
+    # VTN_SNAPSHOT_PATH を指定すると、状態を定期的に保存し、再起動時に読み込む（単一プロセスの場合のみ）
+    snapshot_path = os.environ.get("VTN_SNAPSHOT_PATH")
+    snapshotter = Snapshotter(snapshot_path, callbacks) if snapshot_path else None
+    server = create_server(snapshotter=snapshotter, startup_timer=startup_timer)
+    startup_timer.mark("create_server")
+    asyncio.run(serve(server))
+
+
+async def serve(server):
+    # SIGTERM / SIGINT で止める（stop() で最後のスナップショットを保存する）
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    await server.run()
+    await stopped.wait()
+    await server.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,195 @@
+import asyncio
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from openleadr import hooks
+
+from openleadr_impl.context import current_request
+
+logger = logging.getLogger("openleadr")
+
+_STOP = object()
+
+
+class TrafficRecorder:
+    """
+    VTN が受けたリクエストを記録する（負荷の再現・性能の回帰試験用。benchmarks/replay.py で再生する）。
+
+    openleadr のフック before_parse / before_respond に登録し、パースまで進んだリクエストの
+    受信時刻・パス・ヘッダー（mTLS のリーフ証明書を含む）・本文と、VTN が返した応答を 1 件 1 行の JSON にする。
+    ファイル書き込みと gzip 圧縮は専用のスレッドで行い、イベントループを止めない。
+    ファイルは directory に capture-<開始時刻>-<連番>.jsonl.gz として作り、圧縮前で max_bytes を超えたら
+    次のファイルに切り替え、max_files を超えた古いファイルは消す。
+    書き込みが追いつかず max_pending 件溜まった場合、それ以降のリクエストは記録せずに dropped に数える。
+
+    exclude_headers（小文字）のヘッダーは記録しない。
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_bytes=64 * 1024 * 1024,
+        max_files=20,
+        max_pending=10_000,
+        flush_interval=1.0,
+        exclude_headers=("authorization", "cookie"),
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.exclude_headers = frozenset(name.lower() for name in exclude_headers)
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._sequence = itertools.count()
+
+    def start(self):
+        """
+        フックを登録し、書き込みスレッドを開始する。
+        """
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._write_loop, name="traffic-recorder", daemon=True
+        )
+        self._thread.start()
+        hooks.register("before_parse", self._before_parse)
+        hooks.register("before_respond", self._before_respond)
+
+    async def close(self):
+        """
+        フックを外し、溜まっている記録を書き終えてファイルを閉じる。
+        """
+        if self._thread is None:
+            return
+        for hook_point, hook in (
+            ("before_parse", self._before_parse),
+            ("before_respond", self._before_respond),
+        ):
+            if hook in hooks.HOOKS[hook_point]:
+                hooks.HOOKS[hook_point].remove(hook)
+        thread, self._thread = self._thread, None
+        await asyncio.get_running_loop().run_in_executor(None, self._stop, thread)
+
+    def _stop(self, thread):
+        self._queue.put(_STOP)
+        thread.join()
+
+    async def _before_parse(self, content):
+        context = current_request.get()
+        if context is None:
+            return
+        request = context.request
+        context.values["capture"] = {
+            "t": context.received_at,
+            "path": getattr(request, "path", ""),
+            "headers": [
+                [name, value]
+                for name, value in request.headers.items()
+                if name.lower() not in self.exclude_headers
+            ],
+            "body": content,
+        }
+
+    async def _before_respond(self, text):
+        context = current_request.get()
+        if context is None:
+            return
+        record = context.values.pop("capture", None)
+        if record is None:
+            return
+        record["response"] = text
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.recorded += 1
+
+    def _write_loop(self):
+        file = None
+        written = 0
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if file is not None:
+                    file.flush()
+                continue
+            if record is _STOP:
+                break
+            record["body"] = record["body"].decode("utf-8", "surrogateescape")
+            line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+            try:
+                if file is None or (written and written + len(line) > self.max_bytes):
+                    if file is not None:
+                        file.close()
+                    file = self._open_next()
+                    written = 0
+                file.write(line)
+                written += len(line)
+            except OSError as err:
+                logger.error("Could not write the traffic capture: %s", err)
+                file = None
+        if file is not None:
+            file.close()
+
+    def _open_next(self):
+        name = (
+            f"capture-{time.strftime('%Y%m%dT%H%M%S')}-{next(self._sequence):04d}.jsonl.gz"
+        )
+        files = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl.gz")))
+        for old in files[: max(0, len(files) + 1 - self.max_files)]:
+            os.remove(old)
+        return gzip.open(os.path.join(self.directory, name), "wb")
+
+
+def capture_files(paths):
+    """
+    paths（ファイルまたはディレクトリ）に含まれる記録ファイルを古い順に返す。
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "capture-*.jsonl.gz"))))
+        else:
+            files.append(path)
+    return files
+
+
+def read_capture(paths):
+    """
+    記録を受信時刻の順に 1 件ずつ返す。body は bytes、headers は (名前, 値) のリスト。
+    paths ごと（prefork のワーカーごとのディレクトリなど）に読み、受信時刻で併合する。
+    異常終了で末尾が途切れたファイルは、読めたところまでを返す。
+    """
+    return heapq.merge(
+        *[_read_files(capture_files([path])) for path in paths],
+        key=lambda record: record["t"],
+    )
+
+
+def _read_files(files):
+    for path in files:
+        try:
+            with gzip.open(path, "rb") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    record["body"] = record["body"].encode("utf-8", "surrogateescape")
+                    yield record
+        except EOFError:
+            logger.warning("The traffic capture %s is truncated", path)
@@ -0,0 +1,304 @@
+"""
+VEN の状態をシャード（VTN プロセス）間で移行する。
+
+構成:
+  - 各シャードは VTN_ADMIN_TOKEN を指定して起動する（main.create_server が add_migration_routes を追加する。
+    状態を SharedStore に置く VTN_WORKERS が 2 以上の構成では追加しない）
+  - VEN の前段に ShardRouter を置く（別プロセス。例: web.run_app(ShardRouter(ring).app, port=8000)）
+  - rebalance() は ShardRouter と同じプロセスから呼ぶ（移行中の VEN へのリクエストを ShardRouter で止めるため）
+
+イベントの追加など、アプリケーションから server の状態を変更する呼び出しは VEN を担当するシャードで
+行うこと（担当は ShardRouter の GET /cluster/shard で引ける）。移行中または移行済みの VEN について
+移動元で呼ぶと VenMigrating を送出する（黙って移動元に状態を残さない）。
+"""
+
+import logging
+import pickle
+
+from aiohttp import web
+from openleadr import utils
+
+from openleadr_impl.cluster.sharding import moved_vens
+from openleadr_impl.diagnostics.metrics import state_counts
+from openleadr_impl.service.vtn_service import MyVTNService
+from openleadr_impl.utils.utils import bearer_token_authorized
+
+logger = logging.getLogger("openleadr")
+
+# VEN ごとに ven_id をキーに持つ状態
+PER_VEN_STATE = {
+    "event_service": ("events", "completed_event_ids"),
+    "poll_service": ("events_updated",),
+    "report_service": ("registered_reports", "requested_reports", "created_reports"),
+}
+# イベント ID をキーに持つ状態
+PER_EVENT_STATE = ("event_callbacks", "event_opt_types", "event_delivery_callbacks")
+
+
+class VenMigrating(Exception):
+    """
+    移行中または別のシャードに移行済みの VEN の状態を、移動元で変更しようとした。
+    """
+
+    def __init__(self, ven_id):
+        super().__init__(
+            f"The VEN '{ven_id}' is being migrated or has moved to another shard; "
+            f"change it on the shard that owns it"
+        )
+        self.ven_id = ven_id
+
+
+def _event_ids(events):
+    return {utils.getmember(event, "event_descriptor.event_id") for event in events}
+
+
+def export_ven_state(server, ven_ids, freeze=False):
+    """
+    VEN のプロセス内の状態（イベント、レポート、送信待ちメッセージ、コールバック）をまとめて dict で返す。
+
+    コールバックもそのまま含まれるため、別プロセスに渡す場合はモジュールレベルの関数
+    （またはその partial）にしておくこと（pickle できる必要がある）。
+
+    freeze=True の場合、以降はこの VEN の状態をアプリケーションから変更できなくする
+    （server.add_event() などが VenMigrating を送出する）。取り消すには thaw_vens() を呼ぶ。
+    """
+    services = server.services
+    vens = {}
+    event_ids = set()
+    report_request_ids = set()
+    with MyVTNService.state_lock:
+        if freeze:
+            server.frozen_vens.update(ven_ids)
+        for ven_id in ven_ids:
+            state = {}
+            for service_name, attributes in PER_VEN_STATE.items():
+                service = services[service_name]
+                for attribute in attributes:
+                    store = getattr(service, attribute)
+                    if ven_id in store:
+                        state[f"{service_name}.{attribute}"] = store[ven_id]
+            ven_queue = services["poll_service"].outbound_queue.export(ven_id)
+            if ven_queue is not None:
+                state["poll_service.outbound_queue"] = ven_queue
+            vens[ven_id] = state
+            event_ids |= _event_ids(state.get("event_service.events", ()))
+            report_request_ids |= {
+                utils.getmember(report_request, "report_request_id")
+                for report_request in state.get("report_service.requested_reports", ())
+            }
+
+        event_service = services["event_service"]
+        events = {
+            attribute: {
+                event_id: getattr(event_service, attribute)[event_id]
+                for event_id in event_ids
+                if event_id in getattr(event_service, attribute)
+            }
+            for attribute in PER_EVENT_STATE
+        }
+        # report_callbacks のキーは (report_request_id, r_id)。全体を 1 回だけ走査する
+        report_callbacks = {
+            key: callback
+            for key, callback in services["report_service"].report_callbacks.items()
+            if key[0] in report_request_ids
+        }
+    return {"vens": vens, "events": events, "report_callbacks": report_callbacks}
+
+
+def import_ven_state(server, state):
+    """
+    export_ven_state() の結果を取り込む。取り込んだ VEN の既存の状態は置き換えられる。
+    """
+    services = server.services
+    with MyVTNService.state_lock:
+        server.frozen_vens.difference_update(state["vens"])
+        before = state_counts(server, state["vens"])
+        for ven_id, ven_state in state["vens"].items():
+            for service_name, attributes in PER_VEN_STATE.items():
+                service = services[service_name]
+                for attribute in attributes:
+                    key = f"{service_name}.{attribute}"
+                    if key in ven_state:
+                        getattr(service, attribute)[ven_id] = ven_state[key]
+                    else:
+                        getattr(service, attribute).pop(ven_id, None)
+            if "poll_service.outbound_queue" in ven_state:
+                services["poll_service"].outbound_queue.restore(
+                    ven_id, ven_state["poll_service.outbound_queue"]
+                )
+            else:
+                services["poll_service"].outbound_queue.discard(ven_id)
+        event_service = services["event_service"]
+        for attribute, values in state["events"].items():
+            getattr(event_service, attribute).update(values)
+        services["report_service"].report_callbacks.update(state["report_callbacks"])
+        server.metrics.adjust_state(before, state_counts(server, state["vens"]))
+
+
+def forget_ven_state(server, ven_ids):
+    """
+    移行が終わった VEN の状態を削除する。
+    他の VEN がまだ参照しているイベントやレポートのコールバックは残す。
+    VEN は凍結したままにする（移動元でイベントを追加しても VEN には届かないため）。
+    """
+    services = server.services
+    ven_ids = set(ven_ids)
+    with MyVTNService.state_lock:
+        before = state_counts(server, ven_ids)
+        for service_name, attributes in PER_VEN_STATE.items():
+            service = services[service_name]
+            for attribute in attributes:
+                store = getattr(service, attribute)
+                for ven_id in ven_ids:
+                    store.pop(ven_id, None)
+        for ven_id in ven_ids:
+            services["poll_service"].outbound_queue.discard(ven_id)
+
+        event_service = services["event_service"]
+        kept_event_ids = set()
+        for events in event_service.events.values():
+            kept_event_ids |= _event_ids(events)
+        for attribute in PER_EVENT_STATE:
+            store = getattr(event_service, attribute)
+            for event_id in [key for key in store.keys() if key not in kept_event_ids]:
+                del store[event_id]
+
+        report_service = services["report_service"]
+        kept_report_request_ids = {
+            utils.getmember(report_request, "report_request_id")
+            for report_requests in report_service.requested_reports.values()
+            for report_request in report_requests
+        }
+        for key in [
+            key
+            for key in report_service.report_callbacks.keys()
+            if key[0] not in kept_report_request_ids
+        ]:
+            del report_service.report_callbacks[key]
+        server.metrics.adjust_state(before, state_counts(server, ven_ids))
+
+
+def thaw_vens(server, ven_ids):
+    """
+    export_ven_state(freeze=True) で凍結した VEN を元に戻す（移行を取りやめた場合）。
+    """
+    with MyVTNService.state_lock:
+        server.frozen_vens.difference_update(ven_ids)
+
+
+def add_migration_routes(server, token):
+    """
+    VEN の状態を移行するための管理用エンドポイントを server.app に追加する。
+
+    - POST /cluster/export  {"ven_ids": [...]} → 状態（pickle）。VEN は凍結される
+    - POST /cluster/import  状態（pickle）
+    - POST /cluster/forget  {"ven_ids": [...]}
+    - POST /cluster/thaw    {"ven_ids": [...]}（移行を取りやめた場合）
+
+    import は pickle を読み込むため、token を知っている相手（同じクラスタの VTN と運用者）だけが
+    呼べるようにし、外部に公開しないこと。
+    """
+    if not token:
+        raise ValueError("add_migration_routes() requires a token")
+
+    async def export_state(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        ven_ids = (await request.json())["ven_ids"]
+        return web.Response(
+            body=pickle.dumps(export_ven_state(server, ven_ids, freeze=True)),
+            content_type="application/octet-stream",
+        )
+
+    async def import_state(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        state = pickle.loads(await request.read())
+        import_ven_state(server, state)
+        logger.info("Imported the state of %d VENs", len(state["vens"]))
+        return web.json_response({"imported": len(state["vens"])})
+
+    async def forget_state(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        ven_ids = (await request.json())["ven_ids"]
+        forget_ven_state(server, ven_ids)
+        return web.json_response({"forgotten": len(ven_ids)})
+
+    async def thaw(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        ven_ids = (await request.json())["ven_ids"]
+        thaw_vens(server, ven_ids)
+        return web.json_response({"thawed": len(ven_ids)})
+
+    server.app.router.add_post("/cluster/export", export_state)
+    server.app.router.add_post("/cluster/import", import_state)
+    server.app.router.add_post("/cluster/forget", forget_state)
+    server.app.router.add_post("/cluster/thaw", thaw)
+
+
+async def _post(session, url, headers, **kwargs):
+    async with session.post(url, headers=headers, **kwargs) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def rebalance(router, new_ring, ven_ids, token, session=None):
+    """
+    ShardRouter のリングを new_ring に切り替え、担当が変わる VEN の状態を移行する。
+
+    1. router で移動する VEN へのリクエストを止め、転送中のリクエストが終わるのを待つ
+    2. 移動元から状態をコピーし（移動元ではその VEN を凍結する）、移動先に取り込む
+    3. router のリングを切り替え、止めていたリクエストを移動先に流す
+    4. 移動元の状態を削除する
+
+    1 から 3 の間は VEN からのリクエストも、移動元でのアプリケーションからの変更（VenMigrating になる）も
+    受け付けないため、コピーした後の変更が失われることはない。
+    途中で失敗した場合はリングを切り替えずに、移動元の凍結を解き、移動先に取り込んだ状態を削除して
+    例外を送出する（移動元の状態は残る）。
+    戻り値は {(移動元, 移動先): 移行した VEN 数}。
+    """
+    session = session or router._session
+    headers = {"Authorization": f"Bearer {token}"}
+    moves = moved_vens(router.ring, new_ring, ven_ids)
+    moving = [ven_id for moved in moves.values() for ven_id in moved]
+
+    await router.hold(moving)
+    try:
+        imported = []
+        try:
+            for (source, target), moved in moves.items():
+                state = await _post(
+                    session, f"{source.rstrip('/')}/cluster/export", headers, json={"ven_ids": moved}
+                )
+                await _post(session, f"{target.rstrip('/')}/cluster/import", headers, data=state)
+                imported.append((source, target))
+        except BaseException:
+            for (source, target), moved in moves.items():
+                urls = [f"{source.rstrip('/')}/cluster/thaw"]
+                if (source, target) in imported:
+                    urls.append(f"{target.rstrip('/')}/cluster/forget")
+                for url in urls:
+                    try:
+                        await _post(session, url, headers, json={"ven_ids": moved})
+                    except Exception as err:
+                        logger.warning(
+                            "Could not roll back the migration on %s: %s", url, err
+                        )
+            raise
+        router.ring = new_ring
+    finally:
+        router.release(moving)
+
+    for (source, _target), moved in moves.items():
+        async with session.post(
+            f"{source.rstrip('/')}/cluster/forget", json={"ven_ids": moved}, headers=headers
+        ) as response:
+            if response.status != 200:
+                logger.warning(
+                    "Could not remove the migrated state from %s: %s",
+                    source,
+                    response.status,
+                )
+    return {shards: len(moved) for shards, moved in moves.items()}
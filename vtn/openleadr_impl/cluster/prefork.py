@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+import signal
+
+logger = logging.getLogger("openleadr")
+
+
+def serve_prefork(make_server, workers=None):
+    """
+    workers 個のワーカープロセスを fork し、それぞれで MyOpenADRServer を動かす。
+
+    - make_server(index) はワーカー内（fork 後）で呼ばれ、MyOpenADRServer を返す callable
+    - 各ワーカーは SO_REUSEPORT で同じポートを listen し、接続はカーネルがワーカーに振り分ける
+    - どのワーカーがどの VEN のリクエストを受けてもよいよう、状態は SharedStore に置くこと
+      （SharedStore は fork 前に親プロセスで作る）
+    - 異常終了したワーカーは起動し直す。SIGTERM / SIGINT で全ワーカーを止めて戻る
+    """
+    workers = workers or os.cpu_count() or 1
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _run_worker(make_server, index)
+            except BaseException:
+                logger.exception("Worker %d crashed", index)
+            finally:
+                # os._exit() は atexit を通らないため、QueueLogHandler などに溜まっているログをここで書き出す
+                logging.shutdown()
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+    previous = {
+        signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = children.pop(pid, None)
+            if index is not None and not stopping:
+                logger.warning(
+                    "Worker %d (pid %d) exited with code %d, restarting it",
+                    index,
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+                spawn(index)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def _run_worker(make_server, index):
+    # 親プロセスのシグナルハンドラを引き継がない
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    asyncio.run(_serve(make_server, index))
+    return 0
+
+
+async def _serve(make_server, index):
+    server = make_server(index)
+    server.http_reuse_port = True
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    await server.run()
+    logger.info("Worker %d (pid %d) is serving", index, os.getpid())
+    await stopped.wait()
+    await server.stop()
@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import collections
+import hashlib
+import logging
+
+import aiohttp
+from aiohttp import web
+
+from openleadr_impl.messaging import sniff_ven_id
+from openleadr_impl.utils import utils as myUtils
+
+logger = logging.getLogger("openleadr")
+
+# 転送しないヘッダー（hop-by-hop と、aiohttp が付け直すもの）
+_SKIPPED_HEADERS = {
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "content-length",
+    "host",
+}
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    ven_id をシャード（VTN プロセスのベース URL など）に割り当てるコンシステントハッシュ。
+
+    - シャードごとに vnodes 個の仮想ノードをリング上に置き、shard_for() は二分探索で O(log n)
+    - シャードを 1 つ足しても、担当が変わる VEN はおよそ 1 / シャード数だけ
+    """
+
+    def __init__(self, shards=(), vnodes=128):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        self.shards = []
+        for shard in shards:
+            self.add(shard)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def add(self, shard):
+        if shard in self.shards:
+            return
+        self.shards.append(shard)
+        for i in range(self.vnodes):
+            point = _hash(f"{shard}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, shard)
+
+    def remove(self, shard):
+        if shard not in self.shards:
+            return
+        self.shards.remove(shard)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != shard]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def copy(self):
+        ring = HashRing(vnodes=self.vnodes)
+        ring.shards = list(self.shards)
+        ring._points = list(self._points)
+        ring._owners = list(self._owners)
+        return ring
+
+    def shard_for(self, ven_id):
+        if not self._points:
+            raise LookupError("The hash ring has no shards")
+        index = bisect.bisect(self._points, _hash(ven_id)) % len(self._points)
+        return self._owners[index]
+
+
+def moved_vens(old_ring, new_ring, ven_ids):
+    """
+    リングの変更で担当シャードが変わる VEN を {(移動元, 移動先): [ven_id, ...]} で返す。
+    """
+    moves = {}
+    for ven_id in ven_ids:
+        source = old_ring.shard_for(ven_id)
+        target = new_ring.shard_for(ven_id)
+        if source != target:
+            moves.setdefault((source, target), []).append(ven_id)
+    return moves
+
+
+class ShardRouter:
+    """
+    VEN からのリクエストを担当シャードの VTN に転送する小さなリバースプロキシ。
+
+    振り分けのキーは次の順に決める（XML はパースしない）。
+      1. ボディ中の venID
+      2. ven_registry がある場合は、クライアント証明書のフィンガープリントから引いた ven_id
+      3. クライアント証明書のフィンガープリント（登録前の VEN）
+
+    nginx などの前段から使う場合は、GET /cluster/shard?ven_id=... で担当シャードを返す。
+
+    移行中の VEN（hold() から release() まで）へのリクエストは、転送せずに release() まで待たせる。
+    hold_timeout 秒を過ぎた場合は 503 と Retry-After を返す（VEN は次のポーリングで再送する）。
+    """
+
+    def __init__(self, ring, ven_registry=None, timeout=30.0, hold_timeout=10.0):
+        self.ring = ring
+        self.ven_registry = ven_registry
+        self.timeout = timeout
+        self.hold_timeout = hold_timeout
+        self._session = None
+        # 移行中の VEN → release() で set する Event
+        self._held = {}
+        # 転送中のリクエスト数（振り分けのキーごと）
+        self._in_flight = collections.Counter()
+        self._drained = asyncio.Condition()
+        self.app = web.Application()
+        self.app.router.add_get("/cluster/shard", self.lookup)
+        self.app.router.add_post("/{path:.*}", self.forward)
+        self.app.on_startup.append(self._start)
+        self.app.on_cleanup.append(self._close)
+
+    async def _start(self, app):
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def _close(self, app):
+        await self._session.close()
+
+    def routing_key(self, request, content):
+        ven_id = sniff_ven_id(content)
+        if ven_id:
+            return ven_id
+        if not request.headers.get("X-Amzn-Mtls-Clientcert-Leaf"):
+            return None
+        fingerprint = myUtils.get_certificate_fingerprint_from_alb_header(request)
+        if self.ven_registry is not None:
+            ven_info = self.ven_registry.lookup_by_fingerprint(fingerprint)
+            if ven_info is not None:
+                return ven_info["ven_id"]
+        return fingerprint
+
+    async def hold(self, ven_ids):
+        """
+        ven_ids へのリクエストの転送を止め、すでに転送中のリクエストが終わるまで待つ。
+        """
+        for ven_id in ven_ids:
+            self._held.setdefault(ven_id, asyncio.Event())
+        async with self._drained:
+            await self._drained.wait_for(
+                lambda: not any(self._in_flight[ven_id] for ven_id in ven_ids)
+            )
+
+    def release(self, ven_ids):
+        """
+        hold() で止めていたリクエストを、その時点のリングで転送する。
+        """
+        for ven_id in ven_ids:
+            released = self._held.pop(ven_id, None)
+            if released is not None:
+                released.set()
+
+    async def lookup(self, request):
+        ven_id = request.query.get("ven_id")
+        if not ven_id:
+            return web.Response(status=400, text="ven_id is required")
+        return web.json_response({"ven_id": ven_id, "shard": self.ring.shard_for(ven_id)})
+
+    async def forward(self, request):
+        content = await request.read()
+        key = self.routing_key(request, content)
+        if key is None:
+            return web.Response(status=400, text="Could not determine the VEN")
+        released = self._held.get(key)
+        if released is not None:
+            try:
+                await asyncio.wait_for(released.wait(), self.hold_timeout)
+            except asyncio.TimeoutError:
+                return web.Response(
+                    status=503,
+                    headers={"Retry-After": str(int(self.hold_timeout))},
+                    text="The VEN is being migrated",
+                )
+        self._in_flight[key] += 1
+        try:
+            return await self._forward(request, key, content)
+        finally:
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+            if self._held:
+                async with self._drained:
+                    self._drained.notify_all()
+
+    async def _forward(self, request, key, content):
+        shard = self.ring.shard_for(key)
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in _SKIPPED_HEADERS
+        }
+        try:
+            async with self._session.post(
+                f"{shard.rstrip('/')}{request.path_qs}", data=content, headers=headers
+            ) as response:
+                body = await response.read()
+                return web.Response(
+                    body=body,
+                    status=response.status,
+                    headers={
+                        name: value
+                        for name, value in response.headers.items()
+                        if name.lower() not in _SKIPPED_HEADERS
+                    },
+                )
+        except aiohttp.ClientError as err:
+            logger.warning(
+                "Could not forward a request to shard %s: %s: %s",
+                shard,
+                err.__class__.__name__,
+                err,
+            )
+            return web.Response(status=502, text="The VTN shard is unavailable")
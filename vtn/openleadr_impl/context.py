@@ -0,0 +1,25 @@
+import contextvars
+import time
+
+
+class RequestContext:
+    """
+    処理中のリクエストに関する情報。MyVTNService.handler が current_request に設定する。
+
+    openleadr のフック（hooks.call）には本文しか渡されないため、フックからリクエストのヘッダーなどを
+    参照するにはこれを使う。values はフックなどが同じリクエストの処理の間で値を受け渡すための dict。
+    message_type / ven_id はメッセージをパースした後に設定される（それまでは None）。
+    """
+
+    __slots__ = ("request", "received_at", "message_type", "ven_id", "values")
+
+    def __init__(self, request):
+        self.request = request
+        self.received_at = time.time()
+        self.message_type = None
+        self.ven_id = None
+        self.values = {}
+
+
+# フックは asyncio のタスクとして呼ばれるが、タスクは作成時のコンテキストを引き継ぐので同じ値が見える
+current_request = contextvars.ContextVar("current_request", default=None)
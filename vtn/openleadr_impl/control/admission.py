@@ -0,0 +1,123 @@
+import asyncio
+import collections
+import contextlib
+import random
+
+
+class AdmissionRejected(Exception):
+    """
+    同時実行数と待ち行列の上限を超えた、または待ち時間の期限を過ぎたことを表す例外。
+    retry_after は VEN に返す Retry-After（秒）。
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Service is overloaded, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+# サービスごとの既定の優先度（小さいほど優先）。
+# イベントの応答（EiEvent）とポーリング（OadrPoll）を、大量に届く oadrUpdateReport（EiReport）より先に通す。
+DEFAULT_PRIORITIES = {
+    "EiEvent": 0,
+    "OadrPoll": 0,
+    "EiRegisterParty": 1,
+    "EiOpt": 1,
+    "EiReport": 2,
+}
+
+
+class AdmissionController:
+    """
+    同時実行数の上限（max_concurrency）と、期限付きの待ち行列（max_queue / queue_timeout）を持つアドミッション制御。
+
+    - 空きがあれば即座に実行する
+    - 空きがなければ待機し、queue_timeout 秒以内に順番が来なければ AdmissionRejected
+    - 待ち行列は優先度（小さいほど優先）ごとの FIFO で、空いた枠は最も優先度の高い待機者に渡す
+    - 待ち行列が max_queue に達している場合、より優先度の低い待機者がいればその最後尾を押し出し、
+      いなければ待たずに AdmissionRejected
+    - Retry-After は retry_after〜retry_after * 2 秒の乱数とし、再送のタイミングを分散させる
+
+    admitted / shed は優先度ごとの受理数・拒否数。
+    """
+
+    def __init__(self, max_concurrency, max_queue=0, queue_timeout=1.0, retry_after=5):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters = {}
+        self.admitted = collections.Counter()
+        self.shed = collections.Counter()
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _rejected(self, priority):
+        self.shed[priority] += 1
+        return AdmissionRejected(
+            random.randint(self.retry_after, self.retry_after * 2)
+        )
+
+    async def acquire(self, priority=0):
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            self.admitted[priority] += 1
+            return
+        if self.queued >= self.max_queue and not self._displace(priority):
+            raise self._rejected(priority)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(priority, collections.deque()).append(waiter)
+        try:
+            # 順番が来ると release() から枠がそのまま引き渡される
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(priority, waiter)
+            raise self._rejected(priority) from None
+        except asyncio.CancelledError:
+            self._remove_waiter(priority, waiter)
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        self.admitted[priority] += 1
+
+    def _displace(self, priority):
+        """
+        priority より優先度の低い待機者のうち、最も優先度が低く最も新しいものを拒否して待ち行列から外す。
+        """
+        for lower in sorted(self._waiters, reverse=True):
+            if lower <= priority:
+                return False
+            waiters = self._waiters[lower]
+            while waiters:
+                waiter = waiters.pop()
+                if not waiter.done():
+                    waiter.set_exception(self._rejected(lower))
+                    return True
+        return False
+
+    def release(self):
+        for priority in sorted(self._waiters):
+            waiters = self._waiters[priority]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.active -= 1
+
+    def _remove_waiter(self, priority, waiter):
+        try:
+            self._waiters[priority].remove(waiter)
+        except ValueError:
+            pass
+
+    @contextlib.asynccontextmanager
+    async def admit(self, priority=0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,111 @@
+import asyncio
+import collections
+import logging
+
+from openleadr import errors
+
+logger = logging.getLogger("openleadr")
+
+
+class HandlerTimeout(errors.DeploymentError):
+    """
+    ハンドラが期限内に終わらなかったことを表す例外。VEN には OpenADR のエラー応答として返る。
+    ハンドラを切り離した場合、detached はバックグラウンドで動き続けているタスク（キャンセルした場合は None）。
+    """
+
+    def __init__(self, message_type, timeout, detached=None):
+        super().__init__(f"HANDLER TIMEOUT ({message_type}, {timeout}s)")
+        self.message_type = message_type
+        self.timeout = timeout
+        self.detached = detached
+
+
+class HandlerDeadlines:
+    """
+    メッセージの種類ごとのハンドラ（ユーザーのコールバックを含む）の処理期限。
+
+    deadlines は {メッセージの種類: 秒}。deadlines にない種類には default を使い、None なら期限なし。
+    期限を過ぎたハンドラは、detach に含まれる種類なら切り離してバックグラウンドで最後まで動かし
+    （DynamoDB への書き込みなど途中で止めたくない処理向け）、それ以外はキャンセルする。
+    どちらの場合も HandlerTimeout を送出し、リクエストはすぐに終わる。
+
+    切り離す種類は、VEN の再送が切り離した処理と並行してもう一度動かないよう IdempotencyCache の
+    対象にすること（MyOpenADRServer が check_detached_covered() で確かめる）。
+
+    timed_out / cancelled / detached はメッセージの種類ごとの件数（MyOpenADRServer が metrics に登録する）。
+    """
+
+    def __init__(self, deadlines=None, default=None, detach=()):
+        self.deadlines = deadlines or {}
+        self.default = default
+        self.detach = frozenset(detach)
+        self._detached = set()
+        self.timed_out = collections.Counter()
+        self.cancelled = collections.Counter()
+        self.detached = collections.Counter()
+
+    @property
+    def running_detached(self):
+        return len(self._detached)
+
+    def check_detached_covered(self, idempotency_cache):
+        """
+        切り離す種類がすべて idempotency_cache の対象でなければ ValueError を送出する。
+        """
+        covered = idempotency_cache.message_types if idempotency_cache is not None else ()
+        uncovered = sorted(self.detach.difference(covered))
+        if uncovered:
+            raise ValueError(
+                f"Detached handlers must be covered by the idempotency_cache, so that a "
+                f"retry does not run them again alongside the detached one: {uncovered}"
+            )
+
+    def deadline_for(self, message_type):
+        return self.deadlines.get(message_type, self.default)
+
+    async def run(self, message_type, handle):
+        """
+        handle()（コルーチン関数）を期限付きで実行し、その結果を返す。
+        """
+        timeout = self.deadline_for(message_type)
+        if timeout is None:
+            return await handle()
+
+        task = asyncio.ensure_future(handle())
+        try:
+            done, _pending = await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            # リクエスト自体がキャンセルされた場合はハンドラも止める
+            task.cancel()
+            raise
+        if done:
+            return task.result()
+
+        self.timed_out[message_type] += 1
+        if message_type in self.detach:
+            self.detached[message_type] += 1
+            self._detached.add(task)
+            task.add_done_callback(self._finish_detached)
+            logger.warning(
+                "The %s handler did not finish within %ss; "
+                "it keeps running in the background",
+                message_type,
+                timeout,
+            )
+            raise HandlerTimeout(message_type, timeout, detached=task)
+        self.cancelled[message_type] += 1
+        task.cancel()
+        logger.warning(
+            "The %s handler did not finish within %ss and was cancelled",
+            message_type,
+            timeout,
+        )
+        raise HandlerTimeout(message_type, timeout)
+
+    def _finish_detached(self, task):
+        self._detached.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            err = task.exception()
+            logger.error(
+                "A detached handler failed: %s: %s", err.__class__.__name__, err
+            )
@@ -0,0 +1,173 @@
+import asyncio
+import collections
+import contextvars
+import logging
+import time
+
+logger = logging.getLogger("openleadr")
+
+
+class WorkItem:
+    __slots__ = ("ven_id", "cost", "fn", "submitted_at", "context")
+
+    def __init__(self, ven_id, cost, fn, submitted_at, context):
+        self.ven_id = ven_id
+        self.cost = cost
+        self.fn = fn
+        self.submitted_at = submitted_at
+        self.context = context
+
+
+class FairScheduler:
+    """
+    VEN ごとの作業キューを Deficit Round Robin で公平に処理するワーカープール。
+
+    - submit() は VEN のキューに作業（引数なしの callable。コルーチン関数でもよい）を積むだけで、すぐに戻る
+    - workers 個のワーカーが、VEN を順に巡回しながら作業を取り出して実行する
+    - 巡回のたびに VEN には quantum * weight の持ち分が加算され、作業の cost（値の数など）がそれを
+      超えない範囲で実行される。大きな作業を大量に積んだ VEN がいても、他の VEN は 1 巡ごとに順番が回ってくる
+    - VEN ごとの未処理数が max_pending_per_ven を超える作業は受け付けない（submit() が False を返す）
+    - timeout 秒を過ぎたコルーチンの作業はキャンセルする（ワーカーが遅いコールバックに占有されないように）
+    - 作業は submit() を呼んだときのコンテキスト（contextvars）で実行する（リクエストのトレースなどを引き継ぐ）
+
+    served_cost / served_items / wait_seconds / timed_out は VEN ごとの処理量・待ち時間・期限切れ数の累計。
+    """
+
+    def __init__(
+        self,
+        workers=4,
+        quantum=100,
+        max_pending_per_ven=1000,
+        weights=None,
+        timeout=None,
+        clock=time.perf_counter,
+    ):
+        self.workers = workers
+        self.quantum = quantum
+        self.max_pending_per_ven = max_pending_per_ven
+        self.weights = weights or {}
+        self.timeout = timeout
+        self._clock = clock
+        self._queues = {}
+        self._deficits = {}
+        self._active = collections.deque()
+        self._wakeup = asyncio.Event()
+        # 実行中の作業の数
+        self.running = 0
+        self.served_cost = collections.Counter()
+        self.served_items = collections.Counter()
+        self.wait_seconds = collections.Counter()
+        self.timed_out = collections.Counter()
+
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def pending_for(self, ven_id):
+        return len(self._queues.get(ven_id, ()))
+
+    def submit(self, ven_id, fn, cost=1):
+        return self.submit_all(ven_id, [(fn, cost)])
+
+    def submit_all(self, ven_id, work):
+        """
+        [(callable, cost), ...] をまとめて積む。上限を超える場合は 1 件も積まずに False を返す。
+        """
+        queue = self._queues.get(ven_id)
+        pending = len(queue) if queue is not None else 0
+        if pending + len(work) > self.max_pending_per_ven:
+            return False
+        if not work:
+            return True
+        if queue is None:
+            queue = self._queues[ven_id] = collections.deque()
+            self._deficits[ven_id] = self._quantum_for(ven_id)
+            self._active.append(ven_id)
+        now = self._clock()
+        context = contextvars.copy_context()
+        for fn, cost in work:
+            queue.append(WorkItem(ven_id, cost, fn, now, context))
+        self._wakeup.set()
+        return True
+
+    def _quantum_for(self, ven_id):
+        return self.quantum * self.weights.get(ven_id, 1)
+
+    def _next(self):
+        """
+        次に実行する作業を DRR の順で取り出す。なければ None。
+        """
+        while self._active:
+            ven_id = self._active[0]
+            queue = self._queues[ven_id]
+            item = queue[0]
+            if self._deficits[ven_id] < item.cost:
+                # 持ち分が足りなければ次の VEN へ。次に回ってきたときの持ち分を加算しておく
+                self._active.rotate(-1)
+                self._deficits[ven_id] += self._quantum_for(ven_id)
+                continue
+            self._deficits[ven_id] -= item.cost
+            queue.popleft()
+            if not queue:
+                # キューが空になった VEN の持ち分は持ち越さない
+                self._active.popleft()
+                del self._queues[ven_id]
+                del self._deficits[ven_id]
+            return item
+        return None
+
+    async def _worker(self):
+        while True:
+            item = self._next()
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self.wait_seconds[item.ven_id] += self._clock() - item.submitted_at
+            # submit_all() の作業は同じコンテキストを共有するため、作業ごとに複製して互いの変更が見えないようにする
+            context = item.context.copy()
+            self.running += 1
+            try:
+                result = context.run(item.fn)
+                if asyncio.iscoroutine(result):
+                    await asyncio.wait_for(
+                        asyncio.get_running_loop().create_task(result, context=context),
+                        self.timeout,
+                    )
+            except asyncio.TimeoutError:
+                self.timed_out[item.ven_id] += 1
+                logger.warning(
+                    "Scheduled work for ven '%s' did not finish within %ss "
+                    "and was cancelled",
+                    item.ven_id,
+                    self.timeout,
+                )
+            except Exception as err:
+                logger.error(
+                    "Scheduled work for ven '%s' failed: %s: %s",
+                    item.ven_id,
+                    err.__class__.__name__,
+                    err,
+                )
+            finally:
+                self.running -= 1
+            self.served_cost[item.ven_id] += item.cost
+            self.served_items[item.ven_id] += 1
+
+    async def run(self):
+        """
+        workers 個のワーカーを起動し、キャンセルされるまで作業を処理する。
+        """
+        await asyncio.gather(*[self._worker() for _ in range(self.workers)])
+
+    def fairness_index(self, ven_ids=None):
+        """
+        VEN ごとの処理量（cost）に対する Jain の公平性指標（1.0 で完全に公平）。
+        """
+        served = [
+            self.served_cost[ven_id]
+            for ven_id in (ven_ids if ven_ids is not None else self.served_cost)
+        ]
+        if not served or not any(served):
+            return 1.0
+        return sum(served) ** 2 / (len(served) * sum(x * x for x in served))
@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import time
+
+# VEN が応答の遅れで再送し、再処理すると副作用が重複するメッセージ
+DEFAULT_MESSAGE_TYPES = ("oadrUpdateReport", "oadrCreatedEvent", "oadrRegisterReport")
+
+# 最初の処理が失敗したことを待っている重複リクエストに知らせる値
+_FAILED = object()
+
+
+def request_key(message_type, payload):
+    """
+    メッセージを識別するキー。(ven_id, request_id, message_type) を返し、決められない場合は None。
+
+    oadrCreatedEvent の requestID は応答先の oadrDistributeEvent のもので、同じ配信への optIn と optOut や
+    複数のイベントへの応答で共通になる。そのため (requestID, イベントごとの応答の内容（requestID、イベント、
+    modificationNumber、optType）) を request_id の代わりに使う。
+    """
+    ven_id = payload.get("ven_id")
+    if not ven_id:
+        return None
+    request_id = payload.get("request_id") or (payload.get("response") or {}).get(
+        "request_id"
+    )
+    if message_type == "oadrCreatedEvent":
+        event_responses = tuple(
+            (
+                response.get("request_id"),
+                response.get("event_id"),
+                response.get("modification_number"),
+                response.get("opt_type"),
+            )
+            for response in payload.get("event_responses") or ()
+        )
+        if not event_responses:
+            return None
+        request_id = (request_id, event_responses)
+    if not request_id:
+        return None
+    return (ven_id, request_id, message_type)
+
+
+class IdempotencyCache:
+    """
+    再送されたメッセージに、最初の処理で作った応答をそのまま返すためのキャッシュ。
+
+    - キーは (ven_id, request_id, message_type)。対象は message_types のメッセージだけ
+    - 処理中の重複は最初の処理の完了を待ち、同じ応答を受け取る（ハンドラは 1 回しか動かない）
+    - 最初の処理が例外で終わった場合は応答を残さず、待っていた重複のうち 1 件が処理し直す
+    - 最初の処理が期限を過ぎて切り離された場合（HandlerTimeout.detached）は、処理中のまま残し、
+      切り離された処理が終わった時点の結果で重複に応答する（再送で同じ処理を二重に動かさない）
+    - 応答は ttl 秒保持する。登録順（= 期限順）の OrderedDict で持ち、期限切れと
+      max_entries を超えた古いものから捨てる
+    - replayed / executed はメッセージの種類ごとの再送応答数・実処理数
+    """
+
+    def __init__(
+        self,
+        message_types=DEFAULT_MESSAGE_TYPES,
+        ttl=300.0,
+        max_entries=10_000,
+        clock=time.monotonic,
+    ):
+        self.message_types = frozenset(message_types)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self.replayed = collections.Counter()
+        self.executed = collections.Counter()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key_for(self, message_type, payload):
+        if message_type not in self.message_types:
+            return None
+        return request_key(message_type, payload)
+
+    async def run(self, key, execute):
+        """
+        key の応答がキャッシュにあればそれを返し、なければ execute() を待って結果を保存する。
+        """
+        now = self._clock()
+        self._evict(now)
+        entry = self._entries.get(key)
+        while entry is not None:
+            _expires_at, future = entry
+            result = await asyncio.shield(future)
+            if result is not _FAILED:
+                self.replayed[key[2]] += 1
+                return result
+            entry = self._entries.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now + self.ttl, future)
+        self.executed[key[2]] += 1
+        try:
+            result = await execute()
+        except BaseException as err:
+            detached = getattr(err, "detached", None)
+            if detached is not None:
+                detached.add_done_callback(
+                    lambda task: self._finish_detached(key, future, task)
+                )
+            else:
+                self._fail(key, future)
+            raise
+        future.set_result(result)
+        return result
+
+    def _finish_detached(self, key, future, task):
+        if task.cancelled() or task.exception() is not None:
+            self._fail(key, future)
+        else:
+            future.set_result(task.result())
+
+    def _fail(self, key, future):
+        if self._entries.get(key, (None, None))[1] is future:
+            del self._entries[key]
+        future.set_result(_FAILED)
+
+    def _evict(self, now):
+        entries = self._entries
+        while entries:
+            key, (expires_at, _future) = next(iter(entries.items()))
+            if expires_at > now and len(entries) < self.max_entries:
+                break
+            del entries[key]
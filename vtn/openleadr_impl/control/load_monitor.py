@@ -0,0 +1,58 @@
+import asyncio
+
+from openleadr_impl.diagnostics.histogram import Histogram
+
+
+class LoadMonitor:
+    """
+    VTN の負荷状態（リクエスト処理時間・イベントループ遅延）を EWMA で保持するクラス。
+
+    - リクエスト処理時間は MyVTNService.handler から observe_request_latency() で通知される
+      （分布は request_latencies に Histogram として保持する）
+    - イベントループ遅延は run() が sleep の遅れから定期的に計測する
+    - backoff_factor() はしきい値超過の度合いを 1.0 以上の倍率として返す
+    """
+
+    def __init__(
+        self,
+        latency_threshold=0.5,
+        loop_lag_threshold=0.1,
+        alpha=0.2,
+        max_backoff=8.0,
+    ):
+        self.latency_threshold = latency_threshold
+        self.loop_lag_threshold = loop_lag_threshold
+        self.alpha = alpha
+        self.max_backoff = max_backoff
+        self.request_latency = 0.0
+        self.loop_lag = 0.0
+        self.request_latencies = Histogram()
+
+    def observe_request_latency(self, seconds):
+        self.request_latency += self.alpha * (seconds - self.request_latency)
+        self.request_latencies.observe(seconds)
+
+    def observe_loop_lag(self, seconds):
+        self.loop_lag += self.alpha * (seconds - self.loop_lag)
+
+    def backoff_factor(self):
+        """
+        しきい値以下なら 1.0、超過していれば超過率（最大 max_backoff）を返す。
+        """
+        ratio = max(
+            self.request_latency / self.latency_threshold,
+            self.loop_lag / self.loop_lag_threshold,
+        )
+        if ratio <= 1.0:
+            return 1.0
+        return min(ratio, self.max_backoff)
+
+    async def run(self, interval=0.5):
+        """
+        interval 秒ごとに sleep の遅れを計測し、イベントループ遅延として記録する。
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.observe_loop_lag(max(0.0, loop.time() - started - interval))
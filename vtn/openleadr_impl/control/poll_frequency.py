@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+
+from openleadr import enums, utils
+
+
+class PollFrequencyPolicy:
+    """
+    VEN ごとの oadrPoll 周期（requested_oadr_poll_freq）を決定するポリシー。
+
+    - 開始間近（imminent_window 以内）または実施中のイベントがある VEN、
+      未配信のイベント更新がある VEN には fast_freq を返す
+    - それ以外の VEN には idle_freq を返す
+    - load_monitor が過負荷を示している場合は全体の周期を倍率で引き延ばす（上限 max_freq）
+
+    周期は oadrCreatedPartyRegistration の応答時に決まるため、登録・再登録のたびに評価される。
+    登録後に fast_freq と idle_freq のどちらを返すかが変わった VEN には、PollService が oadrPoll の
+    応答で oadrRequestReregistration を送り、新しい周期を渡し直す（changed() を参照）。
+    event_service / poll_service は MyOpenADRServer が設定する。
+    """
+
+    def __init__(
+        self,
+        fast_freq=timedelta(seconds=5),
+        idle_freq=timedelta(seconds=60),
+        max_freq=timedelta(minutes=5),
+        imminent_window=timedelta(minutes=15),
+        load_monitor=None,
+        event_service=None,
+        poll_service=None,
+    ):
+        self.fast_freq = fast_freq
+        self.idle_freq = idle_freq
+        self.max_freq = max_freq
+        self.imminent_window = imminent_window
+        self.load_monitor = load_monitor
+        self.event_service = event_service
+        self.poll_service = poll_service
+        # VEN ごとに、最後に渡した周期が fast_freq だったか
+        self.handed_out = {}
+
+    def poll_freq_for(self, ven_id, now=None):
+        """
+        ven_id に返すポーリング周期を timedelta で返す。
+        ven_id が未確定（初回の oadrQueryRegistration など）の場合は idle_freq を基準にする。
+        """
+        fast = ven_id is not None and self.has_pending_work(ven_id, now)
+        if ven_id is not None:
+            self.handed_out[ven_id] = fast
+        freq = self.fast_freq if fast else self.idle_freq
+
+        if self.load_monitor is not None:
+            freq = freq * self.load_monitor.backoff_factor()
+        return min(freq, max(self.max_freq, self.fast_freq))
+
+    def changed(self, ven_id, now=None):
+        """
+        最後に渡した周期から、fast_freq と idle_freq のどちらを返すかが変わったかを返す。
+        変わっていた場合は新しい方を渡したものとして記録する（再登録を求めるのは一度だけにする）。
+
+        負荷による引き延ばしは比べない（過負荷のときに全 VEN の再登録を招かないため）。
+        このプロセスで周期を渡していない VEN（他のワーカーや移行元で登録した VEN）は False。
+        """
+        fast = self.handed_out.get(ven_id)
+        if fast is None:
+            return False
+        pending = self.has_pending_work(ven_id, now)
+        if pending == fast:
+            return False
+        self.handed_out[ven_id] = pending
+        return True
+
+    def has_pending_work(self, ven_id, now=None):
+        """
+        VEN に未配信のイベント更新、または開始間近・実施中のイベントがあるかを返す。
+        """
+        if self.poll_service is not None and self.poll_service.events_updated.get(
+            ven_id
+        ):
+            return True
+        if self.event_service is None:
+            return False
+
+        events = self.event_service.events.get(ven_id)
+        if not events:
+            return False
+
+        now = now or datetime.now(timezone.utc)
+        for event in events:
+            event_status = utils.getmember(event, "event_descriptor.event_status")
+            if event_status in (
+                enums.EVENT_STATUS.COMPLETED,
+                enums.EVENT_STATUS.CANCELLED,
+            ):
+                continue
+            dtstart = utils.getmember(event, "active_period.dtstart", None)
+            if dtstart is None:
+                continue
+            duration = utils.getmember(event, "active_period.duration", None)
+            duration = duration or timedelta(0)
+            if dtstart - self.imminent_window <= now <= dtstart + duration:
+                return True
+        return False
@@ -0,0 +1,116 @@
+import collections
+import math
+import time
+
+# rates にないメッセージの種類をまとめるバケットとカウンタの名前
+OTHER = "other"
+
+
+class RateLimited(Exception):
+    """
+    VEN がレート制限を超えたことを表す例外。retry_after は VEN に返す Retry-After（秒）。
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many requests, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at", "rejected")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated_at = now
+        self.rejected = 0
+
+
+class RateLimiter:
+    """
+    VEN（証明書のフィンガープリントまたは ven_id）とメッセージの種類ごとのトークンバケットによるレート制限。
+
+    rates は {メッセージの種類: (1 秒あたりの回数, バースト)}。rates にない種類（推定できなかったものを含む）は
+    キーごとに 1 つの OTHER のバケットにまとめ、default_rate で制限する。default_rate が None なら制限しない。
+    種類はパース前にボディから推定するため VEN が任意の名前を書けるが、名前を変えてもバケットもカウンタも増えない。
+
+    - check() は O(1)。トークンは呼び出し時に経過時間から補充する（定期的な補充処理はない）
+    - バケットは最終利用順の OrderedDict で保持し、idle_timeout 秒使われていないもの、
+      または max_buckets を超えた古いものから捨てる
+    - allowed / rejected はメッセージの種類（rates にある種類と OTHER）ごとの通過数・拒否数
+    """
+
+    def __init__(
+        self,
+        rates,
+        default_rate=None,
+        idle_timeout=600.0,
+        max_buckets=100_000,
+        clock=time.monotonic,
+    ):
+        self.rates = rates
+        self.default_rate = default_rate
+        self.idle_timeout = idle_timeout
+        self.max_buckets = max_buckets
+        self._clock = clock
+        self._buckets = collections.OrderedDict()
+        self.allowed = collections.Counter()
+        self.rejected = collections.Counter()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, key, message_type):
+        """
+        1 回分のトークンを消費する。足りなければ RateLimited を送出する。
+        """
+        rate = self.rates.get(message_type)
+        if rate is None:
+            message_type = OTHER
+            rate = self.default_rate
+            if rate is None:
+                return
+        per_second, burst = rate
+        now = self._clock()
+        bucket_key = (key, message_type)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(burst, now)
+            self._buckets[bucket_key] = bucket
+            self._evict(now)
+        else:
+            bucket.tokens = min(
+                burst, bucket.tokens + (now - bucket.updated_at) * per_second
+            )
+            bucket.updated_at = now
+            self._buckets.move_to_end(bucket_key)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.allowed[message_type] += 1
+            return
+        bucket.rejected += 1
+        self.rejected[message_type] += 1
+        raise RateLimited(max(1, math.ceil((1 - bucket.tokens) / per_second)))
+
+    def _evict(self, now):
+        while self._buckets:
+            bucket_key, bucket = next(iter(self._buckets.items()))
+            if (
+                len(self._buckets) <= self.max_buckets
+                and now - bucket.updated_at < self.idle_timeout
+            ):
+                return
+            del self._buckets[bucket_key]
+
+    def offenders(self, n=10):
+        """
+        拒否回数の多いバケットを [((key, メッセージの種類), 拒否回数), ...] で返す。
+        """
+        counts = collections.Counter(
+            {
+                bucket_key: bucket.rejected
+                for bucket_key, bucket in self._buckets.items()
+                if bucket.rejected
+            }
+        )
+        return counts.most_common(n)
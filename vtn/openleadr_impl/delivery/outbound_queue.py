@@ -0,0 +1,138 @@
+import collections
+import contextlib
+
+# oadrPoll で VEN に返すメッセージの優先度（小さいほど先に返す）
+PRIORITIES = {
+    "oadrDistributeEvent": 0,
+    "oadrRequestReregistration": 1,
+    "oadrCancelReport": 2,
+    "oadrCreateReport": 3,
+}
+
+# 未送信のものが複数あっても 1 件送れば足りるメッセージ（coalesce_key 省略時は message_type でまとめる）
+COALESCED_BY_DEFAULT = ("oadrDistributeEvent", "oadrRequestReregistration")
+
+
+class OutboundMessage:
+    __slots__ = ("message_type", "payload", "coalesce_key")
+
+    def __init__(self, message_type, payload, coalesce_key):
+        self.message_type = message_type
+        self.payload = payload
+        self.coalesce_key = coalesce_key
+
+
+class VenQueue:
+    """
+    1 VEN 分の送信待ちメッセージ。優先度ごとの deque と、coalesce_key からメッセージへの索引を持つ。
+    """
+
+    __slots__ = ("queues", "coalesced")
+
+    def __init__(self):
+        self.queues = tuple(collections.deque() for _ in range(len(PRIORITIES)))
+        self.coalesced = {}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues)
+
+
+class OutboundQueue:
+    """
+    VEN ごとの送信待ちメッセージキュー。oadrPoll の応答として 1 件ずつ取り出す。
+
+    - 優先度ごとに deque を持ち、put() / pop() はどちらも O(1)
+    - coalesce_key が同じメッセージが未送信で残っている場合は新たに積まず、ペイロードだけを最新に置き換える
+      （oadrDistributeEvent や oadrRequestReregistration を何度積んでも 1 件にまとまる）
+
+    VEN ごとの状態は store（ven_id → VenQueue の mapping）に置く。SharedStore の名前空間を渡すと
+    ワーカー間で共有できる。その場合に備え、変更のたびに VenQueue を store に代入し直す。
+    """
+
+    def __init__(self, store=None, lock=None):
+        self._queues = store if store is not None else {}
+        self._lock = lock if lock is not None else contextlib.nullcontext()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def put(self, ven_id, message_type, payload=None, coalesce_key=None):
+        """
+        メッセージを積む。既存のメッセージにまとめられた場合は False を返す。
+        """
+        if message_type not in PRIORITIES:
+            raise ValueError(
+                f"The message_type must be one of '{', '.join(PRIORITIES)}', "
+                f"you provided '{message_type}'."
+            )
+        if coalesce_key is None and message_type in COALESCED_BY_DEFAULT:
+            coalesce_key = message_type
+        with self._lock:
+            ven_queue = self._queues.get(ven_id) or VenQueue()
+            message = ven_queue.coalesced.get(coalesce_key)
+            if message is not None:
+                message.payload = payload
+                queued = False
+            else:
+                message = OutboundMessage(message_type, payload, coalesce_key)
+                ven_queue.queues[PRIORITIES[message_type]].append(message)
+                if coalesce_key is not None:
+                    ven_queue.coalesced[coalesce_key] = message
+                queued = True
+            self._queues[ven_id] = ven_queue
+        return queued
+
+    def pop(self, ven_id):
+        """
+        優先度が最も高いメッセージを 1 件取り出す。なければ None。
+
+        送信待ちがない VEN（oadrPoll のほとんど）はロックを取らずに返す。SharedStore では
+        ロックの取得と解放がそれぞれ Manager プロセスとの往復になるため。
+        """
+        if ven_id not in self._queues:
+            return None
+        with self._lock:
+            ven_queue = self._queues.get(ven_id)
+            if ven_queue is None:
+                return None
+            for queue in ven_queue.queues:
+                if queue:
+                    message = queue.popleft()
+                    if message.coalesce_key is not None:
+                        del ven_queue.coalesced[message.coalesce_key]
+                    if len(ven_queue):
+                        self._queues[ven_id] = ven_queue
+                    else:
+                        del self._queues[ven_id]
+                    return message
+            return None
+
+    def pending(self, ven_id):
+        ven_queue = self._queues.get(ven_id)
+        return len(ven_queue) if ven_queue is not None else 0
+
+    def ven_ids(self):
+        """
+        送信待ちメッセージを持つ（持っていた）VEN の ID のリスト。
+        """
+        return list(self._queues.keys())
+
+    def export(self, ven_id):
+        """
+        VEN の送信待ちメッセージ（VenQueue）を返す。なければ None。別プロセスへの移行に使う。
+        """
+        return self._queues.get(ven_id)
+
+    def restore(self, ven_id, ven_queue):
+        """
+        export() で取り出した VenQueue を戻す。既存の送信待ちメッセージは置き換えられる。
+        """
+        with self._lock:
+            self._queues[ven_id] = ven_queue
+
+    def discard(self, ven_id):
+        """
+        VEN の送信待ちメッセージをすべて破棄する。
+        """
+        with self._lock:
+            self._queues.pop(ven_id, None)
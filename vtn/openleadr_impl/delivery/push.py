@@ -0,0 +1,176 @@
+import asyncio
+import logging
+
+import aiohttp
+from openleadr import utils
+
+from openleadr_impl.service.vtn_service import MyVTNService
+
+logger = logging.getLogger("openleadr")
+
+# push 先のサービス（VEN の transport address に付与するパス）
+SERVICE_FOR_MESSAGE = {
+    "oadrDistributeEvent": "EiEvent",
+    "oadrCreateReport": "EiReport",
+    "oadrCancelReport": "EiReport",
+    "oadrRequestReregistration": "EiRegisterParty",
+}
+
+
+class PushTransport:
+    """
+    VTN から VEN のエンドポイントへメッセージを直接 POST する（OpenADR の push モデル）。
+
+    - 共有の aiohttp.ClientSession（keep-alive 付きのコネクションプール）を使う
+    - fan_out() は max_concurrency で同時送信数を制限する
+    - 送信は VEN ごとに timeout / retries で再試行し、最終的に失敗した場合は
+      PollService の送信待ちキューに積み直して次回の oadrPoll で届ける
+
+    endpoint_lookup は ven_id を受け取り、VEN の transport address（URL）か None を返す callable。
+    poll_service / event_service / vtn_id は MyOpenADRServer が設定する。
+    """
+
+    def __init__(
+        self,
+        endpoint_lookup,
+        max_concurrency=100,
+        timeout=5.0,
+        retries=2,
+        retry_backoff=0.5,
+        connection_limit=100,
+        keepalive_timeout=30.0,
+        create_message=None,
+    ):
+        self.endpoint_lookup = endpoint_lookup
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self._create_message = create_message
+        self.vtn_id = None
+        self.poll_service = None
+        self.event_service = None
+        self._session = None
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.connection_limit,
+                    keepalive_timeout=self.keepalive_timeout,
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def create_message(self, message_type, **payload):
+        create_message = self._create_message or MyVTNService._create_message
+        return create_message(message_type, **payload)
+
+    async def send(self, ven_id, message_type, payload=None, fallback=True):
+        """
+        1 VEN にメッセージを送る。届いた場合は True、失敗した場合は False を返す。
+        fallback が True なら、失敗したメッセージを送信待ちキューに積み直す。
+        payload が None の oadrDistributeEvent は送る時点のイベントで組み立て、積み直す場合は None のまま
+        積んで oadrPoll の時点のイベントで組み立てさせる（PollService.poll と同じ）。
+        """
+        address = await utils.await_if_required(self.endpoint_lookup(ven_id))
+        if address:
+            message_payload = payload
+            if payload is None and message_type == "oadrDistributeEvent":
+                response_type, message_payload = await self.event_service.request_event(
+                    {"ven_id": ven_id}
+                )
+                if response_type != message_type:
+                    # 届けるイベントがない
+                    return True
+            if await self._post(address, ven_id, message_type, message_payload):
+                return True
+        if fallback and self.poll_service is not None:
+            self.poll_service.enqueue(ven_id, message_type, payload)
+        return False
+
+    async def _post(self, address, ven_id, message_type, payload):
+        url = f"{address.rstrip('/')}/{SERVICE_FOR_MESSAGE[message_type]}"
+        message = self.create_message(
+            message_type,
+            **{
+                "request_id": utils.generate_id(),
+                "vtn_id": self.vtn_id,
+                "ven_id": ven_id,
+                **(payload or {}),
+            },
+        )
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                async with self._session.post(
+                    url, data=message, headers={"Content-Type": "application/xml"}
+                ) as response:
+                    await response.read()
+                    if response.status == 200:
+                        return True
+                    logger.debug(
+                        "Push of %s to ven '%s' returned %s",
+                        message_type,
+                        ven_id,
+                        response.status,
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                logger.debug(
+                    "Push of %s to ven '%s' failed: %s: %s",
+                    message_type,
+                    ven_id,
+                    err.__class__.__name__,
+                    err,
+                )
+        return False
+
+    async def fan_out(self, ven_ids, message_type, payload_factory=None):
+        """
+        複数の VEN に同じ種類のメッセージを送る。payload_factory は ven_id を受け取りペイロードを返す callable。
+        戻り値は {ven_id: 届いたかどうか}。
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send_one(ven_id):
+            async with semaphore:
+                payload = payload_factory(ven_id) if payload_factory else None
+                return await self.send(ven_id, message_type, payload)
+
+        ven_ids = list(ven_ids)
+        results = await asyncio.gather(*[send_one(ven_id) for ven_id in ven_ids])
+        return dict(zip(ven_ids, results))
+
+    async def distribute_events(self, ven_ids):
+        """
+        内部のイベントキューから oadrDistributeEvent を組み立てて push する。
+        届いた VEN は events_updated を下ろし、届かなかった VEN は events_updated を残して
+        次回の oadrPoll で配信させる。
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def distribute_one(ven_id):
+            async with semaphore:
+                response_type, payload = await self.event_service.request_event(
+                    {"ven_id": ven_id}
+                )
+                if response_type != "oadrDistributeEvent":
+                    return False
+                delivered = await self.send(
+                    ven_id, response_type, payload, fallback=False
+                )
+                if delivered:
+                    self.poll_service.set_events_updated(ven_id, False)
+                return delivered
+
+        ven_ids = list(ven_ids)
+        results = await asyncio.gather(*[distribute_one(ven_id) for ven_id in ven_ids])
+        return dict(zip(ven_ids, results))
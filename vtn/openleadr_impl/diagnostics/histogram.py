@@ -0,0 +1,69 @@
+import bisect
+
+# 秒単位の区間の上限（イベントループ遅延・リクエスト処理時間向け）
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """
+    区間ごとの件数と合計を持つヒストグラム。observe() は区間の二分探索と加算だけで済む。
+
+    bounds は区間の上限（value <= bound の最小の区間に数える）。最後の区間の後ろに +Inf の区間がある。
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        [(上限, 上限以下の件数), ..., (inf, 全件数)] を返す（Prometheus の _bucket と同じ形）。
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        q 分位点を含む区間の上限を返す（区間の分解能での近似）。
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self):
+        return {
+            "buckets": {str(bound): total for bound, total in self.cumulative()},
+            "sum": self.sum,
+            "count": self.count,
+        }
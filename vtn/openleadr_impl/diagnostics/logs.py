@@ -0,0 +1,191 @@
+import collections
+import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import weakref
+
+from openleadr_impl.context import current_request
+
+# LogRecord が標準で持つ属性。これ以外の属性は extra で渡された構造化フィールドとして出力する
+_RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))
+) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    レコードを 1 行の JSON にする。
+
+    time（UTC の ISO 8601）・level・logger・message に加え、extra で渡したフィールドと、
+    リクエストの処理中に記録されたものなら message_type / ven_id を出力する。
+    JSON にできない値（datetime など）は str() にする。
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    max_level 以下のレコードを rate の割合（0〜1）だけ通す。それより重いレコードはすべて通す。
+
+    乱数ではなく通した割合を数えて間引くため、rate=0.1 なら 10 件に 1 件をちょうど通す。
+    ロガーに addFilter() で付けられるが、フィルタはレコードを作った後に呼ばれるため、
+    値ごとにログを出すテレメトリなどではログを出す前に sample() で確かめる方が軽い。
+    """
+
+    def __init__(self, rate, max_level=logging.INFO):
+        super().__init__()
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError("rate must be between 0 and 1")
+        self.rate = rate
+        self.max_level = max_level
+        self.passed = 0
+        self.sampled_out = 0
+        self._credit = 0.0
+
+    def sample(self, level=logging.INFO):
+        """
+        level のログを出すかどうかを返す。
+        """
+        if level > self.max_level:
+            return True
+        self._credit += self.rate
+        if self._credit >= 1.0:
+            self._credit -= 1.0
+            self.passed += 1
+            return True
+        self.sampled_out += 1
+        return False
+
+    def filter(self, record):
+        return self.sample(record.levelno)
+
+
+class QueueLogHandler(logging.Handler):
+    """
+    レコードをキューに入れるだけのハンドラ。書式化と書き込みは専用のスレッドで handlers に渡して行う。
+
+    ロガーに addHandler() して使う。呼び出し元（イベントループ）で行うのはレコードの作成とキュー（deque）への
+    追加だけで、メッセージの % 展開・JSON への変換・ストリームへの書き込みはスレッド側で行う
+    （標準の QueueHandler は呼び出し元で書式化し、queue.Queue のロックと通知でレコードごとにスレッドを起こす）。
+    そのため、ログに渡した引数は後から変更しないこと。
+    リクエストの処理中なら、呼び出し元で current_request の message_type / ven_id をレコードに付ける。
+
+    スレッドは flush_interval 秒ごと、またはキューが max_queue の半分まで溜まったときに起きて、
+    溜まっているレコードをまとめて書く。max_queue 件溜まっている間のレコードは捨てて dropped に数える。
+    close() で溜まっているレコードを書き終えてスレッドを止める（logging.shutdown() からも呼ばれる）。
+    fork した子プロセスではスレッドが引き継がれないため、子プロセスでキューとスレッドを作り直す。
+    """
+
+    def __init__(self, handlers, max_queue=10_000, flush_interval=0.05):
+        super().__init__()
+        self.handlers = list(handlers)
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._records = collections.deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._fork_hook_registered = False
+
+    def start(self):
+        """
+        書き込みスレッドを開始する。
+        """
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._write_loop, name="log-writer", daemon=True
+        )
+        self._thread.start()
+        if not self._fork_hook_registered:
+            os.register_at_fork(
+                after_in_child=functools.partial(_restart_after_fork, weakref.ref(self))
+            )
+            self._fork_hook_registered = True
+
+    def handle(self, record):
+        # deque への追加はスレッドセーフなので、Handler.handle と違ってロックを取らない
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+    def emit(self, record):
+        records = self._records
+        if len(records) >= self.max_queue:
+            self.dropped += 1
+            return
+        context = current_request.get()
+        if context is not None:
+            if context.message_type is not None:
+                record.__dict__.setdefault("message_type", context.message_type)
+            if context.ven_id is not None:
+                record.__dict__.setdefault("ven_id", context.ven_id)
+        records.append(record)
+        if len(records) * 2 >= self.max_queue:
+            self._wakeup.set()
+
+    def _write_loop(self):
+        records = self._records
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._write(records)
+        self._write(records)
+
+    def _write(self, records):
+        if not records:
+            return
+        while records:
+            record = records.popleft()
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        for handler in self.handlers:
+            handler.flush()
+
+    def flush(self):
+        self._wakeup.set()
+
+    def close(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            thread.join()
+        super().close()
+
+    def _restart(self):
+        # 親プロセスで溜まっていたレコードは親プロセスが書く
+        self._records = collections.deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.start()
+
+
+def _restart_after_fork(handler_ref):
+    handler = handler_ref()
+    # 親プロセスで動いていたものだけを作り直す
+    if handler is not None and handler._thread is not None:
+        handler._restart()
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import logging
+import time
+
+from aiohttp import web
+
+from openleadr_impl.context import current_request
+from openleadr_impl.diagnostics.histogram import Histogram
+from openleadr_impl.utils.utils import bearer_token_authorized
+
+logger = logging.getLogger("openleadr")
+
+_original_run = asyncio.events.Handle._run
+
+
+class LoopMonitor:
+    """
+    イベントループの遅延と、ループを長く占有したコールバックを記録する。
+
+    - run() は interval 秒ごとに sleep の遅れを計測し、lag（Histogram）と max_lag に記録する
+    - run() の間は asyncio.events.Handle._run を差し替えて各コールバック（タスクの 1 ステップを含む）の
+      実行時間を測り、slow_callback_threshold 秒を超えたものを slow_callbacks（新しい max_records 件）と
+      slow_callback_counts（コルーチン名ごとの件数）に記録して警告を出す。
+      リクエストの処理中なら、そのメッセージの種類と ven_id も記録する
+      （asyncio のデバッグモードの slow_callback_duration と同じ計測を、デバッグモードの他の負荷なしに行う）
+
+    XML のパースや署名、同期の boto3 呼び出し、レポートのコールバックでの print など、
+    ループを止める処理がどのリクエストで起きたかを調べるのに使う。
+    差し替えはプロセス全体に効くため、同時に run() できる LoopMonitor は 1 つだけ。
+    """
+
+    _active = None
+
+    def __init__(self, interval=0.1, slow_callback_threshold=0.1, max_records=100):
+        self.interval = interval
+        self.slow_callback_threshold = slow_callback_threshold
+        self.lag = Histogram()
+        self.max_lag = 0.0
+        self.slow_callbacks = collections.deque(maxlen=max_records)
+        self.slow_callback_counts = collections.Counter()
+
+    def install(self):
+        """
+        コールバックの計測を始める。
+        """
+        if LoopMonitor._active is not None:
+            raise RuntimeError("Another LoopMonitor is already installed")
+        LoopMonitor._active = self
+        threshold = self.slow_callback_threshold
+        record = self._record_slow_callback
+        perf_counter = time.perf_counter
+
+        def _run(handle):
+            started = perf_counter()
+            _original_run(handle)
+            elapsed = perf_counter() - started
+            if elapsed > threshold:
+                record(handle, elapsed)
+
+        asyncio.events.Handle._run = _run
+
+    def uninstall(self):
+        if LoopMonitor._active is self:
+            asyncio.events.Handle._run = _original_run
+            LoopMonitor._active = None
+
+    def _record_slow_callback(self, handle, elapsed):
+        callback = _describe(handle._callback)
+        context = handle._context.get(current_request) if handle._context else None
+        message_type = context.message_type if context is not None else None
+        ven_id = context.ven_id if context is not None else None
+        self.slow_callbacks.append(
+            {
+                "at": time.time(),
+                "seconds": elapsed,
+                "callback": callback,
+                "message_type": message_type,
+                "ven_id": ven_id,
+            }
+        )
+        self.slow_callback_counts[callback] += 1
+        if message_type:
+            logger.warning(
+                "%s blocked the event loop for %.0fms (%s from %s)",
+                callback,
+                elapsed * 1000,
+                message_type,
+                ven_id,
+            )
+        else:
+            logger.warning(
+                "%s blocked the event loop for %.0fms", callback, elapsed * 1000
+            )
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.install()
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - started - self.interval)
+                self.lag.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+        finally:
+            self.uninstall()
+
+    def as_dict(self):
+        return {
+            "lag": self.lag.as_dict(),
+            "max_lag": self.max_lag,
+            "slow_callback_counts": dict(self.slow_callback_counts),
+            "slow_callbacks": list(self.slow_callbacks),
+        }
+
+
+def _describe(callback):
+    """
+    コールバックの名前。タスクのステップならタスクのコルーチン名。
+    """
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return getattr(coro, "__qualname__", type(coro).__name__)
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+def add_loop_monitor_routes(server, token, monitor):
+    """
+    イベントループの遅延とリクエスト処理時間を返す管理用エンドポイントを server.app に追加する。
+
+    - GET /debug/loop → {"loop": LoopMonitor.as_dict(), "requests": LoadMonitor の値（あれば）}
+
+    Authorization: Bearer <token> が必要。
+    """
+    if not token:
+        raise ValueError("add_loop_monitor_routes() requires a token")
+
+    async def loop_state(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        load_monitor = server.services["event_service"].load_monitor
+        requests = None
+        if load_monitor is not None:
+            requests = {
+                "latency": load_monitor.request_latencies.as_dict(),
+                "latency_ewma": load_monitor.request_latency,
+                "loop_lag_ewma": load_monitor.loop_lag,
+            }
+        return web.json_response({"loop": monitor.as_dict(), "requests": requests})
+
+    server.app.router.add_get("/debug/loop", loop_state)
@@ -0,0 +1,299 @@
+import asyncio
+import collections
+import datetime
+import functools
+import heapq
+import resource
+import sys
+import tracemalloc
+import types
+
+from aiohttp import web
+from openleadr import utils
+
+from openleadr_impl.cluster.migration import PER_EVENT_STATE, PER_VEN_STATE
+from openleadr_impl.server import STATE_LAYOUT
+from openleadr_impl.utils.utils import bearer_token_authorized
+
+# 状態から参照されていても、その状態の大きさには数えないもの（コード・クラス・モジュールなど共有されるもの）
+_SHARED_TYPES = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.CodeType,
+)
+
+
+# 他のオブジェクトを参照しないもの
+_ATOMIC_TYPES = frozenset(
+    (
+        str,
+        bytes,
+        int,
+        float,
+        bool,
+        complex,
+        type(None),
+        datetime.datetime,
+        datetime.date,
+        datetime.timedelta,
+        datetime.timezone,
+    )
+)
+_CONTAINER_TYPES = (list, tuple, set, frozenset, collections.deque)
+_slot_names = {}
+
+
+def deep_size(obj, seen=None, atomic_seen=None):
+    """
+    obj と、そこからたどれるオブジェクトの sys.getsizeof の合計（バイト）を見積もる。
+
+    dict / list / tuple / set / deque の要素、__dict__ と __slots__ の値、partial の引数をたどる。
+    関数・メソッド・クラス・モジュールは共有されるものとして、自身の大きさだけ数えて先をたどらない
+    （メソッドの先のサービスなどを数えないため）。seen を渡すと、複数回の呼び出しで同じオブジェクトを一度だけ数える。
+    atomic_seen を渡すと、文字列や数値などの変更できない値だけを複数回の呼び出しで一度だけ数える
+    （enum の文字列のように多くの値から共有されるものを、値ごとに数えないため）。
+    """
+    if seen is None:
+        seen = set()
+    getsizeof = sys.getsizeof
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        cls = type(obj)
+        if cls in _ATOMIC_TYPES:
+            if atomic_seen is not None:
+                if id(obj) in atomic_seen:
+                    continue
+                atomic_seen.add(id(obj))
+            size += getsizeof(obj)
+            continue
+        size += getsizeof(obj)
+        if isinstance(obj, _SHARED_TYPES):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, _CONTAINER_TYPES):
+            stack.extend(obj)
+        elif isinstance(obj, functools.partial):
+            stack.extend((obj.args, obj.keywords))
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            slots = _slot_names.get(cls)
+            if slots is None:
+                slots = _slot_names[cls] = tuple(
+                    slot
+                    for klass in cls.__mro__
+                    for slot in klass.__dict__.get("__slots__", ())
+                    if slot not in ("__dict__", "__weakref__")
+                )
+            for slot in slots:
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+def _structures(server):
+    """
+    {"サービス名.属性名": [(キー, 値), ...]} を返す。
+    """
+    structures = {
+        f"{service_name}.{attribute}": list(
+            getattr(server.services[service_name], attribute).items()
+        )
+        for service_name, attributes in STATE_LAYOUT.items()
+        for attribute in attributes
+    }
+    outbound_queue = server.services["poll_service"].outbound_queue
+    structures["poll_service.outbound_queue"] = [
+        (ven_id, outbound_queue.export(ven_id)) for ven_id in outbound_queue.ven_ids()
+    ]
+    return structures
+
+
+async def memory_report(server, top_vens=10, chunk=500):
+    """
+    サービスの状態のメモリ使用量の見積もりを dict で返す。
+
+    - structures: 状態ごとの件数（entries）と、キーと値の大きさの合計（bytes。dict 自体は含まない）
+    - vens: 状態を持つ VEN の数と、状態の大きさが上位 top_vens 件の VEN（状態ごとの内訳付き）
+    - max_rss_bytes: プロセスの最大 RSS
+
+    値ごとに deep_size() を 1 回ずつ計算し、VEN ごとの内訳はその結果から集計する。
+    複数の値から共有される文字列などは、最初に見つけた値の分として数える。
+    chunk 件ごとにイベントループに処理を譲るため、計算中に変わった状態は反映されないことがある（見積もりとして使う）。
+    """
+    entry_sizes = {}
+    structures = {}
+    atomic_seen = set()
+    counted = 0
+    for name, items in _structures(server).items():
+        sizes = {}
+        key_bytes = 0
+        for key, value in items:
+            sizes[key] = deep_size(value, atomic_seen=atomic_seen)
+            key_bytes += sys.getsizeof(key)
+            counted += 1
+            if counted % chunk == 0:
+                await asyncio.sleep(0)
+        entry_sizes[name] = sizes
+        structures[name] = {
+            "entries": len(sizes),
+            "bytes": key_bytes + sum(sizes.values()),
+        }
+    ven_sizes = _ven_sizes(server, entry_sizes)
+    return {
+        "structures": structures,
+        "vens": {
+            "count": len(ven_sizes),
+            "top": [
+                {"ven_id": ven_id, "bytes": size, "structures": breakdown}
+                for size, ven_id, breakdown in heapq.nlargest(
+                    top_vens, ven_sizes, key=lambda entry: entry[0]
+                )
+            ],
+        },
+        # Linux の ru_maxrss は KiB 単位
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def _ven_sizes(server, entry_sizes):
+    """
+    VEN ごとの [(大きさ, ven_id, 状態ごとの内訳), ...]。イベント ID やレポート要求 ID をキーにする状態は、
+    それを持つ VEN の分として数える。
+    """
+    event_service = server.services["event_service"]
+    report_service = server.services["report_service"]
+    per_ven = [
+        f"{service_name}.{attribute}"
+        for service_name, attributes in PER_VEN_STATE.items()
+        for attribute in attributes
+    ] + ["poll_service.outbound_queue"]
+
+    # report_callbacks のキーは (report_request_id, r_id)
+    callback_sizes = collections.Counter()
+    for (report_request_id, _r_id), size in entry_sizes[
+        "report_service.report_callbacks"
+    ].items():
+        callback_sizes[report_request_id] += size
+
+    ven_ids = set()
+    for name in per_ven:
+        ven_ids.update(entry_sizes[name])
+
+    result = []
+    for ven_id in ven_ids:
+        breakdown = {
+            name: entry_sizes[name][ven_id] for name in per_ven if ven_id in entry_sizes[name]
+        }
+        event_ids = [
+            utils.getmember(event, "event_descriptor.event_id")
+            for event in event_service.events.get(ven_id, ())
+        ]
+        for attribute in PER_EVENT_STATE:
+            sizes = entry_sizes[f"event_service.{attribute}"]
+            breakdown[f"event_service.{attribute}"] = sum(
+                sizes.get(event_id, 0) for event_id in event_ids
+            )
+        breakdown["report_service.report_callbacks"] = sum(
+            callback_sizes[utils.getmember(report_request, "report_request_id")]
+            for report_request in report_service.requested_reports.get(ven_id, ())
+        )
+        result.append((sum(breakdown.values()), ven_id, breakdown))
+    return result
+
+
+class AllocationTracker:
+    """
+    tracemalloc のスナップショットを取り、前回のスナップショットからの増減を返す（リークの調査用）。
+
+    最初の mark() で tracemalloc を開始する（以降、割り当てのたびに記録する負荷がかかる）。stop() で止める。
+    """
+
+    def __init__(self, frames=1):
+        self.frames = frames
+        self._previous = None
+
+    def mark(self, top=20, group_by="lineno"):
+        """
+        スナップショットを取り、前回の mark() からの増加の大きい順に top 件を返す（初回は空）。
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = None
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        previous, self._previous = self._previous, snapshot
+        if previous is None:
+            return []
+        return [
+            {
+                "location": str(stat.traceback),
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            }
+            for stat in snapshot.compare_to(previous, group_by)[:top]
+        ]
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._previous = None
+
+
+def add_memory_routes(server, token, tracker=None):
+    """
+    状態のメモリ使用量を調べる管理用エンドポイントを server.app に追加する。
+
+    - GET /debug/memory?vens=10           → memory_report()
+    - POST /debug/memory/tracemalloc?top=20 → 前回の POST からの割り当ての増減（初回は tracemalloc の開始）
+    - DELETE /debug/memory/tracemalloc     → tracemalloc を止める
+
+    Authorization: Bearer <token> が必要。
+    """
+    if not token:
+        raise ValueError("add_memory_routes() requires a token")
+    tracker = tracker or AllocationTracker()
+
+    async def report(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        try:
+            top_vens = int(request.query.get("vens", "10"))
+        except ValueError:
+            return web.Response(status=400, text="vens must be an integer")
+        return web.json_response(await memory_report(server, top_vens))
+
+    async def mark(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        try:
+            top = int(request.query.get("top", "20"))
+        except ValueError:
+            return web.Response(status=400, text="top must be an integer")
+        return web.json_response({"diff": tracker.mark(top)})
+
+    async def stop(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        tracker.stop()
+        return web.json_response({"tracing": False})
+
+    server.app.router.add_get("/debug/memory", report)
+    server.app.router.add_post("/debug/memory/tracemalloc", mark)
+    server.app.router.add_delete("/debug/memory/tracemalloc", stop)
@@ -0,0 +1,343 @@
+import math
+import threading
+
+from aiohttp import web
+
+from openleadr_impl.utils.utils import bearer_token_authorized
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    """
+    ラベルの値の組ごとに値を持つカウンタ。inc() は dict の更新だけで済む。
+
+    DynamoDB の呼び出しなど別スレッドからも数えるため、更新はロックの中で行う。
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in list(self.values.items()):
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Gauge(Counter):
+    """
+    増減する値。状態を変更した箇所で inc() / dec() して、出力時に状態をたどらずに済ませる。
+    """
+
+    kind = "gauge"
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self.values[labels] = value
+
+
+class FunctionGauge:
+    """
+    出力のたびに fn() の値を出力するゲージ。fn は他のクラスが持っている数値を返すだけのものにすること。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def samples(self):
+        yield self.name, {}, self.fn()
+
+
+class SharedGauge:
+    """
+    値を SharedStore の名前空間（dict のプロキシ）に持ち、すべてのワーカーで共有するゲージ。
+
+    inc() / dec() は lock の中で読み出しと代入を行う（Manager プロセスとの往復が数回ある）。
+    出力時は値を 1 つ読むだけで、状態はたどらない。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, values, lock):
+        self.name = name
+        self.help = help
+        self.values = values
+        self._lock = lock
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self.values[self.name] = self.values.get(self.name, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def set(self, value, labels=()):
+        self.values[self.name] = value
+
+    def value(self, labels=()):
+        return self.values.get(self.name, 0)
+
+    def samples(self):
+        yield self.name, {}, self.value()
+
+
+class CounterView:
+    """
+    他のクラスが持っている collections.Counter（ラベルの値 → 件数）を、そのままラベル付きのカウンタとして出力する。
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelname, counts):
+        self.name = name
+        self.help = help
+        self.labelname = labelname
+        self.counts = counts
+
+    def samples(self):
+        for label, value in list(self.counts.items()):
+            yield self.name, {self.labelname: label}, value
+
+
+class HistogramMetric:
+    """
+    diagnostics.histogram.Histogram を Prometheus のヒストグラムとして出力する。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, histogram):
+        self.name = name
+        self.help = help
+        self.histogram = histogram
+
+    def samples(self):
+        histogram = self.histogram
+        for bound, total in histogram.cumulative():
+            yield f"{self.name}_bucket", {"le": bound}, total
+        yield f"{self.name}_sum", {}, histogram.sum
+        yield f"{self.name}_count", {}, histogram.count
+
+
+class MetricsRegistry:
+    """
+    メトリクスを登録し、Prometheus のテキスト形式（0.0.4）で出力する。
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"The metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def gauge_function(self, name, help, fn):
+        return self.register(FunctionGauge(name, help, fn))
+
+    def counter_view(self, name, help, labelname, counts):
+        return self.register(CounterView(name, help, labelname, counts))
+
+    def histogram(self, name, help, histogram):
+        return self.register(HistogramMetric(name, help, histogram))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(
+                        f'{key}="{_escape_label(_format_value(label))}"'
+                        for key, label in labels.items()
+                    )
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# 状態の件数を表す VtnMetrics のゲージ（state_counts() のキーと同じ）
+STATE_GAUGES = (
+    "events_active",
+    "events_updated_pending",
+    "event_callbacks_outstanding",
+    "report_callbacks",
+)
+
+
+class VtnMetrics(MetricsRegistry):
+    """
+    VTN の状態の大きさと処理量のメトリクス。
+
+    状態のゲージは、状態を変更する側（EventService / PollService / ReportService と MyOpenADRServer、
+    移行とスナップショットの読み込み）が変更のたびに増減させる。出力時に状態の dict はたどらない。
+    SharedStore を使う（VTN_WORKERS が 2 以上の）場合、ワーカーごとの増減では他のワーカーの変更が
+    反映されない（値が負になることもある）ため、MyOpenADRServer が share_state_gauges() で
+    ゲージの値を SharedStore に移す。カウンタは各ワーカーが自分で数えた分だけになる。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events_active = self.gauge(
+            "vtn_events_active",
+            "Events held for the VENs that have not completed or been cancelled yet.",
+        )
+        self.events_updated_pending = self.gauge(
+            "vtn_events_updated_pending",
+            "VENs whose updated events have not been delivered yet.",
+        )
+        self.event_callbacks_outstanding = self.gauge(
+            "vtn_event_callbacks_outstanding",
+            "Event callbacks waiting for the VEN's oadrCreatedEvent.",
+        )
+        self.report_callbacks = self.gauge(
+            "vtn_report_callbacks",
+            "Report callbacks registered per (report_request_id, r_id).",
+        )
+        self.telemetry_values = self.counter(
+            "vtn_telemetry_values_total",
+            "Report values received in oadrUpdateReport messages.",
+        )
+        self.dynamodb_calls = self.counter(
+            "vtn_dynamodb_calls_total",
+            "DynamoDB API calls.",
+            ("operation", "outcome"),
+        )
+        self.dynamodb_consumed_capacity = self.counter(
+            "vtn_dynamodb_consumed_capacity_units_total",
+            "Capacity units consumed by DynamoDB API calls.",
+            ("table",),
+        )
+
+    def share_state_gauges(self, values, lock):
+        """
+        状態のゲージを、values（SharedStore の名前空間）に値を持つ SharedGauge に置き換える。
+
+        状態を変更する側はこれまでどおり inc() / dec() を呼び、すべてのワーカーの変更が同じ値に反映される。
+        """
+        for attribute in STATE_GAUGES:
+            gauge = getattr(self, attribute)
+            shared = SharedGauge(gauge.name, gauge.help, values, lock)
+            setattr(self, attribute, shared)
+            self._metrics[gauge.name] = shared
+
+    def set_events_updated(self, previous, updated):
+        """
+        events_updated を previous から updated に変えたときに呼ぶ。
+        """
+        if bool(updated) != bool(previous):
+            self.events_updated_pending.inc(1 if updated else -1)
+
+    def record_dynamodb_call(self, operation, response=None, error=None):
+        """
+        DynamoDB の呼び出しの結果を数える（ReturnConsumedCapacity="TOTAL" を付けて呼んだ応答を渡す）。
+        """
+        outcome = "ok" if error is None else error.__class__.__name__
+        self.dynamodb_calls.inc(labels=(operation, outcome))
+        if response is None:
+            return
+        consumed = response.get("ConsumedCapacity")
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        for entry in consumed or ():
+            self.dynamodb_consumed_capacity.inc(
+                entry.get("CapacityUnits", 0), labels=(entry.get("TableName", ""),)
+            )
+
+    def adjust_state(self, before, after):
+        """
+        状態をまとめて変更した（移行・スナップショットの読み込み）前後の state_counts() の差をゲージに反映する。
+        """
+        for attribute, count in after.items():
+            getattr(self, attribute).inc(count - before[attribute])
+
+
+def state_counts(server, ven_ids=None):
+    """
+    ゲージに対応する状態の件数を数える。ven_ids を指定すると、その VEN の events / events_updated だけを数える。
+
+    状態をまとめて変更する処理の前後で呼び、VtnMetrics.adjust_state() に渡す（出力時には使わない）。
+    """
+    event_service = server.services["event_service"]
+    poll_service = server.services["poll_service"]
+    if ven_ids is None:
+        events = event_service.events.items()
+        events_updated = poll_service.events_updated.values()
+    else:
+        events = [(ven_id, event_service.events.get(ven_id)) for ven_id in ven_ids]
+        events_updated = [poll_service.events_updated.get(ven_id) for ven_id in ven_ids]
+    return {
+        "events_active": sum(len(ven_events or ()) for _ven_id, ven_events in events),
+        "events_updated_pending": sum(1 for updated in events_updated if updated),
+        "event_callbacks_outstanding": len(event_service.event_callbacks),
+        "report_callbacks": len(server.services["report_service"].report_callbacks),
+    }
+
+
+def add_metrics_routes(server, token, metrics):
+    """
+    metrics を Prometheus のテキスト形式で返す GET /metrics を server.app に追加する。
+
+    Authorization: Bearer <token> が必要（Prometheus の scrape_config の authorization で渡す）。
+    """
+    if not token:
+        raise ValueError("add_metrics_routes() requires a token")
+
+    async def scrape(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        return web.Response(
+            body=metrics.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    server.app.router.add_get("/metrics", scrape)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        if value.is_integer():
+            return str(int(value)) if abs(value) < 1e15 else repr(value)
+        return repr(value)
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
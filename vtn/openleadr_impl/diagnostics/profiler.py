@@ -0,0 +1,134 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+from openleadr_impl.utils.utils import bearer_token_authorized
+
+logger = logging.getLogger("openleadr")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """
+    イベントループのスレッドのスタックを一定間隔で採取する統計的プロファイラ。
+
+    採取は別スレッドで sys._current_frames() を読むだけで、ループ側には計測用のコードを入れないため、
+    止めずに本番のプロセスで使える（採取のたびに GIL を短時間取る分だけ遅くなる）。
+    各スタックの根元には、採取した時点でループが実行していた asyncio タスクのコルーチン名
+    （タスクの外でコールバックを実行中・待機中なら "loop"）を付ける。
+
+    結果は {"根元;...;末端": 回数} の Counter で、collapsed() で flamegraph.pl や speedscope が読める
+    collapsed stack 形式のテキストにできる。同時に実行できるプロファイルは 1 つだけ。
+    """
+
+    def __init__(self, interval=0.005, max_depth=128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.running = False
+        self._names = {}
+
+    async def profile(self, seconds, interval=None):
+        """
+        seconds 秒の間、このコルーチンを実行しているイベントループを採取する。
+        """
+        if self.running:
+            raise ProfilerBusy("A profile is already running")
+        loop = asyncio.get_running_loop()
+        interval = interval or self.interval
+        self.running = True
+        # 採取スレッドは GIL を取れたときにしか採取できないため、ループのスレッドが GIL を手放す
+        # 間隔を採取間隔まで縮める（そうしないと select など GIL を手放す箇所に採取が偏る）
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, interval))
+        try:
+            return await loop.run_in_executor(
+                None, self._sample, loop, threading.get_ident(), seconds, interval
+            )
+        finally:
+            sys.setswitchinterval(switch_interval)
+            self.running = False
+
+    def _sample(self, loop, thread_id, seconds, interval):
+        stacks = collections.Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            task = asyncio.tasks._current_tasks.get(loop)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._name(frame.f_code))
+                frame = frame.f_back
+            stack.append(_task_name(task))
+            stacks[";".join(reversed(stack))] += 1
+            del frame
+            time.sleep(interval)
+        return stacks
+
+    def _name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = (
+                f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+        return name
+
+
+def _task_name(task):
+    if task is None:
+        return "loop"
+    coro = task.get_coro()
+    return f"task {getattr(coro, '__qualname__', type(coro).__name__)}"
+
+
+def collapsed(stacks):
+    """
+    collapsed stack 形式（1 行に "根元;...;末端 回数"）のテキストにする。
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def add_profiler_routes(server, token, profiler=None, max_seconds=60.0):
+    """
+    稼働中の VTN をプロファイルする管理用エンドポイントを server.app に追加する。
+
+    - GET /debug/profile?seconds=10&interval=0.005 → collapsed stack 形式のテキスト
+
+    Authorization: Bearer <token> が必要。プロファイル中に別の要求が来たら 409 を返す。
+    """
+    if not token:
+        raise ValueError("add_profiler_routes() requires a token")
+    profiler = profiler or SamplingProfiler()
+
+    async def profile(request):
+        if not bearer_token_authorized(request, token):
+            return web.Response(status=403)
+        try:
+            seconds = float(request.query.get("seconds", "10"))
+            interval = float(request.query.get("interval", profiler.interval))
+        except ValueError:
+            return web.Response(status=400, text="seconds and interval must be numbers")
+        if not 0 < seconds <= max_seconds or interval <= 0:
+            return web.Response(
+                status=400, text=f"seconds must be in (0, {max_seconds}]"
+            )
+        try:
+            stacks = await profiler.profile(seconds, interval)
+        except ProfilerBusy as err:
+            return web.Response(status=409, text=str(err))
+        logger.info(
+            "Profiled the event loop for %ss (%d samples)", seconds, sum(stacks.values())
+        )
+        return web.Response(text=collapsed(stacks))
+
+    server.app.router.add_get("/debug/profile", profile)
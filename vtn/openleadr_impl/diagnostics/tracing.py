@@ -0,0 +1,422 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import random
+import socket
+import threading
+import time
+
+logger = logging.getLogger("openleadr")
+
+# OTLP の Span.SpanKind
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# OTLP の Status.StatusCode
+STATUS_ERROR = 2
+
+
+class Span:
+    """
+    処理の区間。Tracer.span() で作り、with を抜けたときに終わる。
+    """
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_span_id",
+        "name",
+        "kind",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "status_message",
+    )
+
+    recording = True
+
+    def __init__(self, trace, parent_span_id, name, kind, attributes):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.status_message = None
+        if attributes:
+            self.set_attributes(attributes)
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def update_name(self, name):
+        self.name = name
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            if value is not None:
+                self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status_message = message
+
+
+class _NonRecordingSpan:
+    """
+    トレースしていないとき（Tracer がない・サンプリングで外れた）のスパン。何も記録しない。
+    """
+
+    __slots__ = ()
+
+    recording = False
+    trace_id = None
+    span_id = None
+
+    def update_name(self, name):
+        pass
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def set_error(self, message):
+        pass
+
+
+NON_RECORDING_SPAN = _NonRecordingSpan()
+_NOT_TRACING = contextlib.nullcontext(NON_RECORDING_SPAN)
+
+
+class _Trace:
+    """
+    1 つのトレース（ルートのスパンとその子孫）。ルートが終わるまで、終わったスパンを溜めておく。
+    """
+
+    __slots__ = ("trace_id", "spans", "kept", "dropped")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans = []
+        # None: ルートが終わっていない、True / False: 出力する / しない
+        self.kept = None
+        self.dropped = 0
+
+
+# 処理中のスパン。asyncio のタスクは作成時のコンテキストを引き継ぐため、子のタスクのスパンも同じトレースに入る
+current_span = contextvars.ContextVar("current_span", default=None)
+
+_active_tracer = None
+
+
+class Tracer:
+    """
+    contextvars でスパンの親子関係をたどり、終わったトレースを exporter に渡す。
+
+    start() でプロセス全体のトレーサーになり、以降 span() / traced() がスパンを記録する（close() まで）。
+    トレースはルートのスパンを作るときに sample_rate の割合で選び、選ばれなかったトレースは子のスパンも記録しない。
+    slow_threshold 秒を指定すると、ルートのスパンがそれより速く、エラーもなかったトレースは出力しない
+    （遅いリクエストの中身だけを調べたい場合）。出力するかどうかはルートが終わったときに決まるため、
+    それまで子のスパンはトレースごとに溜めておく（max_spans_per_trace を超えた分は数えるだけで捨てる）。
+    ルートより後に終わったスパン（応答後に処理されるレポートのコールバックなど）は、トレースを出力した場合だけ出力する。
+    """
+
+    def __init__(
+        self, exporter, sample_rate=1.0, slow_threshold=0.0, max_spans_per_trace=512
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_spans_per_trace = max_spans_per_trace
+        self.exported_traces = 0
+        self.discarded_traces = 0
+
+    def start(self):
+        global _active_tracer
+        self.exporter.start()
+        _active_tracer = self
+
+    async def close(self):
+        """
+        トレースを止め、溜まっているスパンを書き終える。
+        """
+        global _active_tracer
+        if _active_tracer is self:
+            _active_tracer = None
+        await asyncio.get_running_loop().run_in_executor(None, self.exporter.close)
+
+    @contextlib.contextmanager
+    def span(self, name, attributes=None, kind=SPAN_KIND_INTERNAL):
+        parent = current_span.get()
+        if parent is NON_RECORDING_SPAN:
+            yield parent
+            return
+        if parent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                token = current_span.set(NON_RECORDING_SPAN)
+                try:
+                    yield NON_RECORDING_SPAN
+                finally:
+                    current_span.reset(token)
+                return
+            span = Span(_Trace(), None, name, kind, attributes)
+        else:
+            span = Span(parent.trace, parent.span_id, name, kind, attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as err:
+            if span.status_message is None:
+                span.set_error(f"{err.__class__.__name__}: {err}")
+            raise
+        finally:
+            current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span):
+        trace = span.trace
+        if span.parent_span_id is not None:
+            if trace.kept is None:
+                if len(trace.spans) < self.max_spans_per_trace:
+                    trace.spans.append(span)
+                else:
+                    trace.dropped += 1
+            elif trace.kept:
+                self.exporter.export([span])
+            return
+        # ルートのスパンが終わったら、トレースを出力するかどうかを決める
+        trace.kept = (
+            span.duration >= self.slow_threshold or span.status_message is not None
+        )
+        spans, trace.spans = trace.spans, []
+        if not trace.kept:
+            self.discarded_traces += 1
+            return
+        if trace.dropped:
+            span.set_attribute("trace.dropped_spans", trace.dropped)
+        spans.append(span)
+        self.exporter.export(spans)
+        self.exported_traces += 1
+
+
+def span(name, attributes=None, kind=SPAN_KIND_INTERNAL):
+    """
+    トレース中なら name のスパンを記録する context manager を返す。with の値はスパン
+    （トレースしていなければ何も記録しない NON_RECORDING_SPAN）。
+
+        with tracing.span("DynamoDB.scan", {"db.system": "dynamodb"}, SPAN_KIND_CLIENT) as span:
+            ...
+    """
+    tracer = _active_tracer
+    if tracer is None:
+        return _NOT_TRACING
+    return tracer.span(name, attributes, kind)
+
+
+def enabled():
+    """
+    トレース中（start() した Tracer がある）かどうか。
+    """
+    return _active_tracer is not None
+
+
+def get_current_span():
+    """
+    処理中のスパン（なければ NON_RECORDING_SPAN）。
+    """
+    return current_span.get() or NON_RECORDING_SPAN
+
+
+def traced(name, fn, attributes=None):
+    """
+    呼ばれたときに name のスパンの中で fn() を実行するコルーチン関数を返す（後でワーカーが実行する作業など）。
+    """
+
+    async def run():
+        with span(name, attributes):
+            result = fn()
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+
+    return run
+
+
+def callable_name(fn):
+    """
+    スパンの属性に使うコールバックの名前（partial は元の関数の名前）。
+    """
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+    return getattr(fn, "__qualname__", None) or repr(fn)
+
+
+class SpanExporter:
+    """
+    終わったスパンを OTLP/JSON（ExportTraceServiceRequest の JSON 表現）にして、専用のスレッドで書き出す。
+
+    path を指定するとファイルに追記し、address（(host, port)）を指定すると TCP で送る。
+    どちらも 1 行に 1 つの ExportTraceServiceRequest を書く（OpenTelemetry Collector の file exporter と
+    同じ形式で、otlpjsonfile receiver などで読める）。
+    スレッドは flush_interval 秒ごとに溜まっているスパンを最大 max_batch 件ずつまとめて書く。
+    書き込みが追いつかず max_queue 件溜まった場合、それ以降のスパンは捨てて dropped に数える。
+    送信先に接続できない間のスパンも捨てる（次の書き込みで接続し直す）。
+    """
+
+    def __init__(
+        self,
+        path=None,
+        address=None,
+        service_name="vtn",
+        max_queue=10_000,
+        max_batch=512,
+        flush_interval=1.0,
+    ):
+        if (path is None) == (address is None):
+            raise ValueError("SpanExporter() requires either a path or an address")
+        self.path = path
+        self.address = address
+        self.service_name = service_name
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self._spans = collections.deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._file = None
+        self._socket = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._write_loop, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, spans):
+        if len(self._spans) + len(spans) > self.max_queue:
+            self.dropped += len(spans)
+            return
+        self._spans.extend(spans)
+
+    def close(self):
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread.join()
+        for resource in (self._file, self._socket):
+            if resource is not None:
+                resource.close()
+        self._file = self._socket = None
+
+    def _write_loop(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._write_pending()
+        self._write_pending()
+
+    def _write_pending(self):
+        spans = self._spans
+        while spans:
+            batch = [spans.popleft() for _ in range(min(len(spans), self.max_batch))]
+            line = json.dumps(self.encode(batch), separators=(",", ":")) + "\n"
+            try:
+                self._send(line.encode())
+            except OSError as err:
+                logger.warning("Could not export %d spans: %s", len(batch), err)
+                self.dropped += len(batch)
+                if self._socket is not None:
+                    self._socket.close()
+                    self._socket = None
+            else:
+                self.exported += len(batch)
+
+    def _send(self, data):
+        if self.path is not None:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            self._file.write(data)
+            self._file.flush()
+            return
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address, timeout=5.0)
+        self._socket.sendall(data)
+
+    def encode(self, spans):
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _encode_attributes(
+                            {"service.name": self.service_name}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "openleadr_impl"},
+                            "spans": [_encode_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+def _encode_span(span):
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _encode_attributes(span.attributes),
+        "status": {},
+    }
+    if span.parent_span_id is not None:
+        encoded["parentSpanId"] = span.parent_span_id
+    if span.status_message is not None:
+        encoded["status"] = {"code": STATUS_ERROR, "message": span.status_message}
+    return encoded
+
+
+def _encode_attributes(attributes):
+    return [{"key": key, "value": _encode_value(value)} for key, value in attributes.items()]
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON では int64 を文字列で表す
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return {"arrayValue": {"values": [_encode_value(item) for item in value]}}
+    return {"stringValue": str(value)}
@@ -1,5 +1,4 @@
 import os
-import boto3
 from typing import Optional
 
 
@@ -19,6 +18,9 @@ def get_dynamodb_client():
         boto3.client("dynamodb") のインスタンス
     """
 
+    # boto3 の import は重いため（100ms 以上）、DynamoDB を使うときまで遅らせる
+    import boto3
+
     session = boto3.Session()
 
     region = os.getenv("AWS_REGION", "local")
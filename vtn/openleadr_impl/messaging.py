@@ -1,7 +1,18 @@
+from http import HTTPStatus
+import re
+
 from openleadr import utils, errors
 
 from openleadr_impl.utils import utils as myUtils
 
+# oadrPayload / oadrSignedObject の内側にある最初の oadr 要素がメッセージの種類
+_MESSAGE_TYPE_PATTERN = re.compile(
+    rb"<(?:[\w.-]+:)?(oadr(?!Payload\b|SignedObject\b)\w+)[\s/>]"
+)
+# 署名（ds:Signature）は oadrSignedObject の前に入るため、証明書を含めても収まる大きさにする
+_SNIFF_LIMIT = 16384
+_VEN_ID_PATTERN = re.compile(rb"<(?:[\w.-]+:)?venID>\s*([^<\s]+)\s*</")
+
 
 async def authenticate_message(
     request,
@@ -55,3 +66,54 @@ async def authenticate_message(
                 f"does not match the expected fingerprint '{expected_fingerprint}'"
             )
             raise errors.NotRegisteredOrAuthorizedError(msg)
+
+
+def authenticate_fingerprint(request, ven_registry):
+    """
+    ボディを読む前に、mTLS ヘッダーのフィンガープリントだけで VEN を特定する。
+
+    未知（未登録・失効済み）の証明書は XML をパースする前に 403 で拒否する。
+    特定できた VEN 情報を返すので、呼び出し側はパース後に venID との一致だけを確認すればよい。
+    """
+    connection_fingerprint = myUtils.get_certificate_fingerprint_from_alb_header(
+        request
+    )
+    ven_info = ven_registry.lookup_by_fingerprint(connection_fingerprint)
+    if ven_info is None:
+        raise errors.HTTPError(
+            status=HTTPStatus.FORBIDDEN,
+            description="Your client certificate is not known to this VTN.",
+        )
+    return ven_info
+
+
+def verify_ven_id(ven_info, message_payload):
+    """
+    authenticate_fingerprint() で特定した VEN と、メッセージ中の venID が一致するかを確認する。
+    """
+    ven_id = message_payload.get("ven_id")
+    if ven_id != ven_info["ven_id"]:
+        msg = (
+            f"Your venID {ven_id} does not belong to the client certificate "
+            "that you used to make this request."
+        )
+        raise errors.NotRegisteredOrAuthorizedError(msg)
+    if ven_info.get("registration_id") is None:
+        raise errors.NotRegisteredOrAuthorizedError
+
+
+def sniff_message_type(content):
+    """
+    XML をパースせずに、ボディ先頭のバイト列からメッセージの種類（'oadrPoll' など）を推定する。
+    レート制限など、パース前の安価な振り分けにだけ使う。見つからない場合は None。
+    """
+    match = _MESSAGE_TYPE_PATTERN.search(content, 0, _SNIFF_LIMIT)
+    return match.group(1).decode() if match else None
+
+
+def sniff_ven_id(content):
+    """
+    XML をパースせずに、ボディ中の最初の venID を取り出す。シャードへの振り分けにだけ使う。見つからない場合は None。
+    """
+    match = _VEN_ID_PATTERN.search(content, 0, _SNIFF_LIMIT)
+    return match.group(1).decode() if match else None
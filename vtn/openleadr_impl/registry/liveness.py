@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+
+from openleadr_impl.utils.timing_wheel import TimingWheel
+
+logger = logging.getLogger("openleadr")
+
+
+class LivenessTracker:
+    """
+    VEN ごとの最終アクセス時刻を記録し、offline_after 秒アクセスのない VEN をオフラインとみなすクラス。
+
+    - seen() は MyVTNService.handle_request から認証後に毎回呼ばれる。dict への書き込みだけで済む O(1) の処理
+    - 期限の判定は TimingWheel で行う。VEN ごとにホイールへ登録するのは 1 件だけで、
+      期限が来た時点で最終アクセス時刻を確認し、まだ期限内なら登録し直す（アクセスのたびに登録し直さない）
+    - オンライン → オフライン、オフライン → オンラインの遷移時に offline_callbacks / online_callbacks を呼ぶ
+      （callable(ven_id)。コルーチン関数の場合はタスクとして実行する）
+
+    一度もアクセスのない VEN はオンラインでもオフラインでもない（is_offline() は False）。
+    """
+
+    def __init__(
+        self,
+        offline_after=300.0,
+        tick=1.0,
+        slots=512,
+        on_offline=None,
+        on_online=None,
+        clock=time.monotonic,
+    ):
+        self.offline_after = offline_after
+        self.tick = tick
+        self._clock = clock
+        self._wheel = TimingWheel(tick=tick, slots=slots, now=clock())
+        self._last_seen = {}
+        self._offline = set()
+        self.offline_callbacks = [on_offline] if on_offline is not None else []
+        self.online_callbacks = [on_online] if on_online is not None else []
+
+    def seen(self, ven_id, now=None):
+        """
+        VEN からのアクセスを記録する。
+        """
+        now = self._clock() if now is None else now
+        self._last_seen[ven_id] = now
+        if ven_id not in self._wheel:
+            self._wheel.schedule(ven_id, now + self.offline_after)
+        if ven_id in self._offline:
+            self._offline.discard(ven_id)
+            self._fire(self.online_callbacks, ven_id)
+
+    def expire(self, now=None):
+        """
+        ホイールを now まで進め、期限切れの VEN をオフラインにする。オフラインになった VEN のリストを返す。
+        """
+        now = self._clock() if now is None else now
+        went_offline = []
+        for ven_id in self._wheel.advance(now):
+            deadline = self._last_seen[ven_id] + self.offline_after
+            if deadline > now:
+                # 前回の登録以降にアクセスがあった
+                self._wheel.schedule(ven_id, deadline)
+                continue
+            self._offline.add(ven_id)
+            went_offline.append(ven_id)
+            self._fire(self.offline_callbacks, ven_id)
+        return went_offline
+
+    def is_online(self, ven_id):
+        return ven_id in self._last_seen and ven_id not in self._offline
+
+    def is_offline(self, ven_id):
+        return ven_id in self._offline
+
+    def offline_ven_ids(self):
+        return set(self._offline)
+
+    def seconds_since_seen(self, ven_id, now=None):
+        """
+        最後のアクセスからの経過秒数。一度もアクセスのない VEN は None。
+        """
+        last_seen = self._last_seen.get(ven_id)
+        if last_seen is None:
+            return None
+        return (self._clock() if now is None else now) - last_seen
+
+    def forget(self, ven_id):
+        """
+        登録解除された VEN の記録を消す。
+        """
+        self._last_seen.pop(ven_id, None)
+        self._offline.discard(ven_id)
+        self._wheel.cancel(ven_id)
+
+    def _fire(self, callbacks, ven_id):
+        for callback in callbacks:
+            try:
+                result = callback(ven_id)
+                if asyncio.iscoroutine(result):
+                    asyncio.get_running_loop().create_task(result)
+            except Exception as err:
+                logger.warning(
+                    "A liveness callback for ven '%s' failed: %s: %s",
+                    ven_id,
+                    err.__class__.__name__,
+                    err,
+                )
+
+    async def run(self):
+        """
+        tick 秒ごとにホイールを進める。
+        """
+        while True:
+            await asyncio.sleep(self.tick)
+            self.expire()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+logger = logging.getLogger("openleadr")
+
+
+class VenRegistry:
+    """
+    VEN 情報をメモリ上に保持し、ven_id / フィンガープリントの索引で引けるようにするクラス。
+
+    - load() で VenRepository から全件を読み込む
+    - refresh() で前回取得した updated_at 以降の差分だけを反映する（deleted / revoked の VEN は索引から外す）
+    - lookup() は ven_lookup としてそのまま MyOpenADRServer に渡せる（I/O なしの dict 参照）
+    - save_registration() で登録・登録解除をリポジトリに書き込み、他のプロセスの refresh() に伝える
+
+    索引に保持するのは ven_id, ven_name, fingerprint, registration_id, transport_address のみ。
+    lookup() が返す dict は共有されるため、呼び出し側で変更しないこと。
+    registered は registration_id を持つ VEN の数（索引の変更のたびに増減させる）。
+    """
+
+    def __init__(self, repository, refresh_interval=30):
+        self._repository = repository
+        self.refresh_interval = refresh_interval
+        self._by_ven_id = {}
+        self._by_fingerprint = {}
+        self.marker = None
+        self.registered = 0
+
+    def __len__(self):
+        return len(self._by_ven_id)
+
+    def lookup(self, ven_id):
+        return self._by_ven_id.get(ven_id)
+
+    def lookup_by_fingerprint(self, fingerprint):
+        return self._by_fingerprint.get(fingerprint)
+
+    def transport_address(self, ven_id):
+        """
+        push 配信先の URL を返す。PushTransport の endpoint_lookup に渡せる。
+        """
+        record = self._by_ven_id.get(ven_id)
+        return record["transport_address"] if record is not None else None
+
+    def load(self):
+        """
+        全件を読み込み、索引を作り直す。
+        """
+        self._by_ven_id = {}
+        self._by_fingerprint = {}
+        self.marker = None
+        self.registered = 0
+        self.apply(self._repository.scan_vens())
+
+    def refresh(self):
+        """
+        前回のマーカー以降に更新された VEN だけを取得して反映する。
+        """
+        self.apply(self._repository.scan_vens(updated_since=self.marker))
+
+    def apply(self, vens):
+        for ven in vens:
+            if ven.get("deleted") or ven.get("revoked"):
+                self.remove(ven["ven_id"])
+            else:
+                self.upsert(ven)
+            updated_at = ven.get("updated_at")
+            if updated_at is not None and (self.marker is None or updated_at > self.marker):
+                self.marker = updated_at
+
+    async def save_registration(self, ven_id, registration_id, fingerprint=None):
+        """
+        VEN の登録（registration_id が None の場合は登録解除）をリポジトリに書き込み、索引にもすぐ反映する。
+
+        書き込みは別スレッドで行う。他のワーカー・シャードの VenRegistry は次の refresh() で取り込む
+        （索引はプロセスごとに持つため、upsert() だけではこのプロセスにしか反映されない）。
+        """
+        ven = await asyncio.to_thread(
+            self._repository.save_registration, ven_id, registration_id, fingerprint
+        )
+        if ven is not None:
+            self.upsert(ven)
+
+    def upsert(self, ven):
+        """
+        VEN を索引に追加・更新する。登録処理の直後など、次の refresh() を待たずに反映したい場合にも使う。
+        """
+        record = {
+            "ven_id": ven["ven_id"],
+            "ven_name": ven.get("ven_name"),
+            "fingerprint": ven.get("fingerprint"),
+            "registration_id": ven.get("registration_id"),
+            "transport_address": ven.get("transport_address"),
+        }
+        previous = self._by_ven_id.get(record["ven_id"])
+        if previous is not None:
+            self._unindex_fingerprint(previous)
+            if previous["registration_id"]:
+                self.registered -= 1
+        self._by_ven_id[record["ven_id"]] = record
+        if record["registration_id"]:
+            self.registered += 1
+        if record["fingerprint"]:
+            self._by_fingerprint[record["fingerprint"]] = record
+
+    def remove(self, ven_id):
+        record = self._by_ven_id.pop(ven_id, None)
+        if record is not None:
+            self._unindex_fingerprint(record)
+            if record["registration_id"]:
+                self.registered -= 1
+
+    def _unindex_fingerprint(self, record):
+        if self._by_fingerprint.get(record["fingerprint"]) is record:
+            del self._by_fingerprint[record["fingerprint"]]
+
+    async def run(self):
+        """
+        refresh_interval 秒ごとに差分を取得する。DynamoDB へのアクセスは別スレッドで行い、
+        索引への反映だけをイベントループ上で行う。
+        """
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                vens = await asyncio.to_thread(
+                    self._repository.scan_vens, updated_since=self.marker
+                )
+            except Exception as err:
+                logger.warning(
+                    "Could not refresh the VEN registry: %s: %s",
+                    err.__class__.__name__,
+                    err,
+                )
+                continue
+            self.apply(vens)
@@ -1,5 +1,5 @@
 from typing import List, Dict, Any, Optional
-from botocore.exceptions import ClientError
+from openleadr_impl.diagnostics import tracing
 from openleadr_impl.infra.dynamodb import get_dynamodb_client
 
 
@@ -7,8 +7,38 @@ def _chunked(seq: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]
     return [seq[i:i + size] for i in range(0, len(seq), size)]
 
 class BaseDynamoRepository:
-    def __init__(self):
+    def __init__(self, metrics: Optional[Any] = None):
         self._client = get_dynamodb_client()
+        self.metrics = metrics
+
+    def _call(self, operation: str, table_names: List[str], **params: Any) -> Dict[str, Any]:
+        """
+        DynamoDB の API を呼ぶ。トレース中なら呼び出しを DynamoDB.<operation> のスパンとして記録する
+        （asyncio.to_thread から呼んでも、呼び出し元のリクエストのトレースに入る）。
+        metrics（VtnMetrics）を指定した場合は、呼び出し回数と消費したキャパシティユニットを数える。
+        """
+        if self.metrics is not None:
+            params.setdefault("ReturnConsumedCapacity", "TOTAL")
+        with tracing.span(
+            f"DynamoDB.{operation}",
+            {
+                "db.system": "dynamodb",
+                "db.operation": operation,
+                "aws.dynamodb.table_names": table_names,
+            },
+            tracing.SPAN_KIND_CLIENT,
+        ) as span:
+            try:
+                response = getattr(self._client, operation)(**params)
+            except Exception as err:
+                if self.metrics is not None:
+                    self.metrics.record_dynamodb_call(operation, error=err)
+                raise
+            if self.metrics is not None:
+                self.metrics.record_dynamodb_call(operation, response)
+            if "Count" in response:
+                span.set_attribute("aws.dynamodb.count", response["Count"])
+            return response
 
     def transact_put_and_delete(
         self,
@@ -32,9 +62,22 @@ class BaseDynamoRepository:
         # 25件ごとに分割
         batches = _chunked(transact_items, 25)
 
+        # botocore はクライアントの作成時に読み込み済み（モジュールの import 時には読み込まない）
+        from botocore.exceptions import ClientError
+
         try:
             for batch in batches:
-                self._client.transact_write_items(TransactItems=batch)
+                self._call(
+                    "transact_write_items",
+                    sorted(
+                        {
+                            request["TableName"]
+                            for item in batch
+                            for request in item.values()
+                        }
+                    ),
+                    TransactItems=batch,
+                )
         except ClientError:
             # 呼び出し側で補正処理する前提でそのまま投げる
             raise
\ No newline at end of file
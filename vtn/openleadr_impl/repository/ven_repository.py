@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+from openleadr_impl.repository.dynamodb import BaseDynamoRepository
+
+# updated_partition の値（すべての VEN で同じ値にし、updated_at の GSI を 1 つのパーティションで引く）
+UPDATED_PARTITION = "ven"
+
+
+class VenRepository(BaseDynamoRepository):
+    """
+    VEN 情報テーブルへのアクセス。
+
+    テーブルの項目（AttributeValue 形式）:
+        ven_id          S    パーティションキー
+        ven_name        S
+        fingerprint     S    クライアント証明書の SHA-256 フィンガープリント（'AA:BB:...'）
+        registration_id S    未登録の場合は省略
+        transport_address S  push 配信先の URL（oadrTransportAddress）。pull のみの VEN は省略
+        updated_at      S    ISO8601（UTC）の更新日時。差分取得のマーカーに使う
+        updated_partition S  常に UPDATED_PARTITION。更新時に updated_at と合わせて書くこと
+        deleted         BOOL 論理削除フラグ（差分取得で削除を伝えるため物理削除はしない）
+        revoked         BOOL 証明書の失効フラグ
+
+    差分取得用の GSI（updated_index、射影は ALL）:
+        updated_partition  パーティションキー
+        updated_at         ソートキー
+    updated_partition のない項目は GSI に載らず、差分取得で拾われない。
+    """
+
+    def __init__(
+        self,
+        table_name: str = "vens",
+        metrics: Optional[Any] = None,
+        updated_index: Optional[str] = "updated_at-index",
+    ):
+        super().__init__(metrics)
+        self.table_name = table_name
+        self.updated_index = updated_index
+
+    def scan_vens(self, updated_since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        VEN を全件取得する。updated_since を指定した場合は updated_at がそれ以降の VEN のみを返す。
+
+        全件の取得は Scan。差分は updated_index への Query で取得し、読み取りは返す VEN の分だけになる。
+        updated_index が None の場合、差分も Scan に FilterExpression を付けて取得する。この場合は
+        毎回テーブル全体を読み、読み取りキャパシティもテーブル全体の分を消費する（返す件数が減るだけ）。
+        """
+        if updated_since is not None and self.updated_index is not None:
+            return self._paginate(
+                "query",
+                {
+                    "TableName": self.table_name,
+                    "IndexName": self.updated_index,
+                    "KeyConditionExpression": (
+                        "updated_partition = :partition AND updated_at >= :marker"
+                    ),
+                    "ExpressionAttributeValues": {
+                        ":partition": {"S": UPDATED_PARTITION},
+                        ":marker": {"S": updated_since},
+                    },
+                },
+            )
+
+        params: Dict[str, Any] = {"TableName": self.table_name}
+        if updated_since is not None:
+            params["FilterExpression"] = "updated_at >= :marker"
+            params["ExpressionAttributeValues"] = {":marker": {"S": updated_since}}
+        return self._paginate("scan", params)
+
+    def save_registration(
+        self,
+        ven_id: str,
+        registration_id: Optional[str],
+        fingerprint: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        VEN の登録（registration_id が None の場合は登録解除）を書き込み、updated_at を進める。
+
+        他のワーカー・シャードの VenRegistry は、次の差分取得でこの更新を取り込む。
+        登録解除はテーブルにある VEN だけを更新し、ない場合は何もせずに None を返す。
+        書き込んだ VEN を scan_vens() と同じ形で返す。
+        """
+        updated_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        sets = ["updated_at = :updated_at", "updated_partition = :partition"]
+        values: Dict[str, Any] = {
+            ":updated_at": {"S": updated_at},
+            ":partition": {"S": UPDATED_PARTITION},
+        }
+        params: Dict[str, Any] = {}
+        if registration_id is not None:
+            sets.append("registration_id = :registration_id")
+            values[":registration_id"] = {"S": registration_id}
+        else:
+            params["ConditionExpression"] = "attribute_exists(ven_id)"
+        if fingerprint is not None:
+            sets.append("fingerprint = :fingerprint")
+            values[":fingerprint"] = {"S": fingerprint}
+        expression = "SET " + ", ".join(sets)
+        if registration_id is None:
+            expression += " REMOVE registration_id"
+
+        # botocore はクライアントの作成時に読み込み済み（モジュールの import 時には読み込まない）
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self._call(
+                "update_item",
+                [self.table_name],
+                TableName=self.table_name,
+                Key={"ven_id": {"S": ven_id}},
+                UpdateExpression=expression,
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_NEW",
+                **params,
+            )
+        except ClientError as err:
+            if err.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return None
+            raise
+        return _to_ven(response["Attributes"])
+
+    def _paginate(self, operation: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        vens: List[Dict[str, Any]] = []
+        while True:
+            page = self._call(operation, [self.table_name], **params)
+            vens.extend(_to_ven(item) for item in page.get("Items", []))
+            if "LastEvaluatedKey" not in page:
+                return vens
+            params["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+def _to_ven(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "ven_id": item["ven_id"]["S"],
+        "ven_name": item.get("ven_name", {}).get("S"),
+        "fingerprint": item.get("fingerprint", {}).get("S"),
+        "registration_id": item.get("registration_id", {}).get("S"),
+        "transport_address": item.get("transport_address", {}).get("S"),
+        "updated_at": item.get("updated_at", {}).get("S"),
+        "deleted": item.get("deleted", {}).get("BOOL", False),
+        "revoked": item.get("revoked", {}).get("BOOL", False),
+    }
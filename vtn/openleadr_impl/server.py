@@ -16,20 +16,53 @@
 
 from aiohttp import web
 from openleadr.messaging import create_message
-from openleadr import utils, OpenADRServer
+from openleadr import enums, utils, OpenADRServer
 from functools import partial
 from datetime import timedelta
+import asyncio
+import contextlib
+import inspect
 import logging
 import ssl
 
+from openleadr_impl.cluster.migration import VenMigrating
+from openleadr_impl.control.admission import DEFAULT_PRIORITIES
+from openleadr_impl.delivery.outbound_queue import OutboundQueue
+from openleadr_impl.diagnostics.metrics import VtnMetrics
 from openleadr_impl.service.event_service import EventService
 from openleadr_impl.service.poll_service import PollService
 from openleadr_impl.service.registration_service import RegistrationService
 from openleadr_impl.service.report_service import ReportService
 from openleadr_impl.service.vtn_service import MyVTNService
+from openleadr_impl.startup import StartupTimer, prewarm
 
 logger = logging.getLogger("openleadr")
 
+# The per-VEN state of each service that can be moved to a state_store
+STATE_LAYOUT = {
+    "event_service": (
+        "events",
+        "completed_event_ids",
+        "event_callbacks",
+        "event_opt_types",
+        "event_delivery_callbacks",
+    ),
+    "poll_service": ("events_updated",),
+    "report_service": (
+        "report_callbacks",
+        "registered_reports",
+        "requested_reports",
+        "created_reports",
+    ),
+}
+# The state gauges of the VtnMetrics, shared by the workers (see VtnMetrics.share_state_gauges)
+STATE_GAUGES_NAMESPACE = "metrics.state_gauges"
+STATE_NAMESPACES = tuple(
+    f"{service}.{attribute}"
+    for service, attributes in STATE_LAYOUT.items()
+    for attribute in attributes
+) + ("poll_service.outbound_queue", STATE_GAUGES_NAMESPACE)
+
 
 class MyOpenADRServer(OpenADRServer):
     _MAP = {
@@ -60,11 +93,33 @@ class MyOpenADRServer(OpenADRServer):
         http_key=None,
         http_key_passphrase=None,
         http_path_prefix="/OpenADR2/Simple/2.0b",
+        http_reuse_port=False,
         requested_poll_freq=timedelta(seconds=10),
         http_ca_file=None,
         ven_lookup=None,
         verify_message_signatures=True,
         show_server_cert_domain=True,
+        poll_frequency_policy=None,
+        poll_freq_jitter=0.0,
+        registration_admission=None,
+        admission=None,
+        shared_admission=None,
+        admission_priorities=None,
+        rate_limiter=None,
+        idempotency_cache=None,
+        handler_deadlines=None,
+        report_scheduler=None,
+        ven_registry=None,
+        push_transport=None,
+        liveness_tracker=None,
+        state_store=None,
+        snapshotter=None,
+        traffic_recorder=None,
+        loop_monitor=None,
+        tracer=None,
+        metrics=None,
+        prewarm=True,
+        startup_timer=None,
     ):
         """
         Create a new OpenADR VTN (Server).
@@ -88,9 +143,79 @@ class MyOpenADRServer(OpenADRServer):
         :param str http_key: The path to the PEM private key for securing HTTP traffic.
         :param str http_ca_file: The path to the CA-file that client certificates are checked against.
         :param str http_key_passphrase: The passphrase for the HTTP private key.
+        :param bool http_reuse_port: Bind with SO_REUSEPORT, so that several worker processes
+                                     can listen on the same port (see cluster.prefork).
         :param ven_lookup: A callback that takes a ven_id and returns a dict containing the
                            ven_id, ven_name, fingerprint and registration_id.
         :param verify_message_signatures: Whether to verify message signatures.
+        :param poll_frequency_policy: An optional PollFrequencyPolicy that decides the
+                                      oadrPollFreq per VEN at (re-)registration time.
+                                      If omitted, every VEN gets requested_poll_freq.
+        :param float poll_freq_jitter: Stretch every handed-out oadrPollFreq by a random
+                                       fraction of up to this value (e.g. 0.2 for +0-20%),
+                                       so that VENs that re-register together drift apart.
+        :param registration_admission: An optional AdmissionController that caps the number
+                                       of concurrent EiRegisterParty requests. Requests that
+                                       cannot be admitted get a 503 with a Retry-After header.
+                                       Shorthand for admission={"EiRegisterParty": ...}.
+        :param dict admission: AdmissionControllers per service name (EiEvent, EiReport,
+                               OadrPoll, EiRegisterParty) that cap the number of
+                               concurrent requests to that service.
+        :param shared_admission: An optional AdmissionController shared by all services.
+                                 When it is saturated, waiting requests are admitted in
+                                 order of their service's priority.
+        :param dict admission_priorities: Priority per service name, lower is more urgent.
+                                          Defaults to DEFAULT_PRIORITIES, which puts EiEvent
+                                          and OadrPoll ahead of EiReport.
+        :param rate_limiter: An optional RateLimiter. Every request is checked against it
+                             before its XML is parsed; VENs over their rate get a 429
+                             with a Retry-After header.
+        :param idempotency_cache: An optional IdempotencyCache. Retried oadrUpdateReport,
+                                  oadrCreatedEvent and oadrRegisterReport messages get the
+                                  response to their first delivery instead of being handled
+                                  again; retries that arrive while it is in progress wait for it.
+        :param handler_deadlines: An optional HandlerDeadlines with a time limit per message
+                                  type for the handlers (and the callbacks they await). A
+                                  handler over its limit is cancelled or detached, and the VEN
+                                  gets an OpenADR error response right away. The message types
+                                  it detaches must be covered by the idempotency_cache.
+        :param report_scheduler: An optional FairScheduler. oadrUpdateReport is then answered
+                                 as soon as its callbacks are queued, and the callbacks run
+                                 in the background with each VEN getting a fair share.
+        :param ven_registry: An optional VenRegistry. Its lookup is used as the ven_lookup
+                             (unless you provide one) and it is refreshed in the background
+                             while the server runs. Requests to services other than
+                             EiRegisterParty are authenticated against its fingerprint
+                             index before the body is read.
+        :param push_transport: An optional PushTransport. If given, push_events() delivers
+                               oadrDistributeEvent straight to the VEN endpoints; messages
+                               that cannot be pushed fall back to the oadrPoll queue.
+        :param liveness_tracker: An optional LivenessTracker that records every authenticated
+                                 request. push_events() skips offline VENs, and with a
+                                 push_transport their events are pushed when they come back.
+        :param state_store: An optional SharedStore that holds the service state, so that
+                            several worker processes can serve any VEN (see cluster.prefork).
+        :param snapshotter: An optional Snapshotter. The service state is restored from its
+                            file when the server starts, saved periodically while it runs
+                            and saved once more when it stops.
+        :param traffic_recorder: An optional TrafficRecorder that writes the incoming requests
+                                 and their responses to files while the server runs, for
+                                 replaying them later (see benchmarks/replay.py).
+        :param loop_monitor: An optional LoopMonitor that records the event loop lag and the
+                             callbacks that block the loop while the server runs.
+        :param tracer: An optional Tracer. While the server runs, each request is traced
+                       from the handler through the service handler, the report and event
+                       callbacks and the DynamoDB calls, and the traces are exported as
+                       OTLP JSON.
+        :param metrics: An optional VtnMetrics that the services and the server keep up to
+                        date as their state changes (see add_metrics_routes() for the
+                        Prometheus endpoint). The latency histograms of the loop_monitor and
+                        the poll_frequency_policy's load monitor and the ven_registry's
+                        registered VENs are added to it. Defaults to a new VtnMetrics.
+        :param prewarm: Compile the message templates and warm up message parsing before the
+                        listener opens, so that the first requests do not pay for it.
+        :param startup_timer: An optional StartupTimer. run() records the restore, prewarm and
+                              listen phases in it and logs the startup timing report.
         """
         # Set up the message queues
 
@@ -106,13 +231,131 @@ class MyOpenADRServer(OpenADRServer):
         self.services["report_service"] = ReportService(vtn_id)
         self.services["poll_service"] = PollService(vtn_id)
         self.services["registration_service"] = RegistrationService(
-            vtn_id, poll_freq=requested_poll_freq
+            vtn_id,
+            poll_freq=requested_poll_freq,
+            poll_frequency_policy=poll_frequency_policy,
+            poll_freq_jitter=poll_freq_jitter,
         )
 
+        # Cap the concurrent requests per service and shed the rest
+        admission = dict(admission or {})
+        if registration_admission is not None:
+            admission.setdefault("EiRegisterParty", registration_admission)
+        priorities = {**DEFAULT_PRIORITIES, **(admission_priorities or {})}
+        if handler_deadlines is not None:
+            handler_deadlines.check_detached_covered(idempotency_cache)
+        MyVTNService.shared_admission = shared_admission
+        MyVTNService.rate_limiter = rate_limiter
+        MyVTNService.idempotency_cache = idempotency_cache
+        MyVTNService.handler_deadlines = handler_deadlines
+        for service in self.services.values():
+            service.admission_controller = admission.get(service.__service_name__)
+            service.admission_priority = priorities.get(service.__service_name__, 0)
+
+        self.report_scheduler = report_scheduler
+        self.services["report_service"].report_scheduler = report_scheduler
+
+        # Keep the per-VEN state in the state store
+        MyVTNService.state_lock = contextlib.nullcontext()
+        if state_store is not None:
+            MyVTNService.state_lock = state_store.lock()
+            for service_name, attributes in STATE_LAYOUT.items():
+                for attribute in attributes:
+                    setattr(
+                        self.services[service_name],
+                        attribute,
+                        state_store.namespace(f"{service_name}.{attribute}"),
+                    )
+            self.services["poll_service"].outbound_queue = OutboundQueue(
+                state_store.namespace("poll_service.outbound_queue"),
+                lock=MyVTNService.state_lock,
+            )
+
         # Register the other services with the poll service
         self.services["poll_service"].event_service = self.services["event_service"]
         self.services["poll_service"].report_service = self.services["report_service"]
 
+        # Let the poll frequency policy see the pending events per VEN
+        self.poll_frequency_policy = poll_frequency_policy
+        self.background_tasks = []
+        MyVTNService.load_monitor = None
+        if poll_frequency_policy is not None:
+            poll_frequency_policy.event_service = self.services["event_service"]
+            poll_frequency_policy.poll_service = self.services["poll_service"]
+            self.services["poll_service"].poll_frequency_policy = poll_frequency_policy
+            MyVTNService.load_monitor = poll_frequency_policy.load_monitor
+
+        # Let the push transport render events and fall back to the poll queue
+        self.push_transport = push_transport
+        if push_transport is not None:
+            push_transport.vtn_id = vtn_id
+            push_transport.event_service = self.services["event_service"]
+            push_transport.poll_service = self.services["poll_service"]
+
+        # Track which VENs are still talking to us
+        self.liveness_tracker = liveness_tracker
+        self.snapshotter = snapshotter
+        self.traffic_recorder = traffic_recorder
+        self.loop_monitor = loop_monitor
+        self.tracer = tracer
+        # VENs whose state is being (or has been) migrated to another shard; see cluster.migration
+        self.frozen_vens = set()
+        self.metrics = metrics if metrics is not None else VtnMetrics()
+        for service in self.services.values():
+            service.metrics = self.metrics
+        if state_store is not None:
+            # Each worker only sees its own changes; keep the state gauges in the store as well
+            self.metrics.share_state_gauges(
+                state_store.namespace(STATE_GAUGES_NAMESPACE), MyVTNService.state_lock
+            )
+        if loop_monitor is not None:
+            self.metrics.histogram(
+                "vtn_event_loop_lag_seconds",
+                "How late the event loop ran a timer.",
+                loop_monitor.lag,
+            )
+        if MyVTNService.load_monitor is not None:
+            self.metrics.histogram(
+                "vtn_request_duration_seconds",
+                "Time from receiving a request to having its response.",
+                MyVTNService.load_monitor.request_latencies,
+            )
+        if handler_deadlines is not None:
+            self.metrics.counter_view(
+                "vtn_handler_timeouts_total",
+                "Handlers that did not finish within their deadline.",
+                "message_type",
+                handler_deadlines.timed_out,
+            )
+            self.metrics.counter_view(
+                "vtn_handler_cancelled_total",
+                "Handlers cancelled at their deadline.",
+                "message_type",
+                handler_deadlines.cancelled,
+            )
+            self.metrics.counter_view(
+                "vtn_handler_detached_total",
+                "Handlers left running in the background at their deadline.",
+                "message_type",
+                handler_deadlines.detached,
+            )
+            self.metrics.gauge_function(
+                "vtn_handler_detached_running",
+                "Detached handlers that are still running.",
+                lambda: handler_deadlines.running_detached,
+            )
+        if ven_registry is not None:
+            self.metrics.gauge_function(
+                "vtn_registered_vens",
+                "VENs with a registration in the VEN registry.",
+                lambda: ven_registry.registered,
+            )
+        self.prewarm = prewarm
+        self.startup_timer = startup_timer
+        MyVTNService.liveness_tracker = liveness_tracker
+        if liveness_tracker is not None and push_transport is not None:
+            liveness_tracker.online_callbacks.append(self._push_on_return)
+
         # Set up the HTTP handlers for the services
         http_path_prefix = http_path_prefix.rstrip("/")
         self.app.add_routes(
@@ -129,6 +372,7 @@ class MyOpenADRServer(OpenADRServer):
         self.http_port = http_port
         self.http_host = http_host
         self.http_path_prefix = http_path_prefix
+        self.http_reuse_port = http_reuse_port
 
         # Create SSL context for running the server
         if http_cert and http_key and http_ca_file:
@@ -179,6 +423,10 @@ class MyOpenADRServer(OpenADRServer):
                 "https://openleadr.org/docs/server.html#things-you-should-implement."
             )
             MyVTNService.fingerprint_lookup = staticmethod(fingerprint_lookup)
+        self.ven_registry = ven_registry
+        MyVTNService.ven_registry = ven_registry
+        if ven_lookup is None and ven_registry is not None:
+            ven_lookup = ven_registry.lookup
         if ven_lookup is None:
             logger.warning(
                 "If you provide a 'ven_lookup' to your OpenADRServer() init, OpenLEADR can "
@@ -188,3 +436,256 @@ class MyOpenADRServer(OpenADRServer):
         else:
             MyVTNService.ven_lookup = staticmethod(ven_lookup)
         self.__setattr__ = self.add_handler
+
+    def add_raw_event(self, ven_id, event, callback=None, delivery_callback=None):
+        """
+        Add a new event to the queue for a specific VEN.
+
+        :param str ven_id: The ven_id to which this event should be distributed.
+        :param dict event: The event (as a dict or as a objects.Event instance)
+                           that contains the event details.
+        :param callable callback: A callback that will receive the opt status for this event.
+                                  This callback receives ven_id, event_id, opt_type as its arguments.
+        """
+        self._check_not_frozen(ven_id)
+        if utils.getmember(event, "response_required") == "always":
+            if callback is None:
+                logger.warning(
+                    "You did not provide a 'callback', which means you won't know if the "
+                    "VEN will opt in or opt out of your event. You should consider adding "
+                    "a callback for this."
+                )
+            elif not asyncio.isfuture(callback):
+                args = inspect.signature(callback).parameters
+                if not all(["ven_id" in args, "event_id" in args, "opt_type" in args]):
+                    raise ValueError(
+                        "The 'callback' must have at least the following parameters: "
+                        "'ven_id' (str), 'event_id' (str), 'opt_type' (str). Please fix "
+                        "your 'callback' handler."
+                    )
+
+        event_id = utils.getmember(event, "event_descriptor.event_id")
+
+        # Add some default properties to the event if they are not already set
+        if not utils.getmember(event, "event_descriptor.event_status", None):
+            utils.setmember(event, "event_descriptor.event_status", "far")
+        if not utils.getmember(event, "event_descriptor.active_period", None):
+            active_period = utils.get_active_period_from_intervals(
+                [
+                    utils.get_active_period_from_intervals(
+                        utils.getmember(signal, "intervals"), False
+                    )
+                    for signal in utils.getmember(event, "event_signals")
+                ]
+            )
+            utils.setmember(event, "active_period", active_period)
+        if not utils.getmember(event, "event_descriptor.priority", None):
+            utils.setmember(event, "event_descriptor.priority", 0)
+
+        # Add event to the queue; the queue may live in a shared store, so write it back
+        with MyVTNService.state_lock:
+            ven_events = self.events.get(ven_id, [])
+            ven_events.append(event)
+            self.events[ven_id] = ven_events
+            self.metrics.events_active.inc()
+            self.services["poll_service"].set_events_updated(ven_id, True)
+
+        # Add the callback for the response to this event
+        if callback is not None:
+            if event_id not in self.event_callbacks:
+                self.metrics.event_callbacks_outstanding.inc()
+            self.event_callbacks[event_id] = (event, callback)
+        if delivery_callback is not None:
+            self.event_delivery_callbacks[event_id] = delivery_callback
+        return event_id
+
+    def cancel_event(self, ven_id, event_id):
+        """
+        Mark the indicated event as cancelled.
+        """
+        self._check_not_frozen(ven_id)
+        with MyVTNService.state_lock:
+            ven_events = self.events.get(ven_id)
+            if ven_events is None:
+                logger.warning(
+                    f"Attempted to cancel event {event_id} for "
+                    f"ven_id {ven_id}, but this ven_id does not exist."
+                )
+                return
+
+            event = utils.find_by(ven_events, "event_descriptor.event_id", event_id)
+            if not event:
+                logger.error(
+                    "The event you tried to cancel was not found. "
+                    f"Was looking for event_id {event_id} for ven {ven_id}."
+                    f"Only found these: "
+                    f"{[utils.getmember(e, 'event_descriptor.event_id') for e in ven_events]}"
+                )
+                return
+
+            utils.setmember(
+                event, "event_descriptor.event_status", enums.EVENT_STATUS.CANCELLED
+            )
+            utils.increment_event_modification_number(event)
+            self.events[ven_id] = ven_events
+            self.services["poll_service"].set_events_updated(ven_id, True)
+
+    def request_report(self, ven_id, report_requests, skip_offline=False):
+        """
+        Queue an oadrCreateReport for this VEN, delivered on its next oadrPoll.
+
+        :param str ven_id: The ven_id that should create the reports.
+        :param list report_requests: A list of objects.ReportRequest (or dicts).
+        :param bool skip_offline: Do not queue anything for a VEN that is offline, so that
+                                  periodic requests do not pile up while it is away.
+        """
+        self._check_not_frozen(ven_id)
+        if skip_offline and self.is_offline(ven_id):
+            return False
+        return self.services["poll_service"].enqueue(
+            ven_id,
+            "oadrCreateReport",
+            {"request_id": utils.generate_id(), "report_requests": report_requests},
+        )
+
+    def cancel_report(self, ven_id, report_request_id, report_to_follow=False):
+        """
+        Queue an oadrCancelReport for this VEN, delivered on its next oadrPoll.
+        Cancelling the same report twice before delivery results in one message.
+        """
+        self._check_not_frozen(ven_id)
+        return self.services["poll_service"].enqueue(
+            ven_id,
+            "oadrCancelReport",
+            {
+                "request_id": utils.generate_id(),
+                "report_request_id": report_request_id,
+                "report_to_follow": report_to_follow,
+            },
+            coalesce_key=("oadrCancelReport", report_request_id),
+        )
+
+    def request_reregistration(self, ven_id):
+        """
+        Queue an oadrRequestReregistration for this VEN, delivered on its next oadrPoll.
+        The VEN then re-registers and receives a fresh oadrPollFreq.
+        """
+        self._check_not_frozen(ven_id)
+        return self.services["poll_service"].enqueue(
+            ven_id, "oadrRequestReregistration"
+        )
+
+    def _check_not_frozen(self, ven_id):
+        # A change made here after the state was exported would be lost with the migration
+        if ven_id in self.frozen_vens:
+            raise VenMigrating(ven_id)
+
+    async def push_events(self, ven_ids):
+        """
+        Push the pending events of these VENs right away instead of waiting for their
+        next oadrPoll. VENs that cannot be reached get them on their next oadrPoll.
+
+        :param ven_ids: The ven_ids to push to.
+        :returns: A dict of ven_id to whether the push was delivered.
+        """
+        if self.push_transport is None:
+            raise RuntimeError("push_events() requires a push_transport")
+        ven_ids = [
+            ven_id
+            for ven_id in ven_ids
+            if self.services["poll_service"].events_updated.get(ven_id)
+            and not self.is_offline(ven_id)
+        ]
+        return await self.push_transport.distribute_events(ven_ids)
+
+    def is_offline(self, ven_id):
+        """
+        Whether the liveness_tracker considers this VEN offline. Always False without one.
+        """
+        return self.liveness_tracker is not None and self.liveness_tracker.is_offline(
+            ven_id
+        )
+
+    async def _push_on_return(self, ven_id):
+        # The events that were held back while the VEN was offline
+        await self.push_events([ven_id])
+
+    async def run(self):
+        """
+        Starts the server and its background tasks in an already-running asyncio loop.
+        """
+        timer = self.startup_timer or StartupTimer()
+        if self.snapshotter is not None:
+            self.snapshotter.restore(self)
+            timer.mark("restore")
+        if self.prewarm:
+            prewarm()
+            timer.mark("prewarm")
+        self.app_runner = web.AppRunner(self.app)
+        await self.app_runner.setup()
+        site = web.TCPSite(
+            self.app_runner,
+            port=self.http_port,
+            host=self.http_host,
+            ssl_context=self.ssl_context,
+            reuse_port=self.http_reuse_port,
+        )
+        await site.start()
+        protocol = "https" if self.ssl_context else "http"
+        print("")
+        print("*" * 80)
+        print("Your VTN Server is now running at ".center(80))
+        print(
+            f"{protocol}://{self.http_host}:{self.http_port}{self.http_path_prefix}".center(
+                80
+            )
+        )
+        print("*" * 80)
+        print("")
+        timer.mark("listen")
+        if self.startup_timer is not None:
+            self.startup_timer.report()
+        if self.push_transport is not None:
+            await self.push_transport.start()
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.start()
+        if self.tracer is not None:
+            self.tracer.start()
+        if MyVTNService.load_monitor is not None:
+            self.background_tasks.append(
+                asyncio.create_task(MyVTNService.load_monitor.run())
+            )
+        if self.ven_registry is not None:
+            self.background_tasks.append(asyncio.create_task(self.ven_registry.run()))
+        if self.report_scheduler is not None:
+            self.background_tasks.append(
+                asyncio.create_task(self.report_scheduler.run())
+            )
+        if self.liveness_tracker is not None:
+            self.background_tasks.append(
+                asyncio.create_task(self.liveness_tracker.run())
+            )
+        if self.snapshotter is not None:
+            self.background_tasks.append(
+                asyncio.create_task(self.snapshotter.run(self))
+            )
+        if self.loop_monitor is not None:
+            self.background_tasks.append(asyncio.create_task(self.loop_monitor.run()))
+
+    async def stop(self):
+        """
+        Stop the background tasks and the server in a graceful manner.
+        """
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        self.background_tasks = []
+        if self.snapshotter is not None:
+            await self.snapshotter.save(self)
+        if self.push_transport is not None:
+            await self.push_transport.close()
+        if self.traffic_recorder is not None:
+            await self.traffic_recorder.close()
+        if self.tracer is not None:
+            await self.tracer.close()
+        await super().stop()
@@ -1,4 +1,5 @@
 from openleadr.service.event_service import handler, service
+from openleadr_impl.diagnostics import tracing
 from openleadr_impl.service.vtn_service import MyVTNService
 import asyncio
 from openleadr import utils, errors, enums
@@ -26,21 +27,28 @@ class EventService(MyVTNService):
         """
         ven_id = payload["ven_id"]
         if self.polling_method == "internal":
-            if ven_id in self.events and self.events[ven_id]:
-                events = utils.order_events(self.events[ven_id])
-                for event in events:
-                    event_status = utils.getmember(
-                        event, "event_descriptor.event_status"
-                    )
-                    # Pop the event from the events so that this is the last time it is communicated
-                    if event_status == enums.EVENT_STATUS.COMPLETED:
-                        if ven_id not in self.completed_event_ids:
-                            self.completed_event_ids[ven_id] = []
-                        event_id = utils.getmember(event, "event_descriptor.event_id")
-                        self.completed_event_ids[ven_id].append(event_id)
-                        self.events[ven_id].pop(self.events[ven_id].index(event))
-            else:
-                events = None
+            with self.state_lock:
+                # The events may live in a shared store: modify a copy and write it back
+                ven_events = self.events.get(ven_id)
+                if ven_events:
+                    events = utils.order_events(ven_events)
+                    completed_event_ids = self.completed_event_ids.get(ven_id, [])
+                    for event in events:
+                        event_status = utils.getmember(
+                            event, "event_descriptor.event_status"
+                        )
+                        # Pop the event from the events so that this is the last time it is communicated
+                        if event_status == enums.EVENT_STATUS.COMPLETED:
+                            event_id = utils.getmember(
+                                event, "event_descriptor.event_id"
+                            )
+                            completed_event_ids.append(event_id)
+                            ven_events.pop(ven_events.index(event))
+                            self.completed_event_ids[ven_id] = completed_event_ids
+                            self.metrics.events_active.dec()
+                    self.events[ven_id] = ven_events
+                else:
+                    events = None
         else:
             result = self.on_request_event(ven_id=payload["ven_id"])
             if asyncio.iscoroutine(result):
@@ -87,7 +95,7 @@ class EventService(MyVTNService):
                 modification_number = event_response["modification_number"]
                 opt_type = event_response["opt_type"]
                 event = utils.find_by(
-                    self.events[ven_id],
+                    self.events.get(ven_id, []),
                     "event_descriptor.event_id",
                     event_id,
                     "event_descriptor.modification_number",
@@ -106,11 +114,16 @@ class EventService(MyVTNService):
                     utils.getmember(event, "event_descriptor.event_status")
                     == enums.EVENT_STATUS.CANCELLED
                 ):
-                    utils.pop_by(
-                        self.events[ven_id], "event_descriptor.event_id", event_id
-                    )
+                    with self.state_lock:
+                        ven_events = self.events.get(ven_id, [])
+                        if utils.pop_by(
+                            ven_events, "event_descriptor.event_id", event_id
+                        ):
+                            self.metrics.events_active.dec()
+                        self.events[ven_id] = ven_events
                 if event_response["event_id"] in self.event_callbacks:
                     event, callback = self.event_callbacks.pop(event_id)
+                    self.metrics.event_callbacks_outstanding.dec()
                     if isinstance(callback, asyncio.Future):
                         if callback.done():
                             logger.warning(
@@ -122,11 +135,19 @@ class EventService(MyVTNService):
                         else:
                             callback.set_result(opt_type)
                     else:
-                        result = callback(
-                            ven_id=ven_id, event_id=event_id, opt_type=opt_type
-                        )
-                        if asyncio.iscoroutine(result):
-                            result = await result
+                        with tracing.span(
+                            "EventService.event_callback",
+                            {
+                                "code.function": tracing.callable_name(callback),
+                                "openadr.event_id": event_id,
+                                "openadr.opt_type": opt_type,
+                            },
+                        ):
+                            result = callback(
+                                ven_id=ven_id, event_id=event_id, opt_type=opt_type
+                            )
+                            if asyncio.iscoroutine(result):
+                                result = await result
         else:
             for event_response in payload["event_responses"]:
                 event_id = event_response["event_id"]
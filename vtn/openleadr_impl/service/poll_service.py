@@ -4,6 +4,7 @@ import asyncio
 from dataclasses import asdict
 import logging
 
+from openleadr_impl.delivery.outbound_queue import OutboundQueue
 from openleadr_impl.service.vtn_service import MyVTNService
 
 logger = logging.getLogger("openleadr")
@@ -18,9 +19,10 @@ class PollService(MyVTNService):
         super().__init__(vtn_id)
         self.polling_method = polling_method
         self.events_updated = {}
-        self.report_requests = {}
+        self.outbound_queue = OutboundQueue()
         self.event_service = event_service
         self.report_service = report_service
+        self.poll_frequency_policy = None
 
     @handler("oadrPoll")
     async def poll(self, payload):
@@ -28,6 +30,16 @@ class PollService(MyVTNService):
         Handle the request to the oadrPoll service. This either calls a previously registered
         `on_poll` handler, or it retrieves the next message from the internal queue.
         """
+        # The poll frequency is only handed out on registration: ask the VEN to
+        # re-register when the policy would now give it a different one
+        policy = self.poll_frequency_policy
+        if (
+            policy is not None
+            and self.polling_method != "external"
+            and policy.changed(payload["ven_id"])
+        ):
+            self.enqueue(payload["ven_id"], "oadrRequestReregistration")
+
         if self.polling_method == "external":
             result = self.on_poll(ven_id=payload["ven_id"])
         elif self.events_updated.get(payload["ven_id"]):
@@ -35,9 +47,18 @@ class PollService(MyVTNService):
             result = await self.event_service.request_event(
                 {"ven_id": payload["ven_id"]}
             )
-            self.events_updated[payload["ven_id"]] = False
+            self.set_events_updated(payload["ven_id"], False)
         else:
-            return "oadrResponse", {}
+            message = self.outbound_queue.pop(payload["ven_id"])
+            if message is None:
+                return "oadrResponse", {}
+            if message.message_type == "oadrDistributeEvent" and message.payload is None:
+                # Render the distribute from the current events at delivery time
+                result = await self.event_service.request_event(
+                    {"ven_id": payload["ven_id"]}
+                )
+            else:
+                result = message.message_type, message.payload or {}
 
         if asyncio.iscoroutine(result):
             result = await result
@@ -68,3 +89,25 @@ class PollService(MyVTNService):
             " or RequestReport."
         )
         return None
+
+    def set_events_updated(self, ven_id, updated):
+        """
+        Flag (or clear) that this VEN has event updates to be delivered.
+        """
+        previous = self.events_updated.get(ven_id)
+        self.events_updated[ven_id] = updated
+        self.metrics.set_events_updated(previous, updated)
+
+    def enqueue(self, ven_id, message_type, payload=None, coalesce_key=None):
+        """
+        Queue a message for delivery in response to the next oadrPoll of this VEN.
+        A oadrDistributeEvent without payload is rendered from the internal
+        events when it is delivered.
+        """
+        if self.polling_method == "external":
+            logger.error(
+                "You cannot queue messages after you assign your own on_poll handler. "
+                f"The {message_type} for ven '{ven_id}' will NOT be queued."
+            )
+            return False
+        return self.outbound_queue.put(ven_id, message_type, payload, coalesce_key)
@@ -1,6 +1,8 @@
 from openleadr.service import service, handler
 from asyncio import iscoroutine
+from datetime import timedelta
 import logging
+import random
 
 from openleadr_impl.service.vtn_service import MyVTNService
 
@@ -9,10 +11,32 @@ logger = logging.getLogger("openleadr")
 
 @service("EiRegisterParty")
 class RegistrationService(MyVTNService):
+    # New VENs register with certificates that are not in the VEN registry yet
+    reject_unknown_certificates = False
 
-    def __init__(self, vtn_id, poll_freq):
+    def __init__(
+        self, vtn_id, poll_freq, poll_frequency_policy=None, poll_freq_jitter=0.0
+    ):
         super().__init__(vtn_id)
         self.poll_freq = poll_freq
+        self.poll_frequency_policy = poll_frequency_policy
+        self.poll_freq_jitter = poll_freq_jitter
+
+    def requested_poll_freq(self, ven_id=None):
+        """
+        Determine the oadrPollFreq to hand out to this VEN. With a poll_freq_jitter,
+        the frequency is stretched by a random fraction so that VENs that
+        (re-)register at the same moment spread out their polls.
+        """
+        if self.poll_frequency_policy is None:
+            poll_freq = self.poll_freq
+        else:
+            poll_freq = self.poll_frequency_policy.poll_freq_for(ven_id)
+        if self.poll_freq_jitter:
+            poll_freq = poll_freq * (1 + random.uniform(0, self.poll_freq_jitter))
+            # oadrPollFreq is rendered with whole seconds
+            poll_freq = timedelta(seconds=round(poll_freq.total_seconds()))
+        return poll_freq
 
     @handler("oadrQueryRegistration")
     async def query_registration(self, payload):
@@ -34,7 +58,9 @@ class RegistrationService(MyVTNService):
                     "transports": [{"transport_name": "simpleHttp"}],
                 }
             ],
-            "requested_oadr_poll_freq": self.poll_freq,
+            "requested_oadr_poll_freq": self.requested_poll_freq(
+                payload.get("ven_id")
+            ),
         }
         return "oadrCreatedPartyRegistration", response_payload
 
@@ -57,6 +83,9 @@ class RegistrationService(MyVTNService):
                 response_payload = {}
             else:
                 ven_id, registration_id = result
+                await self.update_registry(
+                    ven_id, registration_id, payload.get("fingerprint")
+                )
                 transports = [{"transport_name": payload["transport_name"]}]
                 response_payload = {
                     "ven_id": result[0],
@@ -67,7 +96,7 @@ class RegistrationService(MyVTNService):
                             "transports": transports,
                         }
                     ],
-                    "requested_oadr_poll_freq": self.poll_freq,
+                    "requested_oadr_poll_freq": self.requested_poll_freq(ven_id),
                 }
         else:
             transports = [{"transport_name": payload["transport_name"]}]
@@ -75,7 +104,7 @@ class RegistrationService(MyVTNService):
                 "profiles": [
                     {"profile_name": payload["profile_name"], "transports": transports}
                 ],
-                "requested_oadr_poll_freq": self.poll_freq,
+                "requested_oadr_poll_freq": self.requested_poll_freq(),
             }
         return "oadrCreatedPartyRegistration", response_payload
 
@@ -100,8 +129,20 @@ class RegistrationService(MyVTNService):
         result = self.on_cancel_party_registration(payload)
         if iscoroutine(result):
             result = await result
+        await self.update_registry(payload.get("ven_id"), None)
         return result
 
+    async def update_registry(self, ven_id, registration_id, fingerprint=None):
+        """
+        Store a registration (or its cancellation) through the ven_registry. It is
+        reflected in this process right away, so that the VEN can use the other
+        services before the next refresh(), and in the other workers and shards on
+        their next refresh().
+        """
+        if self.ven_registry is None or ven_id is None:
+            return
+        await self.ven_registry.save_registration(ven_id, registration_id, fingerprint)
+
     def on_cancel_party_registration(self, ven_id):
         """
         Placeholder for the on_cancel_party_registration handler.
@@ -1,10 +1,13 @@
 from datetime import timedelta
+from functools import partial
+from http import HTTPStatus
 from openleadr.service import service, handler
 from asyncio import iscoroutine
-from openleadr import objects, utils
+from openleadr import errors, objects, utils
 import logging
 import inspect
 
+from openleadr_impl.diagnostics import tracing
 from openleadr_impl.service.vtn_service import MyVTNService
 
 logger = logging.getLogger("openleadr")
@@ -12,6 +15,7 @@ logger = logging.getLogger("openleadr")
 
 @service("EiReport")
 class ReportService(MyVTNService):
+    report_scheduler = None
 
     def __init__(self, vtn_id):
         super().__init__(vtn_id)
@@ -47,12 +51,11 @@ class ReportService(MyVTNService):
             return "oadrRegisteredReport", {"report_requests": []}
 
         for report in payload["reports"]:
-            if payload["ven_id"] not in self.registered_reports:
-                self.registered_reports[payload["ven_id"]] = []
-
+            registered_reports = self.registered_reports.get(payload["ven_id"], [])
             report_copy = report.copy()
             report_copy["report_name"] = report_copy["report_name"][9:]
-            self.registered_reports[payload["ven_id"]].append(report_copy)
+            registered_reports.append(report_copy)
+            self.registered_reports[payload["ven_id"]] = registered_reports
 
             if report["report_name"] == "METADATA_TELEMETRY_STATUS":
                 if mode == "compact":
@@ -196,6 +199,8 @@ class ReportService(MyVTNService):
                     objects.SpecifierPayload(r_id=r_id, reading_type=reading_type)
                 )
                 # Append the callback to our list of known callbacks
+                if (report_request_id, r_id) not in self.report_callbacks:
+                    self.metrics.report_callbacks.inc()
                 self.report_callbacks[(report_request_id, r_id)] = callback
 
             # Add the ReportSpecifier to the ReportRequest
@@ -242,6 +247,14 @@ class ReportService(MyVTNService):
         """
         Handle a report that we received from the VEN.
         """
+        values = sum(len(report.get("intervals") or ()) for report in payload["reports"])
+        if self.report_scheduler is not None:
+            # Only count the values once the scheduler has accepted them (it may shed them)
+            self.schedule_report_work(payload)
+            self.metrics.telemetry_values.inc(values)
+            return "oadrUpdatedReport", {}
+        self.metrics.telemetry_values.inc(values)
+
         for report in payload["reports"]:
             report_request_id = report["report_request_id"]
             if not self.report_callbacks:
@@ -259,14 +272,75 @@ class ReportService(MyVTNService):
                         (ri["dtstart"], ri["report_payload"]["value"]) for ri in values
                     ]
                     # Call the callback function to deliver the values
-                    result = self.report_callbacks[(report_request_id, r_id)](values)
-                    if iscoroutine(result):
-                        result = await result
+                    callback = self.report_callbacks[(report_request_id, r_id)]
+                    with tracing.span("ReportService.report_callback") as span:
+                        if span.recording:
+                            span.set_attributes(
+                                self.callback_attributes(
+                                    callback, report_request_id, r_id, values
+                                )
+                            )
+                        result = callback(values)
+                        if iscoroutine(result):
+                            result = await result
 
         response_type = "oadrUpdatedReport"
         response_payload = {}
         return response_type, response_payload
 
+    def schedule_report_work(self, payload):
+        """
+        Hand the report callbacks to the report_scheduler instead of running them inline,
+        so that the response does not wait for them. The cost of each callback is the
+        number of values it receives.
+        """
+        work = []
+        for report in payload["reports"]:
+            report_request_id = report["report_request_id"]
+            if not self.report_callbacks:
+                work.append(
+                    (
+                        partial(self.on_update_report, report),
+                        max(1, len(report.get("intervals") or [])),
+                    )
+                )
+                continue
+            for r_id, values in utils.group_by(
+                report["intervals"], "report_payload.r_id"
+            ).items():
+                if (report_request_id, r_id) in self.report_callbacks:
+                    values = [
+                        (ri["dtstart"], ri["report_payload"]["value"]) for ri in values
+                    ]
+                    callback = self.report_callbacks[(report_request_id, r_id)]
+                    fn = partial(callback, values)
+                    if tracing.enabled():
+                        fn = tracing.traced(
+                            "ReportService.report_callback",
+                            fn,
+                            self.callback_attributes(
+                                callback, report_request_id, r_id, values
+                            ),
+                        )
+                    work.append((fn, len(values)))
+        if not self.report_scheduler.submit_all(payload["ven_id"], work):
+            raise errors.HTTPError(
+                status=HTTPStatus.SERVICE_UNAVAILABLE,
+                description="Too many reports from this VEN are still being processed.",
+            )
+
+    @staticmethod
+    def callback_attributes(callback, report_request_id, r_id, values):
+        """
+        The span attributes of a report callback.
+        """
+        return {
+            "code.function": tracing.callable_name(callback),
+            "openadr.report_request_id": report_request_id,
+            "openadr.r_id": r_id,
+            "openadr.values": len(values),
+        }
+
     async def on_update_report(self, payload):
         """
         Placeholder for the on_update_report handler.
@@ -298,16 +372,16 @@ class ReportService(MyVTNService):
         Implementation of the on_created_report handler, may be overwritten by the user.
         """
         ven_id = payload["ven_id"]
-        if payload["ven_id"] not in self.created_reports:
-            self.created_reports[ven_id] = []
+        created_reports = self.created_reports.get(ven_id, [])
 
         if payload.get("pending_reports"):
             for pending_report in payload.get("pending_reports", []):
-                self.created_reports[ven_id].append(pending_report["report_request_id"])
+                created_reports.append(pending_report["report_request_id"])
+        self.created_reports[ven_id] = created_reports
 
         # Check if all requested reports were created
         for requested_report in self.requested_reports[ven_id]:
-            if requested_report.report_request_id not in self.created_reports[ven_id]:
+            if requested_report.report_request_id not in created_reports:
                 logger.warning(
                     f"The requested report with id {requested_report.report_request_id} "
                     "was not created by the VEN. Yoy may want to contact the VEN to "
@@ -1,6 +1,7 @@
+import contextlib
 from http import HTTPStatus
 import logging
-import traceback
+import time
 
 from aiohttp import web
 from lxml.etree import XMLSyntaxError
@@ -10,19 +11,102 @@ from openleadr import errors, hooks, utils
 from openleadr.messaging import validate_xml_schema, parse_message
 from openleadr.service import VTNService
 
+from openleadr_impl.context import RequestContext, current_request
+from openleadr_impl.control.admission import AdmissionRejected
+from openleadr_impl.control.rate_limit import RateLimited
+from openleadr_impl.diagnostics import tracing
+from openleadr_impl.diagnostics.metrics import VtnMetrics
 from openleadr_impl.utils import utils as myUtils
-from openleadr_impl.messaging import authenticate_message
+from openleadr_impl.messaging import (
+    authenticate_fingerprint,
+    authenticate_message,
+    sniff_message_type,
+    verify_ven_id,
+)
 
 logger = logging.getLogger("openleadr")
 
 
 class MyVTNService(VTNService):
     verify_message_signatures = False
+    load_monitor = None
+    admission_controller = None
+    # Shared by all services; admits requests in order of admission_priority
+    shared_admission = None
+    admission_priority = 0
+    ven_registry = None
+    liveness_tracker = None
+    rate_limiter = None
+    idempotency_cache = None
+    handler_deadlines = None
+    # Guards read-modify-write of state that may live in a SharedStore
+    state_lock = contextlib.nullcontext()
+    # Whether requests must come from a certificate known to the ven_registry
+    reject_unknown_certificates = True
+    # Counts the state and traffic of the services; the server gives its services its own
+    metrics = VtnMetrics()
 
     async def handler(self, request):
         """
         Handle all incoming POST requests.
         """
+        started = time.perf_counter()
+        # Let hooks and other helpers find the request that is being handled. It stays set
+        # after the handler returns (until the next request on the connection replaces it),
+        # so that the LoopMonitor can attribute a task step that ran the whole request.
+        current_request.set(RequestContext(request))
+        # The root span of the request's trace; handle_request names it after the message type
+        with tracing.span(
+            self.__class__.__name__, kind=tracing.SPAN_KIND_SERVER
+        ) as span:
+            if self.admission_controller is None and self.shared_admission is None:
+                response = await self.handle_request(request)
+            else:
+                try:
+                    async with self.admitted():
+                        response = await self.handle_request(request)
+                except AdmissionRejected as err:
+                    logger.debug("%s shed a request: %s", self.__class__.__name__, err)
+                    response = web.Response(
+                        text=str(err),
+                        status=HTTPStatus.SERVICE_UNAVAILABLE,
+                        headers={"Retry-After": str(err.retry_after)},
+                    )
+            span.set_attribute("http.response.status_code", response.status)
+            if response.status >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                span.set_error(f"HTTP {response.status}")
+        if self.load_monitor is not None:
+            self.load_monitor.observe_request_latency(time.perf_counter() - started)
+        return response
+
+    @contextlib.asynccontextmanager
+    async def admitted(self):
+        """
+        Hold a slot of this service's own limit and then of the shared limit.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for controller in (self.admission_controller, self.shared_admission):
+                if controller is not None:
+                    await stack.enter_async_context(
+                        controller.admit(self.admission_priority)
+                    )
+            yield
+
+    def rate_limit_key(self, request, ven_info):
+        """
+        The identity to rate limit on: the VEN if its certificate identified it, otherwise
+        the certificate fingerprint, otherwise the remote address.
+        """
+        if ven_info is not None:
+            return ven_info["ven_id"]
+        if request.headers.get("X-Amzn-Mtls-Clientcert-Leaf"):
+            return myUtils.get_certificate_fingerprint_from_alb_header(request)
+        return getattr(request, "remote", None)
+
+    async def handle_request(self, request):
+        """
+        Parse, authenticate and dispatch a single request.
+        """
         try:
             # Check the Content-Type header
             content_type = request.headers.get("content-type", "")
@@ -32,7 +116,20 @@ class MyVTNService(VTNService):
                     description="The Content-Type header must be application/xml; "
                     f"you provided {request.headers.get('content-type', '')}",
                 )
+
+            # Identify the VEN by its certificate before reading and parsing the body
+            ven_info = None
+            if self.ven_registry is not None and self.reject_unknown_certificates:
+                ven_info = authenticate_fingerprint(request, self.ven_registry)
+
             content = await request.read()
+
+            # Throttle VENs that send too many messages of one type, before parsing
+            if self.rate_limiter is not None:
+                self.rate_limiter.check(
+                    self.rate_limit_key(request, ven_info), sniff_message_type(content)
+                )
+
             hooks.call("before_parse", content)
 
             # Validate the message to the XML Schema
@@ -40,6 +137,20 @@ class MyVTNService(VTNService):
 
             # Parse the message to a type and payload dict
             message_type, message_payload = parse_message(content)
+            context = current_request.get()
+            if context is not None:
+                context.message_type = message_type
+                context.ven_id = message_payload.get("ven_id")
+            span = tracing.get_current_span()
+            if span.recording:
+                span.update_name(message_type)
+                span.set_attributes(
+                    {
+                        "openadr.message_type": message_type,
+                        "openadr.ven_id": message_payload.get("ven_id"),
+                        "openadr.request_id": message_payload.get("request_id"),
+                    }
+                )
 
             if message_type == "oadrResponse":
                 raise errors.SendEmptyHTTPResponse()
@@ -55,7 +166,10 @@ class MyVTNService(VTNService):
                 )
 
             # Check if we know this VEN, ask for reregistration otherwise
-            if (
+            if ven_info is not None and "ven_id" in message_payload:
+                # The certificate already identified the VEN; it may only use its own venID
+                verify_ven_id(ven_info, message_payload)
+            elif (
                 message_type
                 not in ("oadrCreatePartyRegistration", "oadrQueryRegistration")
                 and "ven_id" in message_payload
@@ -68,7 +182,7 @@ class MyVTNService(VTNService):
                     raise errors.NotRegisteredOrAuthorizedError
 
             # Authenticate the message
-            if message_type not in ("oadrCreatePartyRegistration", "oadrQueryRegistration") and "ven_id" in message_payload:
+            if ven_info is None and message_type not in ("oadrCreatePartyRegistration", "oadrQueryRegistration") and "ven_id" in message_payload:
                 if hasattr(self, "fingerprint_lookup"):
                     await authenticate_message(
                         request,
@@ -90,36 +204,26 @@ class MyVTNService(VTNService):
                         "https://openleadr.org/docs/server.html#signing-messages for info."
                     )
 
-            # Pass the message off to the handler and get the response type and payload
-            try:
-                # Add the request fingerprint to the message so that the handler can check for it.
-                if message_type in (
-                    "oadrCreatePartyRegistration",
-                    "oadrQueryRegistration",
-                ):
-                    message_payload["fingerprint"] = (
-                        myUtils.get_certificate_fingerprint_from_alb_header(request)
-                    )
-                response_type, response_payload = await self.handle_message(
-                    message_type, message_payload
-                )
-            except Exception as err:
-                logger.error(
-                    "An exception occurred during the execution of your "
-                    f"{self.__class__.__name__} handler: "
-                    f"{err.__class__.__name__}: {err}"
+            # Record that this VEN is alive
+            if self.liveness_tracker is not None and message_payload.get("ven_id"):
+                self.liveness_tracker.seen(message_payload["ven_id"])
+
+            # Answer a retried message with the response to its first delivery
+            key = None
+            if self.idempotency_cache is not None:
+                key = self.idempotency_cache.key_for(message_type, message_payload)
+            if key is None:
+                msg = await self.respond(request, message_type, message_payload)
+            else:
+                msg = await self.idempotency_cache.run(
+                    key, lambda: self.respond(request, message_type, message_payload)
                 )
-                raise err
-
-            if "response" not in response_payload:
-                response_payload["response"] = {
-                    "response_code": 200,
-                    "response_description": "OK",
-                    "request_id": message_payload.get("request_id"),
-                }
-            response_payload["vtn_id"] = self.vtn_id
-            if "ven_id" not in response_payload:
-                response_payload["ven_id"] = message_payload.get("ven_id")
+        except RateLimited as err:
+            response = web.Response(
+                text=str(err),
+                status=HTTPStatus.TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(err.retry_after)},
+            )
         except errors.SendEmptyHTTPResponse:
             response = web.Response(
                 text="", status=HTTPStatus.OK, content_type="application/xml"
@@ -139,7 +243,7 @@ class MyVTNService(VTNService):
                 text=err.response_description, status=err.response_code
             )
         except XMLSyntaxError as err:
-            logger.warning(f"XML schema validation of incoming message failed: {err}.")
+            logger.warning("XML schema validation of incoming message failed: %s.", err)
             response = web.Response(
                 text=f"XML failed validation: {err}", status=HTTPStatus.BAD_REQUEST
             )
@@ -154,15 +258,65 @@ class MyVTNService(VTNService):
         except Exception as err:
             # In case of some other error, return a HTTP 500
             logger.error(
-                f"The VTN server encountered an error: {err.__class__.__name__}: {err}"
+                "The VTN server encountered an error: %s: %s",
+                err.__class__.__name__,
+                err,
+                exc_info=True,
             )
-            logger.error(traceback.format_exc())
             response = web.Response(status=HTTPStatus.INTERNAL_SERVER_ERROR)
         else:
             # We've successfully handled this message
-            msg = self._create_message(response_type, **response_payload)
             response = web.Response(
                 text=msg, status=HTTPStatus.OK, content_type="application/xml"
             )
         hooks.call("before_respond", response.text)
         return response
+
+    async def respond(self, request, message_type, message_payload):
+        """
+        Pass the message off to the handler and render its response message.
+        """
+        try:
+            # Add the request fingerprint to the message so that the handler can check for it.
+            if message_type in (
+                "oadrCreatePartyRegistration",
+                "oadrQueryRegistration",
+            ):
+                message_payload["fingerprint"] = (
+                    myUtils.get_certificate_fingerprint_from_alb_header(request)
+                )
+            with tracing.span(f"{self.__class__.__name__}.{message_type}"):
+                if self.handler_deadlines is None:
+                    return await self.handle_and_render(message_type, message_payload)
+                # A detached handler renders its own response, so that the idempotency
+                # cache can answer a retried message with it once it finishes
+                return await self.handler_deadlines.run(
+                    message_type,
+                    lambda: self.handle_and_render(message_type, message_payload),
+                )
+        except Exception as err:
+            logger.error(
+                "An exception occurred during the execution of your %s handler: %s: %s",
+                self.__class__.__name__,
+                err.__class__.__name__,
+                err,
+            )
+            raise err
+
+    async def handle_and_render(self, message_type, message_payload):
+        """
+        Run the handler for this message and render its response message.
+        """
+        response_type, response_payload = await self.handle_message(
+            message_type, message_payload
+        )
+        if "response" not in response_payload:
+            response_payload["response"] = {
+                "response_code": 200,
+                "response_description": "OK",
+                "request_id": message_payload.get("request_id"),
+            }
+        response_payload["vtn_id"] = self.vtn_id
+        if "ven_id" not in response_payload:
+            response_payload["ven_id"] = message_payload.get("ven_id")
+        return self._create_message(response_type, **response_payload)
@@ -0,0 +1,69 @@
+import importlib
+import logging
+import time
+
+from openleadr.messaging import (
+    TEMPLATES,
+    create_message,
+    parse_message,
+    validate_xml_schema,
+)
+
+logger = logging.getLogger("openleadr")
+
+_prewarmed = False
+
+
+class StartupTimer:
+    """
+    起動の段階ごとの所要時間を記録する。
+
+    started にはプロセスのなるべく早い時点（main.py の先頭など）の time.perf_counter() を渡す。
+    mark(name) は前の mark() から（最初は started から）の経過時間を name の段階として記録し、
+    report() で段階ごとの時間と合計をログに出す。
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = []
+        self._last = self.started
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def elapsed(self):
+        return self._last - self.started
+
+    def report(self):
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        logger.info("Started in %.0fms (%s)", self.elapsed * 1000, phases)
+
+
+def prewarm(modules=()):
+    """
+    最初のリクエストで初めて行われる準備を先に済ませる。2 回目以降の呼び出しでは何もしない。
+
+    - openleadr のメッセージのテンプレート（Jinja2）をすべてコンパイルする（1 つ数 ms）
+    - テンプレートの更新確認（メッセージを作るたびのファイルの stat）を止める
+    - メッセージを 1 つ作ってスキーマ検証とパースを通し、lxml と xmltodict の初回の処理を済ませる
+    - modules に挙げたモジュールを import する（prefork の親プロセスで読み込んでワーカーと共有する場合など）
+
+    XML スキーマは openleadr.messaging の import 時にコンパイルされる。
+    """
+    global _prewarmed
+    for module in modules:
+        importlib.import_module(module)
+    if _prewarmed:
+        return
+    for name in TEMPLATES.list_templates():
+        TEMPLATES.get_template(name)
+    # テンプレートはパッケージに含まれていて実行中に変わらない
+    TEMPLATES.auto_reload = False
+    # リクエストの処理（MyVTNService.handle_request）と同じく、スキーマ検証してからパースする
+    message = create_message("oadrPoll", ven_id="prewarm").encode()
+    validate_xml_schema(message)
+    parse_message(message)
+    _prewarmed = True
@@ -0,0 +1,386 @@
+import asyncio
+import gc
+import io
+import logging
+import os
+import pickle
+import struct
+import time
+import types
+
+from openleadr_impl.diagnostics.metrics import state_counts
+from openleadr_impl.server import STATE_LAYOUT
+from openleadr_impl.service.vtn_service import MyVTNService
+
+logger = logging.getLogger("openleadr")
+
+MAGIC = b"VTNSNAP"
+VERSION = 1
+_HEADER = struct.Struct(">7sB")
+# save_in_background() の子プロセスが、コールバックを MissingCallback に置き換えて保存したときの終了コード
+_EXIT_MISSING_CALLBACKS = 3
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class MissingCallback:
+    """
+    スナップショットに記録された名前のコールバックが登録されていない場合の代わり。
+    呼ばれると警告を出して何もしない（他の状態の復元は続ける）。
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        logger.warning(
+            "The callback '%s' from the snapshot is not registered; ignoring the call",
+            self.name,
+        )
+
+    def __reduce__(self):
+        return MissingCallback, (self.name,)
+
+
+class CallbackRegistry:
+    """
+    コールバックを名前で登録しておき、スナップショットには関数ではなく名前を書く。
+
+    - functools.partial は関数部分だけが名前になり、引数はそのまま保存される
+      （main.on_register_report が返す partial も、関数を登録しておけば保存できる）
+    - 復元時は同じ名前で登録された関数に結び直すため、関数の移動や改名があっても名前を保てばよい
+    - 登録されていないモジュールレベルの関数は通常の pickle（モジュールと関数名）で保存される
+    """
+
+    def __init__(self):
+        self._by_name = {}
+        self._names = {}
+        self._reported = set()
+
+    def register(self, name=None, callback=None):
+        """
+        register("name", func) または @register("name") / @register() として使う。
+        name を省略すると "モジュール名.関数名" になる。
+        """
+
+        def decorator(callback):
+            callback_name = name or f"{callback.__module__}.{callback.__qualname__}"
+            self._by_name[callback_name] = callback
+            self._names[id(callback)] = callback_name
+            return callback
+
+        if callback is not None:
+            return decorator(callback)
+        return decorator
+
+    def name_of(self, callback):
+        name = self._names.get(id(callback))
+        if name is not None and self._by_name[name] is callback:
+            return name
+        return None
+
+    def resolve(self, name):
+        try:
+            return self._by_name[name]
+        except KeyError:
+            logger.warning(
+                "The callback '%s' is not registered; it will be ignored", name
+            )
+            return MissingCallback(name)
+
+    def report_unsaved(self, names):
+        """
+        スナップショットに保存できず MissingCallback に置き換えたコールバックを、名前ごとに一度だけ警告する。
+        """
+        for name in sorted(set(names) - self._reported):
+            self._reported.add(name)
+            logger.warning(
+                "The callback '%s' cannot be saved in the snapshot; register it with "
+                "the CallbackRegistry, it is restored as a MissingCallback",
+                name,
+            )
+
+
+# コールバックを値に持つ状態と、値のうちコールバックの位置（None は値そのもの）
+_CALLBACK_STATE = {
+    "event_service.event_callbacks": 1,
+    "event_service.event_delivery_callbacks": None,
+    "report_service.report_callbacks": None,
+}
+
+
+def _callback_name(callback):
+    callback = getattr(callback, "func", callback)
+    if hasattr(callback, "__qualname__"):
+        return f"{callback.__module__}.{callback.__qualname__}"
+    return f"{type(callback).__module__}.{type(callback).__qualname__}"
+
+
+def _callback_by_name(name):
+    # 読み込み時は _Unpickler.find_class() が registry.resolve に置き換える
+    raise SnapshotError(f"The callback '{name}' can only be restored with its registry")
+
+
+class _Pickler(pickle.Pickler):
+    """
+    登録済みのコールバックを _callback_by_name(name) として保存する Pickler。
+
+    persistent_id() は str や dict を含むすべてのオブジェクトで呼ばれて遅いため、
+    それらを除いたオブジェクトでだけ呼ばれる reducer_override() を使う。
+    """
+
+    def __init__(self, file, registry):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.registry = registry
+        # MissingCallback に置き換えたコールバックの名前
+        self.missing = set()
+
+    def reducer_override(self, obj):
+        if type(obj) is types.FunctionType:
+            name = self.registry.name_of(obj)
+            if name is not None:
+                return _callback_by_name, (name,)
+            # lambda や関数内で定義した関数はモジュールから読み込めないため保存できない
+            if "<" in obj.__qualname__:
+                return self._missing(obj)
+        elif isinstance(obj, asyncio.Future):
+            return self._missing(obj)
+        return NotImplemented
+
+    def _missing(self, callback):
+        name = _callback_name(callback)
+        self.missing.add(name)
+        return MissingCallback, (name,)
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, registry):
+        super().__init__(file)
+        self.registry = registry
+
+    def find_class(self, module, name):
+        if module == __name__ and name == "_callback_by_name":
+            return self.registry.resolve
+        return super().find_class(module, name)
+
+
+def _serialize(state, registry):
+    buffer = io.BytesIO()
+    buffer.write(_HEADER.pack(MAGIC, VERSION))
+    pickler = _Pickler(buffer, registry)
+    pickler.dump(state)
+    return buffer.getvalue(), pickler.missing
+
+
+def _replace_unsaved_callbacks(state, registry):
+    """
+    state のコールバックをエントリごとに直列化し、保存できないものを MissingCallback に置き換える。
+    置き換えたコールバックの名前を返す。エントリごとに直列化するため、全体の直列化に失敗したときだけ使う。
+    """
+    missing = set()
+    for key, position in _CALLBACK_STATE.items():
+        entries = state.get(key, {})
+        for entry_key, value in list(entries.items()):
+            callback = value if position is None else value[position]
+            pickler = _Pickler(io.BytesIO(), registry)
+            try:
+                pickler.dump(callback)
+            except Exception:
+                name = _callback_name(callback)
+                missing.add(name)
+                if position is None:
+                    entries[entry_key] = MissingCallback(name)
+                else:
+                    entries[entry_key] = (
+                        value[:position] + (MissingCallback(name),) + value[position + 1 :]
+                    )
+            missing |= pickler.missing
+    return missing
+
+
+def _dump(server, registry):
+    """
+    dump_state() の本体。ログを出さずに (バイト列, MissingCallback に置き換えたコールバックの名前) を返す。
+    fork した子プロセスからも呼ぶため、ここではロギングを使わないこと。
+    """
+    state = {}
+    with MyVTNService.state_lock:
+        for service_name, attributes in STATE_LAYOUT.items():
+            service = server.services[service_name]
+            for attribute in attributes:
+                state[f"{service_name}.{attribute}"] = dict(getattr(service, attribute))
+        outbound_queue = server.services["poll_service"].outbound_queue
+        state["poll_service.outbound_queue"] = dict(outbound_queue._queues)
+        try:
+            return _serialize(state, registry)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # 直列化できないコールバックがある。そのエントリだけを置き換えて直列化し直す
+            missing = _replace_unsaved_callbacks(state, registry)
+            data, more_missing = _serialize(state, registry)
+            return data, missing | more_missing
+
+
+def unsaved_callbacks(server, registry):
+    """
+    スナップショットに保存できず MissingCallback に置き換えられるコールバックの名前を返す。
+    """
+    with MyVTNService.state_lock:
+        state = {
+            key: dict(getattr(server.services[key.split(".")[0]], key.split(".")[1]))
+            for key in _CALLBACK_STATE
+        }
+    return _replace_unsaved_callbacks(state, registry)
+
+
+def dump_state(server, registry):
+    """
+    サーバーのサービスの状態（STATE_LAYOUT と送信待ちメッセージ）をバイト列にする。
+
+    登録されておらず直列化できないコールバック（lambda、関数内の関数、Future など）は
+    エントリごとに MissingCallback に置き換え、名前ごとに一度だけ警告する。
+    """
+    data, missing = _dump(server, registry)
+    registry.report_unsaved(missing)
+    return data
+
+
+def load_state(server, data, registry):
+    """
+    dump_state() の結果をサーバーに取り込む。スナップショットにある VEN の状態は置き換えられる。
+    """
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f"Unsupported snapshot format ({magic!r}, version {version})")
+    # 大量の小さなオブジェクトを作る間は循環参照 GC を止める（止めないと読み込み時間が倍近くになる）
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        file = io.BytesIO(data)
+        file.seek(_HEADER.size)
+        state = _Unpickler(file, registry).load()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    with MyVTNService.state_lock:
+        before = state_counts(server)
+        for service_name, attributes in STATE_LAYOUT.items():
+            service = server.services[service_name]
+            for attribute in attributes:
+                getattr(service, attribute).update(state.get(f"{service_name}.{attribute}", {}))
+        outbound_queue = server.services["poll_service"].outbound_queue
+        for ven_id, ven_queue in state.get("poll_service.outbound_queue", {}).items():
+            outbound_queue.restore(ven_id, ven_queue)
+        server.metrics.adjust_state(before, state_counts(server))
+    return state
+
+
+class Snapshotter:
+    """
+    サービスの状態をローカルファイルに定期的に保存し、起動時に読み込む。
+
+    - 保存は pickle（最新プロトコル）の 1 ファイル。一時ファイルに書いてから置き換えるため、
+      途中で落ちても前回のスナップショットが残る
+    - 定期保存は fork した子プロセスで行い、イベントループを止めない。停止時の保存はイベントループ上で行う
+    - コールバックは registry に登録した名前で保存する（CallbackRegistry を参照）
+
+    スナップショットは信頼できるローカルファイルとして扱うこと（pickle を読み込むため）。
+    """
+
+    def __init__(self, path, registry=None, interval=60.0):
+        self.path = path
+        self.registry = registry or CallbackRegistry()
+        self.interval = interval
+        self.last_saved = None
+        self.last_duration = None
+
+    async def save(self, server):
+        """
+        イベントループ上で状態を直列化して保存する（停止時に使う）。保存したバイト数を返す。
+        """
+        started = time.perf_counter()
+        data = dump_state(server, self.registry)
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        self._saved(started)
+        return len(data)
+
+    async def save_in_background(self, server):
+        """
+        fork した子プロセスで状態を直列化して保存する（定期保存に使う）。
+
+        子プロセスは fork した時点のメモリ（コピーオンライト）を読むため、一貫した状態を
+        イベントループを止めずに保存できる。保存できた場合は True を返す。
+
+        fork した時点で他のスレッド（ログの書き込みスレッドなど）が持っていたロックは子プロセスでは
+        解放されないため、子プロセスはロギングを使わず、結果を終了コードだけで返す
+        （0: 保存した、_EXIT_MISSING_CALLBACKS: コールバックを置き換えて保存した、それ以外: 失敗）。
+        置き換えたコールバックの名前は親プロセスで調べて警告する。
+        """
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                data, missing = _dump(server, self.registry)
+                self._write(data)
+                code = _EXIT_MISSING_CALLBACKS if missing else 0
+            finally:
+                os._exit(code)
+        _pid, status = await asyncio.get_running_loop().run_in_executor(
+            None, os.waitpid, pid, 0
+        )
+        code = os.waitstatus_to_exitcode(status)
+        if code == _EXIT_MISSING_CALLBACKS:
+            self.registry.report_unsaved(unsaved_callbacks(server, self.registry))
+        elif code != 0:
+            return False
+        self._saved(started)
+        return True
+
+    def _saved(self, started):
+        self.last_saved = time.time()
+        self.last_duration = time.perf_counter() - started
+
+    def _write(self, data):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+    def restore(self, server):
+        """
+        スナップショットがあれば読み込む。読み込んだ場合は True を返す。
+        壊れている場合は警告を出して読み込まずに False を返す（空の状態で起動する）。
+        """
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return False
+        started = time.perf_counter()
+        try:
+            state = load_state(server, data, self.registry)
+        except Exception as err:
+            logger.warning(
+                "Could not restore the snapshot %s: %s: %s",
+                self.path,
+                err.__class__.__name__,
+                err,
+            )
+            return False
+        logger.info(
+            "Restored the state of %d VENs from %s in %.3fs",
+            len(state.get("event_service.events", {})),
+            self.path,
+            time.perf_counter() - started,
+        )
+        return True
+
+    async def run(self, server):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not await self.save_in_background(server):
+                logger.warning("Could not save the snapshot %s", self.path)
@@ -0,0 +1,59 @@
+import contextlib
+import multiprocessing
+
+
+class MemoryStore:
+    """
+    プロセス内の dict に状態を持つストア（既定の動作と同じ）。
+    """
+
+    def __init__(self):
+        self._namespaces = {}
+
+    def namespace(self, name):
+        return self._namespaces.setdefault(name, {})
+
+    def lock(self):
+        return contextlib.nullcontext()
+
+
+class SharedStore:
+    """
+    multiprocessing.Manager のプロセスに状態を持ち、fork したワーカー間で共有するストア。
+
+    - namespaces はワーカーを fork する前にすべて作っておく（fork 後に作った名前空間は他のワーカーから見えない）
+    - namespace() が返すのは dict のプロキシで、値は取り出すたびにコピーになる。
+      値を変更した場合は必ず代入し直すこと（store[key].append(x) は反映されない）
+    - 値は pickle できる必要がある。コールバックはモジュールレベルの関数（またはその partial）にすること
+    - 読み出し・変更・代入をまとめて行う箇所は lock() の中で行う（lock の中で await しないこと）
+    - プロキシの操作とロックの取得はそれぞれ Manager プロセスとの往復になる。oadrPoll の処理では
+      送信待ちがない VEN についてロックを取らない（OutboundQueue.pop を参照）
+
+    共有するのは STATE_LAYOUT の状態と送信待ちメッセージだけで、次のものはワーカーごとに持つ。
+    どのワーカーにリクエストが届くかはカーネル（SO_REUSEPORT）が決めるため、その影響を受ける。
+      - IdempotencyCache: 再送が別のワーカーに届くと、もう一度処理される
+      - RateLimiter: 1 台の VEN が使える量は、ワーカー数まで設定の倍数になり得る
+      - LivenessTracker: 他のワーカーが受けたリクエストは見えないため、オフラインの判定が早まることがある
+        （push_events() や request_report(skip_offline=True) の対象から外れる）
+      - VenRegistry: 各ワーカーが起動時に読み込み、それぞれ差分を取り込む。登録・登録解除は
+        処理したワーカーだけにすぐ反映され、他のワーカーには次の差分の取り込みで反映される
+    """
+
+    def __init__(self, namespaces):
+        self._manager = multiprocessing.Manager()
+        self._namespaces = {name: self._manager.dict() for name in namespaces}
+        self._lock = self._manager.RLock()
+
+    def namespace(self, name):
+        try:
+            return self._namespaces[name]
+        except KeyError:
+            raise KeyError(
+                f"The namespace '{name}' must be declared when the SharedStore is created."
+            ) from None
+
+    def lock(self):
+        return self._lock
+
+    def shutdown(self):
+        self._manager.shutdown()
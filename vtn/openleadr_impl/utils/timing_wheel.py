@@ -0,0 +1,60 @@
+class TimingWheel:
+    """
+    ハッシュ化タイミングホイール。キーごとに 1 つの期限を持ち、期限切れのキーを advance() で取り出す。
+
+    - schedule() / cancel() は O(1)
+    - advance() は経過した tick のスロットだけを見る（全キーの走査はしない）
+    - 1 周（tick * slots 秒）より先の期限は、スロットを通過しても期限まで残り続ける
+
+    時刻は単調増加する秒数（time.monotonic() など）で扱う。
+    """
+
+    def __init__(self, tick=1.0, slots=512, now=0.0):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._deadline_ticks = {}
+        self._current_tick = self._tick_of(now)
+
+    def __len__(self):
+        return len(self._deadline_ticks)
+
+    def __contains__(self, key):
+        return key in self._deadline_ticks
+
+    def _tick_of(self, seconds):
+        return int(seconds // self.tick)
+
+    def schedule(self, key, deadline):
+        """
+        key の期限を deadline に設定する。既に登録されている場合は期限を置き換える。
+        """
+        self.cancel(key)
+        # 過去の期限は次の tick で取り出す
+        deadline_tick = max(self._tick_of(deadline), self._current_tick + 1)
+        self._deadline_ticks[key] = deadline_tick
+        self._slots[deadline_tick % len(self._slots)].add(key)
+
+    def cancel(self, key):
+        deadline_tick = self._deadline_ticks.pop(key, None)
+        if deadline_tick is not None:
+            self._slots[deadline_tick % len(self._slots)].discard(key)
+
+    def advance(self, now):
+        """
+        現在時刻を now まで進め、期限切れになったキーのリストを返す。
+        """
+        target_tick = self._tick_of(now)
+        if target_tick <= self._current_tick:
+            return []
+        # 1 周以上進んだ場合も、各スロットを見るのは 1 回だけでよい
+        ticks = min(target_tick - self._current_tick, len(self._slots))
+        expired = []
+        for offset in range(1, ticks + 1):
+            slot = self._slots[(self._current_tick + offset) % len(self._slots)]
+            due = [key for key in slot if self._deadline_ticks[key] <= target_tick]
+            for key in due:
+                slot.discard(key)
+                del self._deadline_ticks[key]
+            expired.extend(due)
+        self._current_tick = target_tick
+        return expired
@@ -1,5 +1,7 @@
+from functools import lru_cache
 from http import HTTPStatus
 import hashlib
+import hmac
 
 from urllib.parse import unquote
 from cryptography import x509
@@ -20,6 +22,16 @@ def get_certificate_fingerprint_from_alb_header(request):
             description="Client certificate is missing. Mutual TLS authentication is required",
         )
 
+    return _fingerprint_from_leaf(leaf_enc)
+
+
+@lru_cache(maxsize=4096)
+def _fingerprint_from_leaf(leaf_enc):
+    """
+    ヘッダー値からフィンガープリントを計算する。
+    同じ証明書からのリクエストでは証明書のパースを省略できるよう、ヘッダー値をキーにキャッシュする。
+    （不正な証明書で送出した例外はキャッシュされない）
+    """
     try:
         # 1) URLデコード → PEMテキスト
         leaf_pem = unquote(leaf_enc).encode("utf-8")
@@ -37,3 +49,11 @@ def get_certificate_fingerprint_from_alb_header(request):
         )
 
     return ":".join(f"{b:02X}" for b in h)
+
+
+def bearer_token_authorized(request, token):
+    """
+    Authorization ヘッダーが "Bearer <token>" かどうかを返す（管理用エンドポイント向け）。
+    """
+    supplied = request.headers.get("Authorization", "")
+    return hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode())
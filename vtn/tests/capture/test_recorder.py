@@ -0,0 +1,121 @@
+import asyncio
+import gzip
+import os
+
+import pytest
+from openleadr.messaging import create_message
+
+from openleadr_impl.capture.recorder import TrafficRecorder, read_capture
+from openleadr_impl.service.report_service import ReportService
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+        self.remote = "10.0.0.1"
+        self.path = "/OpenADR2/Simple/2.0b/EiReport"
+
+    async def read(self):
+        return self._body
+
+
+async def handle_message(message_type, payload):
+    return "oadrRegisteredReport", {"report_requests": []}
+
+
+def make_service():
+    service = ReportService("test-vtn")
+    service._create_message = create_message
+    service.handle_message = handle_message
+    return service
+
+
+def register_report(request_id):
+    return create_message(
+        "oadrRegisterReport", ven_id="ven-1", request_id=request_id, reports=[]
+    ).encode()
+
+
+class TestTrafficRecorder:
+    @pytest.mark.asyncio
+    async def test_records_requests_and_responses(self, tmp_path):
+        recorder = TrafficRecorder(str(tmp_path))
+        recorder.start()
+        service = make_service()
+        body = register_report("req-1")
+        headers = {
+            "content-type": "application/xml",
+            "X-Amzn-Mtls-Clientcert-Leaf": "leaf",
+            "Authorization": "secret",
+        }
+        try:
+            response = await service.handler(DummyRequest(headers, body))
+            # フックはタスクとして動く
+            await asyncio.sleep(0.01)
+        finally:
+            await recorder.close()
+
+        records = list(read_capture([str(tmp_path)]))
+        assert len(records) == 1
+        assert records[0]["body"] == body
+        assert records[0]["path"] == "/OpenADR2/Simple/2.0b/EiReport"
+        assert records[0]["response"] == response.text
+        assert dict(records[0]["headers"]) == {
+            "content-type": "application/xml",
+            "X-Amzn-Mtls-Clientcert-Leaf": "leaf",
+        }
+        assert recorder.recorded == 1
+
+    @pytest.mark.asyncio
+    async def test_rotates_and_keeps_the_newest_files(self, tmp_path):
+        recorder = TrafficRecorder(str(tmp_path), max_bytes=1, max_files=3)
+        recorder.start()
+        service = make_service()
+        try:
+            for i in range(5):
+                await service.handler(
+                    DummyRequest(
+                        {"content-type": "application/xml"}, register_report(f"req-{i}")
+                    )
+                )
+                await asyncio.sleep(0.01)
+        finally:
+            await recorder.close()
+
+        assert len(os.listdir(tmp_path)) == 3
+        bodies = [record["body"] for record in read_capture([str(tmp_path)])]
+        assert bodies == [register_report(f"req-{i}") for i in (2, 3, 4)]
+
+    @pytest.mark.asyncio
+    async def test_close_removes_the_hooks(self, tmp_path):
+        recorder = TrafficRecorder(str(tmp_path))
+        recorder.start()
+        await recorder.close()
+
+        await make_service().handler(
+            DummyRequest({"content-type": "application/xml"}, register_report("req-1"))
+        )
+        await asyncio.sleep(0.01)
+
+        assert recorder.recorded == 0
+
+    def test_reads_truncated_files_and_merges_by_time(self, tmp_path):
+        first = tmp_path / "worker-0"
+        second = tmp_path / "worker-1"
+        first.mkdir()
+        second.mkdir()
+        lines = {
+            first: ['{"t":1,"path":"","headers":[],"body":"a","response":""}'],
+            second: ['{"t":2,"path":"","headers":[],"body":"b","response":""}'],
+        }
+        for directory, records in lines.items():
+            with gzip.open(directory / "capture-1-0000.jsonl.gz", "wt") as file:
+                file.write("\n".join(records) + "\n")
+        # 書き込み途中で止まったファイル
+        data = gzip.compress(b'{"t":3,"path":"","headers":[],"body":"c","response":""}\n')
+        (first / "capture-2-0001.jsonl.gz").write_bytes(data[:-8])
+
+        records = list(read_capture([str(first), str(second)]))
+
+        assert [record["body"] for record in records] == [b"a", b"b", b"c"]
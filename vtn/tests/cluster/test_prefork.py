@@ -0,0 +1,69 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from openleadr_impl.cluster.prefork import serve_prefork
+from openleadr_impl.server import MyOpenADRServer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_server_on(port):
+    def make_server(index):
+        server = MyOpenADRServer(
+            vtn_id="test-vtn", http_host="127.0.0.1", http_port=port
+        )
+
+        async def pid(request):
+            return web.Response(text=str(os.getpid()))
+
+        server.app.router.add_get("/pid", pid)
+        return server
+
+    return make_server
+
+
+def run_launcher(port, workers):
+    serve_prefork(make_server_on(port), workers=workers)
+
+
+class TestServePrefork:
+    @pytest.mark.asyncio
+    async def test_workers_share_the_port(self):
+        port = free_port()
+        launcher = multiprocessing.get_context("fork").Process(
+            target=run_launcher, args=(port, 2)
+        )
+        launcher.start()
+        try:
+            pids = set()
+            deadline = time.monotonic() + 10
+            while len(pids) < 2 and time.monotonic() < deadline:
+                # 接続ごとにワーカーが選ばれるよう、keep-alive を使わない
+                async with aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(force_close=True)
+                ) as session:
+                    try:
+                        url = f"http://127.0.0.1:{port}/pid"
+                        async with session.get(url) as response:
+                            pids.add(await response.text())
+                    except aiohttp.ClientConnectionError:
+                        await asyncio.sleep(0.05)
+
+            assert len(pids) == 2
+        finally:
+            os.kill(launcher.pid, signal.SIGTERM)
+            launcher.join(timeout=10)
+
+        assert launcher.exitcode == 0
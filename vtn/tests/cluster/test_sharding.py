@@ -0,0 +1,267 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from openleadr.messaging import create_message
+
+from openleadr_impl.cluster.migration import (
+    VenMigrating,
+    add_migration_routes,
+    export_ven_state,
+    forget_ven_state,
+    import_ven_state,
+    rebalance,
+)
+from openleadr_impl.cluster.sharding import HashRing, ShardRouter, moved_vens
+from openleadr_impl.server import MyOpenADRServer
+
+TOKEN = "test-token"
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def add_event(server, ven_id):
+    return server.add_event(
+        ven_id=ven_id,
+        signal_name="simple",
+        signal_type="level",
+        intervals=[
+            {
+                "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                "duration": timedelta(minutes=5),
+                "signal_payload": 1,
+            }
+        ],
+        callback=on_event_response,
+    )
+
+
+class TestHashRing:
+    def test_spreads_and_moves_about_one_nth(self):
+        ven_ids = [f"ven-{i}" for i in range(10_000)]
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {shard: 0 for shard in ring.shards}
+        for ven_id in ven_ids:
+            counts[ring.shard_for(ven_id)] += 1
+
+        grown = ring.copy()
+        grown.add("e")
+        moves = moved_vens(ring, grown, ven_ids)
+
+        assert min(counts.values()) > 10_000 / 4 * 0.75
+        # 移動するのは新しいシャードへの分だけで、およそ 1/5
+        assert {target for _source, target in moves} == {"e"}
+        moved = sum(len(vens) for vens in moves.values())
+        assert 10_000 / 5 * 0.7 < moved < 10_000 / 5 * 1.3
+
+    def test_remove_and_empty(self):
+        ring = HashRing(["a", "b"])
+        ring.remove("b")
+
+        assert {ring.shard_for(f"ven-{i}") for i in range(100)} == {"a"}
+        with pytest.raises(LookupError):
+            HashRing().shard_for("ven-1")
+
+
+class TestMigration:
+    def test_roundtrip_moves_events_queue_and_callbacks(self):
+        source = MyOpenADRServer(vtn_id="test-vtn")
+        target = MyOpenADRServer(vtn_id="test-vtn")
+        event_id = add_event(source, "ven-1")
+        add_event(source, "ven-2")
+        source.request_reregistration("ven-1")
+
+        import_ven_state(target, export_ven_state(source, ["ven-1"]))
+        forget_ven_state(source, ["ven-1"])
+
+        assert target.events["ven-1"][0].event_descriptor.event_id == event_id
+        assert target.services["event_service"].event_callbacks[event_id][1] is (
+            on_event_response
+        )
+        assert target.services["poll_service"].outbound_queue.pending("ven-1") == 1
+        assert "ven-1" not in source.events
+        assert event_id not in source.services["event_service"].event_callbacks
+        assert len(source.services["event_service"].event_callbacks) == 1
+        assert source.services["poll_service"].outbound_queue.pending("ven-1") == 0
+
+
+class ShardServer:
+    def __init__(self, name):
+        self.name = name
+        self.server = MyOpenADRServer(vtn_id="test-vtn")
+        add_migration_routes(self.server, TOKEN)
+        self.server.app.router.add_post("/test/shard-name", self.poll)
+        self.test_server = TestServer(self.server.app)
+
+    async def poll(self, request):
+        return web.Response(text=self.name)
+
+    @property
+    def url(self):
+        return str(self.test_server.make_url("")).rstrip("/")
+
+
+class HookedSession:
+    """
+    rebalance() に渡すセッション。URL が suffix で終わるリクエストの前に hook を呼ぶ。
+    """
+
+    def __init__(self, session, suffix, hook):
+        self.session = session
+        self.suffix = suffix
+        self.hook = hook
+
+    def post(self, url, **kwargs):
+        return _HookedRequest(self, url, kwargs)
+
+
+class _HookedRequest:
+    def __init__(self, hooked, url, kwargs):
+        self.hooked = hooked
+        self.url = url
+        self.kwargs = kwargs
+
+    async def __aenter__(self):
+        if self.url.endswith(self.hooked.suffix):
+            await self.hooked.hook()
+        self.request = self.hooked.session.post(self.url, **self.kwargs)
+        return await self.request.__aenter__()
+
+    async def __aexit__(self, *exc_info):
+        return await self.request.__aexit__(*exc_info)
+
+
+@pytest_asyncio.fixture
+async def shards():
+    servers = [ShardServer(name) for name in ("a", "b", "c")]
+    for server in servers:
+        await server.test_server.start_server()
+    yield servers
+    for server in servers:
+        await server.test_server.close()
+
+
+class TestShardRouter:
+    @pytest.mark.asyncio
+    async def test_routes_by_ven_id_and_rebalances(self, shards):
+        names = {shard.url: shard.name for shard in shards}
+        router = ShardRouter(HashRing([shard.url for shard in shards[:2]]))
+        router_server = TestServer(router.app)
+        await router_server.start_server()
+        ven_ids = [f"ven-{i}" for i in range(30)]
+        servers = {shard.url: shard.server for shard in shards}
+        for ven_id in ven_ids:
+            add_event(servers[router.ring.shard_for(ven_id)], ven_id)
+
+        async def poll(session, ven_id):
+            async with session.post(
+                router_server.make_url("/test/shard-name"),
+                data=create_message("oadrPoll", ven_id=ven_id),
+            ) as response:
+                return await response.text()
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                for ven_id in ven_ids:
+                    assert await poll(session, ven_id) == names[router.ring.shard_for(ven_id)]
+                async with session.get(
+                    router_server.make_url("/cluster/shard"), params={"ven_id": "ven-1"}
+                ) as response:
+                    assert (await response.json())["shard"] == router.ring.shard_for("ven-1")
+
+                new_ring = router.ring.copy()
+                new_ring.add(shards[2].url)
+                moved = await rebalance(router, new_ring, ven_ids, TOKEN)
+
+                moved_to_c = [v for v in ven_ids if new_ring.shard_for(v) == shards[2].url]
+                assert sum(moved.values()) == len(moved_to_c) > 0
+                assert sorted(shards[2].server.events) == sorted(moved_to_c)
+                for ven_id in ven_ids:
+                    assert await poll(session, ven_id) == names[new_ring.shard_for(ven_id)]
+        finally:
+            await router_server.close()
+
+    @pytest.mark.asyncio
+    async def test_source_changes_during_rebalance_are_not_lost(self, shards):
+        router = ShardRouter(HashRing([shards[0].url]))
+        router_server = TestServer(router.app)
+        await router_server.start_server()
+        source, target = shards[0].server, shards[1].server
+        ven_ids = [f"ven-{i}" for i in range(20)]
+        for ven_id in ven_ids:
+            add_event(source, ven_id)
+        new_ring = HashRing([shards[0].url, shards[1].url])
+        moving = [v for v in ven_ids if new_ring.shard_for(v) == shards[1].url]
+        staying = [v for v in ven_ids if v not in moving]
+        held_polls = []
+
+        async def poll(session, ven_id):
+            async with session.post(
+                router_server.make_url("/test/shard-name"),
+                data=create_message("oadrPoll", ven_id=ven_id),
+            ) as response:
+                return await response.text()
+
+        async def between_export_and_switch():
+            # VEN からのリクエストは切り替えまで待たされ、移動元での変更は拒否される
+            held_polls.append(asyncio.create_task(poll(session, moving[0])))
+            await asyncio.sleep(0.05)
+            assert not held_polls[0].done()
+            with pytest.raises(VenMigrating):
+                add_event(source, moving[0])
+            with pytest.raises(VenMigrating):
+                source.cancel_event(moving[0], "event-1")
+            add_event(source, staying[0])
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                hooked = HookedSession(router._session, "/cluster/import", between_export_and_switch)
+                await rebalance(router, new_ring, ven_ids, TOKEN, session=hooked)
+
+                assert await held_polls[0] == "b"
+                assert sorted(target.events) == sorted(moving)
+                assert len(source.events[staying[0]]) == 2
+                # 移行した後も、移動元で追加したイベントは VEN に届かないため拒否する
+                with pytest.raises(VenMigrating):
+                    add_event(source, moving[0])
+                add_event(target, moving[0])
+                assert len(target.events[moving[0]]) == 2
+        finally:
+            await router_server.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_rebalance_thaws_the_source(self, shards):
+        router = ShardRouter(HashRing([shards[0].url]))
+        router_server = TestServer(router.app)
+        await router_server.start_server()
+        source = shards[0].server
+        ven_ids = [f"ven-{i}" for i in range(20)]
+        for ven_id in ven_ids:
+            add_event(source, ven_id)
+        old_ring = router.ring
+        # 移動先が止まっている
+        new_ring = HashRing([shards[0].url, "http://127.0.0.1:9"])
+        try:
+            with pytest.raises(aiohttp.ClientError):
+                await rebalance(router, new_ring, ven_ids, TOKEN)
+            assert router.ring is old_ring
+            assert source.frozen_vens == set()
+            assert sorted(source.events) == sorted(ven_ids)
+        finally:
+            await router_server.close()
+
+    @pytest.mark.asyncio
+    async def test_migration_routes_require_token(self, shards):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{shards[0].url}/cluster/import",
+                data=b"not a pickle",
+                headers={"Authorization": "Bearer wrong"},
+            ) as response:
+                assert response.status == 403
@@ -0,0 +1,284 @@
+import asyncio
+import time
+from datetime import timedelta
+from http import HTTPStatus
+
+import pytest
+from aiohttp import web
+
+from openleadr_impl.control.admission import (
+    DEFAULT_PRIORITIES,
+    AdmissionController,
+    AdmissionRejected,
+)
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.service import vtn_service
+from openleadr_impl.service.vtn_service import MyVTNService
+from openleadr_impl.service.registration_service import RegistrationService
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+
+class TestAdmissionController:
+    @pytest.mark.asyncio
+    async def test_admits_up_to_max_concurrency(self):
+        controller = AdmissionController(max_concurrency=2)
+
+        await controller.acquire()
+        await controller.acquire()
+
+        assert controller.active == 2
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire()
+
+    @pytest.mark.asyncio
+    async def test_queued_request_gets_slot_on_release(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1)
+        await controller.acquire()
+
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+
+        controller.release()
+        await waiter
+
+        assert controller.active == 1
+        assert controller.queued == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_deadline_rejects(self):
+        controller = AdmissionController(
+            max_concurrency=1, max_queue=1, queue_timeout=0.01, retry_after=3
+        )
+        await controller.acquire()
+
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire()
+
+        assert 3 <= excinfo.value.retry_after <= 6
+        assert controller.queued == 0
+        controller.release()
+        assert controller.active == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_leak_slot(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1)
+        await controller.acquire()
+
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        controller.release()
+        assert controller.active == 0
+
+
+class TestRegistrationStorm:
+    @pytest.mark.asyncio
+    async def test_10k_simultaneous_registrations(self, monkeypatch):
+        max_concurrency = 50
+        max_queue = 2000
+        vens = 10_000
+
+        service = RegistrationService(
+            "test-vtn", poll_freq=timedelta(seconds=10), poll_freq_jitter=0.5
+        )
+        service.admission_controller = AdmissionController(
+            max_concurrency=max_concurrency, max_queue=max_queue, queue_timeout=5.0
+        )
+
+        rendered = []
+
+        def create_message(message_type, **payload):
+            rendered.append(payload)
+            return "<xml/>"
+
+        service._create_message = create_message
+
+        in_flight = 0
+        peak = 0
+
+        async def on_create_party_registration(payload):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return payload["ven_name"], "reg"
+
+        service.on_create_party_registration = on_create_party_registration
+
+        monkeypatch.setattr(vtn_service, "validate_xml_schema", lambda content: None)
+        monkeypatch.setattr(
+            vtn_service,
+            "parse_message",
+            lambda content: (
+                "oadrCreatePartyRegistration",
+                {
+                    "request_id": content.decode(),
+                    "ven_name": content.decode(),
+                    "profile_name": "2.0b",
+                    "transport_name": "simpleHttp",
+                },
+            ),
+        )
+        monkeypatch.setattr(
+            vtn_service.myUtils,
+            "get_certificate_fingerprint_from_alb_header",
+            lambda request: "AA:BB",
+        )
+
+        responses = await asyncio.gather(
+            *[
+                service.handler(
+                    DummyRequest(
+                        headers={"content-type": "application/xml"},
+                        body=f"ven-{i}".encode(),
+                    )
+                )
+                for i in range(vens)
+            ]
+        )
+
+        accepted = [r for r in responses if r.status == HTTPStatus.OK]
+        shed = [r for r in responses if r.status == HTTPStatus.SERVICE_UNAVAILABLE]
+
+        assert len(accepted) + len(shed) == vens
+        assert len(accepted) == max_concurrency + max_queue
+        assert peak <= max_concurrency
+        assert all(5 <= int(r.headers["Retry-After"]) <= 10 for r in shed)
+        assert len({r.headers["Retry-After"] for r in shed}) > 1
+        assert service.admission_controller.active == 0
+
+        poll_freqs = {p["requested_oadr_poll_freq"] for p in rendered}
+        assert min(poll_freqs) >= timedelta(seconds=10)
+        assert max(poll_freqs) <= timedelta(seconds=15)
+        assert len(poll_freqs) > 1
+
+
+class TestAdmissionPriority:
+    @pytest.mark.asyncio
+    async def test_release_prefers_higher_priority(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=2)
+        await controller.acquire()
+
+        order = []
+
+        async def wait(priority):
+            await controller.acquire(priority)
+            order.append(priority)
+
+        low = asyncio.create_task(wait(2))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(wait(0))
+        await asyncio.sleep(0)
+
+        controller.release()
+        await high
+        controller.release()
+        await low
+
+        assert order == [0, 2]
+
+    @pytest.mark.asyncio
+    async def test_full_queue_displaces_lower_priority(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1)
+        await controller.acquire()
+        low = asyncio.create_task(controller.acquire(2))
+        await asyncio.sleep(0)
+
+        high = asyncio.create_task(controller.acquire(0))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected):
+            await low
+        controller.release()
+        await high
+        assert controller.shed == {2: 1}
+        assert controller.admitted == {0: 2}
+
+    @pytest.mark.asyncio
+    async def test_full_queue_rejects_same_priority(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1)
+        await controller.acquire(0)
+        waiter = asyncio.create_task(controller.acquire(0))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire(0)
+        controller.release()
+        await waiter
+
+
+class TestServiceAdmission:
+    def test_server_assigns_limits_and_priorities(self):
+        event_admission = AdmissionController(max_concurrency=10)
+        report_admission = AdmissionController(max_concurrency=5)
+        registration_admission = AdmissionController(max_concurrency=2)
+        server = MyOpenADRServer(
+            vtn_id="test-vtn",
+            admission={"EiEvent": event_admission, "EiReport": report_admission},
+            registration_admission=registration_admission,
+            admission_priorities={"EiRegisterParty": 3},
+        )
+        services = server.services
+
+        assert services["event_service"].admission_controller is event_admission
+        assert services["report_service"].admission_controller is report_admission
+        assert (
+            services["registration_service"].admission_controller
+            is registration_admission
+        )
+        assert services["poll_service"].admission_controller is None
+        assert services["poll_service"].admission_priority == 0
+        assert services["report_service"].admission_priority == 2
+        assert services["registration_service"].admission_priority == 3
+
+    @pytest.mark.asyncio
+    async def test_polls_keep_bounded_latency_under_report_flood(self, monkeypatch):
+        shared = AdmissionController(max_concurrency=4, max_queue=20, queue_timeout=5.0)
+        report_service = MyVTNService("test-vtn")
+        report_service.admission_priority = DEFAULT_PRIORITIES["EiReport"]
+        poll_service = MyVTNService("test-vtn")
+        poll_service.admission_priority = DEFAULT_PRIORITIES["OadrPoll"]
+        monkeypatch.setattr(MyVTNService, "shared_admission", shared)
+
+        async def handle_request(request):
+            await asyncio.sleep(0.01)
+            return web.Response(status=HTTPStatus.OK)
+
+        report_service.handle_request = handle_request
+        poll_service.handle_request = handle_request
+
+        async def timed(service):
+            started = time.perf_counter()
+            response = await service.handler(None)
+            return response.status, time.perf_counter() - started
+
+        reports = [asyncio.create_task(timed(report_service)) for _ in range(500)]
+        await asyncio.sleep(0)
+        polls = []
+        for _ in range(20):
+            polls.append(asyncio.create_task(timed(poll_service)))
+            await asyncio.sleep(0.005)
+
+        poll_results = await asyncio.gather(*polls)
+        report_results = await asyncio.gather(*reports)
+
+        assert all(status == HTTPStatus.OK for status, _ in poll_results)
+        # 実行中の oadrUpdateReport が終わるのを待つだけで、待ち行列の後ろには並ばない
+        assert max(latency for _, latency in poll_results) < 0.1
+        assert any(
+            status == HTTPStatus.SERVICE_UNAVAILABLE for status, _ in report_results
+        )
+        assert shared.active == 0
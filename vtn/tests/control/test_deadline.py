@@ -0,0 +1,196 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from openleadr.enums import STATUS_CODES
+from openleadr.messaging import create_message, parse_message
+
+from openleadr_impl.control.deadline import HandlerDeadlines, HandlerTimeout
+from openleadr_impl.control.idempotency import IdempotencyCache
+from openleadr_impl.diagnostics.metrics import VtnMetrics
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.service.report_service import ReportService
+from openleadr_impl.service.vtn_service import MyVTNService
+
+
+class TestHandlerDeadlines:
+    @pytest.mark.asyncio
+    async def test_slow_handler_is_cancelled(self):
+        deadlines = HandlerDeadlines({"oadrRegisterReport": 0.01})
+        cancelled = asyncio.Event()
+
+        async def handle():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with pytest.raises(HandlerTimeout):
+            await deadlines.run("oadrRegisterReport", handle)
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+        assert deadlines.timed_out["oadrRegisterReport"] == 1
+        assert deadlines.cancelled["oadrRegisterReport"] == 1
+
+    @pytest.mark.asyncio
+    async def test_detached_handler_keeps_running(self):
+        deadlines = HandlerDeadlines(
+            default=0.01, detach=("oadrCreatePartyRegistration",)
+        )
+        finished = asyncio.Event()
+
+        async def handle():
+            await asyncio.sleep(0.05)
+            finished.set()
+
+        with pytest.raises(HandlerTimeout):
+            await deadlines.run("oadrCreatePartyRegistration", handle)
+        assert deadlines.running_detached == 1
+
+        await asyncio.wait_for(finished.wait(), 1)
+        await asyncio.sleep(0)
+        assert deadlines.running_detached == 0
+        assert deadlines.detached["oadrCreatePartyRegistration"] == 1
+
+    @pytest.mark.asyncio
+    async def test_fast_and_unlimited_handlers(self):
+        deadlines = HandlerDeadlines({"oadrRegisterReport": 1.0})
+
+        async def handle():
+            return "done"
+
+        assert await deadlines.run("oadrRegisterReport", handle) == "done"
+        assert await deadlines.run("oadrPoll", handle) == "done"
+        assert not deadlines.timed_out
+
+    @pytest.mark.asyncio
+    async def test_cancelling_the_request_cancels_the_handler(self):
+        deadlines = HandlerDeadlines(default=10.0)
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def handle():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        request = asyncio.create_task(deadlines.run("oadrPoll", handle))
+        await started.wait()
+        request.cancel()
+
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+        self.remote = "10.0.0.1"
+
+    async def read(self):
+        return self._body
+
+
+class TestHandlerDeadlineResponse:
+    @pytest.mark.asyncio
+    async def test_timeout_returns_openadr_error(self):
+        service = ReportService("test-vtn")
+        service.handler_deadlines = HandlerDeadlines({"oadrRegisterReport": 0.01})
+        service._create_message = create_message
+
+        async def handle_message(message_type, payload):
+            await asyncio.sleep(10)
+
+        service.handle_message = handle_message
+        body = create_message(
+            "oadrRegisterReport", ven_id="ven-1", request_id="req-1", reports=[]
+        ).encode()
+
+        response = await service.handler(
+            DummyRequest({"content-type": "application/xml"}, body)
+        )
+
+        assert response.status == HTTPStatus.OK
+        message_type, payload = parse_message(response.text.encode())
+        assert message_type == "oadrResponse"
+        assert payload["response"]["response_code"] == (
+            STATUS_CODES.DEPLOYMENT_ERROR_OR_OTHER_ERROR
+        )
+
+    @pytest.mark.asyncio
+    async def test_retry_of_detached_handler_gets_its_response(self):
+        service = ReportService("test-vtn")
+        service.handler_deadlines = HandlerDeadlines(
+            {"oadrRegisterReport": 0.01}, detach=("oadrRegisterReport",)
+        )
+        service.idempotency_cache = IdempotencyCache()
+        service._create_message = create_message
+        release = asyncio.Event()
+        calls = []
+
+        async def handle_message(message_type, payload):
+            calls.append(message_type)
+            await release.wait()
+            return "oadrRegisteredReport", {"report_requests": []}
+
+        service.handle_message = handle_message
+        body = create_message(
+            "oadrRegisterReport", ven_id="ven-1", request_id="req-1", reports=[]
+        ).encode()
+
+        def request():
+            return service.handler(DummyRequest({"content-type": "application/xml"}, body))
+
+        timed_out = await request()
+        # 切り離された処理が終わるまで、再送は処理し直さずに待つ
+        retry = asyncio.create_task(request())
+        await asyncio.sleep(0.02)
+        assert not retry.done()
+        release.set()
+        retried = await retry
+
+        assert calls == ["oadrRegisterReport"]
+        assert parse_message(timed_out.text.encode())[0] == "oadrResponse"
+        assert parse_message(retried.text.encode())[0] == "oadrRegisteredReport"
+        assert (await request()).text == retried.text
+
+
+class TestHandlerDeadlineMetrics:
+    @pytest.mark.asyncio
+    async def test_counters_are_exported(self, monkeypatch):
+        # サーバーが MyVTNService に設定する handler_deadlines を、テストの後に元に戻す
+        monkeypatch.setattr(MyVTNService, "handler_deadlines", None)
+        deadlines = HandlerDeadlines({"oadrRegisterReport": 0.01})
+        server = MyOpenADRServer(
+            vtn_id="test-vtn", handler_deadlines=deadlines, metrics=VtnMetrics()
+        )
+
+        async def handle():
+            await asyncio.sleep(10)
+
+        with pytest.raises(HandlerTimeout):
+            await deadlines.run("oadrRegisterReport", handle)
+
+        lines = server.metrics.render().splitlines()
+        assert 'vtn_handler_timeouts_total{message_type="oadrRegisterReport"} 1' in lines
+        assert 'vtn_handler_cancelled_total{message_type="oadrRegisterReport"} 1' in lines
+        assert "vtn_handler_detached_running 0" in lines
+
+    def test_detached_types_must_be_idempotent(self, monkeypatch):
+        monkeypatch.setattr(MyVTNService, "handler_deadlines", None)
+        deadlines = HandlerDeadlines(default=1.0, detach=("oadrCreatePartyRegistration",))
+
+        for idempotency_cache in (None, IdempotencyCache()):
+            with pytest.raises(ValueError, match="oadrCreatePartyRegistration"):
+                MyOpenADRServer(
+                    vtn_id="test-vtn",
+                    handler_deadlines=deadlines,
+                    idempotency_cache=idempotency_cache,
+                )
+        HandlerDeadlines(detach=("oadrRegisterReport",)).check_detached_covered(
+            IdempotencyCache()
+        )
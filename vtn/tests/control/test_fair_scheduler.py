@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+
+import pytest
+from openleadr import errors
+
+from openleadr_impl.control.fair_scheduler import FairScheduler
+from openleadr_impl.diagnostics.metrics import VtnMetrics
+from openleadr_impl.service.report_service import ReportService
+
+
+async def run_until_idle(scheduler, timeout=5.0):
+    task = asyncio.create_task(scheduler.run())
+    try:
+        async with asyncio.timeout(timeout):
+            while scheduler.pending or scheduler.running:
+                await asyncio.sleep(0)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+class TestFairScheduler:
+    @pytest.mark.asyncio
+    async def test_heavy_ven_cannot_starve_light_vens(self):
+        scheduler = FairScheduler(workers=1, quantum=100, max_pending_per_ven=10_000)
+        done = []
+
+        def work(ven_id):
+            return lambda: done.append(ven_id)
+
+        # 重い VEN が先に大量の作業を積む
+        scheduler.submit_all("heavy", [(work("heavy"), 100) for _ in range(1000)])
+        for i in range(10):
+            scheduler.submit_all(
+                f"light-{i}", [(work(f"light-{i}"), 1) for _ in range(5)]
+            )
+
+        await run_until_idle(scheduler)
+
+        last_light = max(i for i, ven_id in enumerate(done) if ven_id != "heavy")
+        # 軽い VEN の作業 50 件は、重い VEN の作業が 1 巡分進む間にすべて終わる
+        assert done[: last_light + 1].count("heavy") <= 1
+        assert scheduler.served_items["heavy"] == 1000
+        assert scheduler.fairness_index([f"light-{i}" for i in range(10)]) == 1.0
+
+    @pytest.mark.asyncio
+    async def test_share_follows_quantum_while_backlogged(self):
+        scheduler = FairScheduler(workers=1, quantum=10, weights={"b": 2})
+        order = []
+        for ven_id in ("a", "b"):
+            scheduler.submit_all(
+                ven_id, [(lambda v=ven_id: order.append(v), 5) for _ in range(40)]
+            )
+
+        await run_until_idle(scheduler)
+
+        # 両方に作業が残っている間は b が a の 2 倍処理される
+        first = order[:30]
+        assert first.count("b") == 2 * first.count("a")
+
+    @pytest.mark.asyncio
+    async def test_coroutine_work_and_errors(self):
+        scheduler = FairScheduler(workers=2)
+        done = []
+
+        async def work():
+            await asyncio.sleep(0)
+            done.append("ok")
+
+        def broken():
+            raise RuntimeError("boom")
+
+        scheduler.submit("ven-1", broken)
+        scheduler.submit("ven-1", work)
+
+        await run_until_idle(scheduler)
+
+        assert done == ["ok"]
+        assert scheduler.served_items["ven-1"] == 2
+
+    def test_submit_all_is_all_or_nothing(self):
+        scheduler = FairScheduler(max_pending_per_ven=3)
+
+        assert scheduler.submit_all("ven-1", [(print, 1)] * 2) is True
+        assert scheduler.submit_all("ven-1", [(print, 1)] * 2) is False
+        assert scheduler.pending_for("ven-1") == 2
+
+    @pytest.mark.asyncio
+    async def test_slow_work_is_cancelled_after_timeout(self):
+        scheduler = FairScheduler(workers=1, timeout=0.01)
+        done = []
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        scheduler.submit("ven-1", slow)
+        scheduler.submit("ven-2", lambda: done.append("ok"))
+
+        await run_until_idle(scheduler)
+
+        assert done == ["ok"]
+        assert scheduler.timed_out["ven-1"] == 1
+
+
+def make_update_report(ven_id, report_request_id, values):
+    dtstart = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return {
+        "ven_id": ven_id,
+        "reports": [
+            {
+                "report_request_id": report_request_id,
+                "intervals": [
+                    {
+                        "dtstart": dtstart + timedelta(seconds=i),
+                        "report_payload": {"r_id": "r1", "value": i},
+                    }
+                    for i in range(values)
+                ],
+            }
+        ],
+    }
+
+
+class TestReportServiceScheduling:
+    @pytest.mark.asyncio
+    async def test_update_report_returns_before_callbacks_run(self):
+        service = ReportService("test-vtn")
+        service.report_scheduler = FairScheduler(workers=1)
+        received = []
+        service.report_callbacks[("rr-1", "r1")] = received.append
+
+        response = await service.update_report(make_update_report("ven-1", "rr-1", 3))
+
+        assert response == ("oadrUpdatedReport", {})
+        assert received == []
+        assert service.report_scheduler.pending_for("ven-1") == 1
+
+        await run_until_idle(service.report_scheduler)
+        assert [value for _, value in received[0]] == [0, 1, 2]
+        assert service.report_scheduler.served_cost["ven-1"] == 3
+
+    @pytest.mark.asyncio
+    async def test_update_report_rejected_when_ven_backlog_is_full(self):
+        service = ReportService("test-vtn")
+        service.report_scheduler = FairScheduler(max_pending_per_ven=1)
+        service.metrics = VtnMetrics()
+        service.report_callbacks[("rr-1", "r1")] = lambda values: None
+        await service.update_report(make_update_report("ven-1", "rr-1", 1))
+
+        with pytest.raises(errors.HTTPError) as excinfo:
+            await service.update_report(make_update_report("ven-1", "rr-1", 1))
+
+        assert excinfo.value.response_code == HTTPStatus.SERVICE_UNAVAILABLE
+        # 受け付けなかった値は数えない
+        assert service.metrics.telemetry_values.value() == 1
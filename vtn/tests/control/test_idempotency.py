@@ -0,0 +1,201 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from openleadr.messaging import create_message, parse_message
+
+from openleadr_impl.control.idempotency import IdempotencyCache, request_key
+from openleadr_impl.service.report_service import ReportService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyCache:
+    @pytest.mark.asyncio
+    async def test_replays_completed_response(self):
+        cache = IdempotencyCache()
+        calls = []
+
+        async def execute():
+            calls.append(1)
+            return f"response-{len(calls)}"
+
+        key = ("ven-1", "req-1", "oadrUpdateReport")
+        assert await cache.run(key, execute) == "response-1"
+        assert await cache.run(key, execute) == "response-1"
+        assert await cache.run(("ven-2", "req-1", "oadrUpdateReport"), execute) == (
+            "response-2"
+        )
+        assert cache.replayed["oadrUpdateReport"] == 1
+        assert cache.executed["oadrUpdateReport"] == 2
+
+    @pytest.mark.asyncio
+    async def test_in_flight_duplicates_wait_for_the_first(self):
+        cache = IdempotencyCache()
+        release = asyncio.Event()
+        calls = []
+
+        async def execute():
+            calls.append(1)
+            await release.wait()
+            return "response"
+
+        key = ("ven-1", "req-1", "oadrUpdateReport")
+        tasks = [asyncio.create_task(cache.run(key, execute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await asyncio.gather(*tasks) == ["response"] * 5
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_execution_is_not_cached(self):
+        cache = IdempotencyCache()
+        release = asyncio.Event()
+        calls = []
+
+        async def execute():
+            calls.append(1)
+            await release.wait()
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return "response"
+
+        key = ("ven-1", "req-1", "oadrUpdateReport")
+        first = asyncio.create_task(cache.run(key, execute))
+        await asyncio.sleep(0)
+        retry = asyncio.create_task(cache.run(key, execute))
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(RuntimeError):
+            await first
+        # 待っていた重複が処理し直す
+        assert await retry == "response"
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_entries_expire_and_are_bounded(self):
+        clock = FakeClock()
+        cache = IdempotencyCache(ttl=10.0, max_entries=3, clock=clock)
+
+        async def execute():
+            return "response"
+
+        for i in range(5):
+            await cache.run(("ven-1", f"req-{i}", "oadrUpdateReport"), execute)
+        assert len(cache) == 3
+
+        clock.now = 11.0
+        await cache.run(("ven-1", "req-9", "oadrUpdateReport"), execute)
+        assert len(cache) == 1
+
+    def test_request_key(self):
+        message_type, payload = parse_message(
+            create_message(
+                "oadrCreatedEvent",
+                response={"response_code": 200, "response_description": "OK"},
+                event_responses=[
+                    {
+                        "response_code": 200,
+                        "response_description": "OK",
+                        "request_id": "req-1",
+                        "event_id": "event-1",
+                        "modification_number": 0,
+                        "opt_type": "optIn",
+                    }
+                ],
+                ven_id="ven-1",
+            )
+        )
+
+        assert request_key(message_type, payload) == (
+            "ven-1",
+            (None, (("req-1", "event-1", 0, "optIn"),)),
+            "oadrCreatedEvent",
+        )
+        assert request_key("oadrUpdateReport", {"ven_id": "ven-1"}) is None
+        assert IdempotencyCache().key_for("oadrPoll", {"ven_id": "ven-1"}) is None
+
+    def test_created_event_key_includes_each_response(self):
+        def created_event(opt_type, event_id="event-1"):
+            # OpenADRClient.created_event() は response.requestID に配信の requestID を入れる
+            return parse_message(
+                create_message(
+                    "oadrCreatedEvent",
+                    response={
+                        "response_code": 200,
+                        "response_description": "OK",
+                        "request_id": "distribute-1",
+                    },
+                    event_responses=[
+                        {
+                            "response_code": 200,
+                            "response_description": "OK",
+                            "request_id": "distribute-1",
+                            "event_id": event_id,
+                            "modification_number": 0,
+                            "opt_type": opt_type,
+                        }
+                    ],
+                    ven_id="ven-1",
+                )
+            )
+
+        opt_in = request_key(*created_event("optIn"))
+        opt_out = request_key(*created_event("optOut"))
+        other_event = request_key(*created_event("optIn", event_id="event-2"))
+
+        assert opt_in == request_key(*created_event("optIn"))
+        assert len({opt_in, opt_out, other_event}) == 3
+        assert opt_in[1][1][0][0] == "distribute-1"
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+        self.remote = "10.0.0.1"
+
+    async def read(self):
+        return self._body
+
+
+class TestHandlerIdempotency:
+    @pytest.mark.asyncio
+    async def test_retried_register_report_is_handled_once(self):
+        service = ReportService("test-vtn")
+        service.idempotency_cache = IdempotencyCache()
+        service._create_message = create_message
+        calls = []
+
+        async def handle_message(message_type, payload):
+            calls.append(message_type)
+            await asyncio.sleep(0.01)
+            return "oadrRegisteredReport", {"report_requests": [], "request_id": len(calls)}
+
+        service.handle_message = handle_message
+        body = create_message(
+            "oadrRegisterReport", ven_id="ven-1", request_id="req-1", reports=[]
+        ).encode()
+
+        responses = await asyncio.gather(
+            *[
+                service.handler(DummyRequest({"content-type": "application/xml"}, body))
+                for _ in range(3)
+            ]
+        )
+        retried = await service.handler(
+            DummyRequest({"content-type": "application/xml"}, body)
+        )
+
+        assert calls == ["oadrRegisterReport"]
+        assert {response.status for response in responses} == {HTTPStatus.OK}
+        assert {response.text for response in responses} == {retried.text}
+        assert service.idempotency_cache.replayed["oadrRegisterReport"] == 3
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from openleadr_impl.control.load_monitor import LoadMonitor
+from openleadr_impl.control.poll_frequency import PollFrequencyPolicy
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.service.registration_service import RegistrationService
+
+NOW = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_event(dtstart, duration=timedelta(minutes=30), status="far"):
+    return {
+        "event_descriptor": {"event_id": "ev-1", "event_status": status},
+        "active_period": {"dtstart": dtstart, "duration": duration},
+    }
+
+
+def make_policy(events=None, events_updated=None, load_monitor=None):
+    return PollFrequencyPolicy(
+        fast_freq=timedelta(seconds=5),
+        idle_freq=timedelta(seconds=60),
+        max_freq=timedelta(minutes=5),
+        imminent_window=timedelta(minutes=15),
+        load_monitor=load_monitor,
+        event_service=SimpleNamespace(events=events or {}),
+        poll_service=SimpleNamespace(events_updated=events_updated or {}),
+    )
+
+
+class TestPollFrequencyPolicy:
+    def test_idle_ven_polls_slowly(self):
+        policy = make_policy()
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(seconds=60)
+
+    def test_unknown_ven_id_polls_slowly(self):
+        policy = make_policy(events_updated={"ven-1": True})
+
+        assert policy.poll_freq_for(None, now=NOW) == timedelta(seconds=60)
+
+    def test_imminent_event_polls_fast(self):
+        policy = make_policy(
+            events={"ven-1": [make_event(NOW + timedelta(minutes=10))]}
+        )
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(seconds=5)
+
+    def test_active_event_polls_fast(self):
+        policy = make_policy(
+            events={"ven-1": [make_event(NOW - timedelta(minutes=10))]}
+        )
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(seconds=5)
+
+    def test_far_future_event_polls_slowly(self):
+        policy = make_policy(events={"ven-1": [make_event(NOW + timedelta(hours=2))]})
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(seconds=60)
+
+    @pytest.mark.parametrize("status", ["completed", "cancelled"])
+    def test_finished_event_is_ignored(self, status):
+        policy = make_policy(
+            events={"ven-1": [make_event(NOW - timedelta(minutes=1), status=status)]}
+        )
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(seconds=60)
+
+    def test_pending_event_update_polls_fast(self):
+        policy = make_policy(events_updated={"ven-1": True})
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(seconds=5)
+
+    def test_overload_backs_off_up_to_max(self):
+        monitor = LoadMonitor(latency_threshold=0.1, loop_lag_threshold=0.1)
+        monitor.request_latency = 0.3
+        policy = make_policy(load_monitor=monitor)
+
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(minutes=3)
+
+        monitor.request_latency = 10.0
+        assert policy.poll_freq_for("ven-1", now=NOW) == timedelta(minutes=5)
+
+
+    def test_changed_after_handing_out(self):
+        events = {"ven-2": []}
+        policy = make_policy(events=events)
+
+        # 周期を渡していない VEN は比べない
+        assert policy.changed("ven-1", NOW) is False
+        assert policy.poll_freq_for("ven-1", NOW) == timedelta(seconds=60)
+        assert policy.changed("ven-1", NOW) is False
+
+        events["ven-1"] = [make_event(NOW + timedelta(minutes=5))]
+        assert policy.changed("ven-1", NOW) is True
+        # 再登録を求めるのは一度だけ
+        assert policy.changed("ven-1", NOW) is False
+        assert policy.changed("ven-1", NOW + timedelta(hours=1)) is True
+
+
+class TestLoadMonitor:
+    def test_backoff_is_one_below_thresholds(self):
+        monitor = LoadMonitor(latency_threshold=0.5, loop_lag_threshold=0.1)
+        monitor.observe_request_latency(0.2)
+        monitor.observe_loop_lag(0.05)
+
+        assert monitor.backoff_factor() == 1.0
+
+    def test_backoff_follows_worst_signal(self):
+        monitor = LoadMonitor(
+            latency_threshold=0.5, loop_lag_threshold=0.1, alpha=1.0, max_backoff=8.0
+        )
+        monitor.observe_request_latency(1.0)
+        monitor.observe_loop_lag(0.4)
+
+        assert monitor.backoff_factor() == pytest.approx(4.0)
+
+
+class TestRegistrationServicePollFreq:
+    @pytest.mark.asyncio
+    async def test_query_registration_uses_policy(self):
+        policy = make_policy(events_updated={"ven-1": True})
+        service = RegistrationService(
+            "vtn", poll_freq=timedelta(seconds=10), poll_frequency_policy=policy
+        )
+
+        _, payload = await service.query_registration(
+            {"request_id": "1", "ven_id": "ven-1"}
+        )
+
+        assert payload["requested_oadr_poll_freq"] == timedelta(seconds=5)
+
+    @pytest.mark.asyncio
+    async def test_create_party_registration_uses_policy(self):
+        policy = make_policy(events={"ven-1": [make_event(datetime.now(timezone.utc))]})
+        service = RegistrationService(
+            "vtn", poll_freq=timedelta(seconds=10), poll_frequency_policy=policy
+        )
+        service.on_create_party_registration = lambda payload: ("ven-1", "reg-1")
+
+        _, payload = await service.create_party_registration(
+            {"transport_name": "simpleHttp", "profile_name": "2.0b"}
+        )
+
+        assert payload["requested_oadr_poll_freq"] == timedelta(seconds=5)
+
+    @pytest.mark.asyncio
+    async def test_without_policy_uses_fixed_freq(self):
+        service = RegistrationService("vtn", poll_freq=timedelta(seconds=10))
+
+        _, payload = await service.query_registration({"request_id": "1"})
+
+        assert payload["requested_oadr_poll_freq"] == timedelta(seconds=10)
+
+
+class TestPollRequestsReregistration:
+    @pytest.mark.asyncio
+    async def test_ven_is_asked_to_reregister_when_its_freq_changes(self):
+        server = MyOpenADRServer(
+            vtn_id="test-vtn",
+            poll_frequency_policy=PollFrequencyPolicy(
+                fast_freq=timedelta(seconds=5), idle_freq=timedelta(seconds=60)
+            ),
+        )
+        poll_service = server.services["poll_service"]
+        registration_service = server.services["registration_service"]
+        assert registration_service.requested_poll_freq("ven-1") == timedelta(seconds=60)
+        assert (await poll_service.poll({"ven_id": "ven-1"}))[0] == "oadrResponse"
+
+        server.add_event(
+            ven_id="ven-1",
+            signal_name="simple",
+            signal_type="level",
+            intervals=[
+                {
+                    "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                    "duration": timedelta(minutes=5),
+                    "signal_payload": 1,
+                }
+            ],
+            callback=on_event_response,
+        )
+
+        assert (await poll_service.poll({"ven_id": "ven-1"}))[0] == "oadrDistributeEvent"
+        assert (await poll_service.poll({"ven_id": "ven-1"}))[0] == (
+            "oadrRequestReregistration"
+        )
+        # 再登録で短い周期を受け取った後は求めない
+        assert registration_service.requested_poll_freq("ven-1") == timedelta(seconds=5)
+        assert (await poll_service.poll({"ven_id": "ven-1"}))[0] == "oadrResponse"
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
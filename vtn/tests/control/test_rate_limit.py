@@ -0,0 +1,166 @@
+from http import HTTPStatus
+from unittest.mock import Mock
+
+import pytest
+from openleadr.messaging import create_message
+
+from openleadr_impl.control.rate_limit import RateLimited, RateLimiter
+from openleadr_impl.service import vtn_service
+from openleadr_impl.service.vtn_service import MyVTNService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter:
+    def test_burst_then_refill(self):
+        clock = FakeClock()
+        limiter = RateLimiter({"oadrPoll": (1.0, 3)}, clock=clock)
+
+        for _ in range(3):
+            limiter.check("ven-1", "oadrPoll")
+        with pytest.raises(RateLimited) as excinfo:
+            limiter.check("ven-1", "oadrPoll")
+        assert excinfo.value.retry_after == 1
+
+        clock.now = 1.0
+        limiter.check("ven-1", "oadrPoll")
+        assert limiter.allowed["oadrPoll"] == 4
+        assert limiter.rejected["oadrPoll"] == 1
+
+    def test_buckets_are_per_key_and_message_type(self):
+        limiter = RateLimiter(
+            {"oadrPoll": (1.0, 1), "oadrUpdateReport": (1.0, 1)}, clock=FakeClock()
+        )
+
+        limiter.check("ven-1", "oadrPoll")
+        limiter.check("ven-1", "oadrUpdateReport")
+        limiter.check("ven-2", "oadrPoll")
+        with pytest.raises(RateLimited):
+            limiter.check("ven-1", "oadrPoll")
+
+    def test_default_rate_and_unlimited_types(self):
+        limiter = RateLimiter({}, clock=FakeClock())
+        for _ in range(100):
+            limiter.check("ven-1", "oadrPoll")
+        assert len(limiter) == 0
+
+        limiter.default_rate = (1.0, 1)
+        limiter.check("ven-1", None)
+        with pytest.raises(RateLimited):
+            limiter.check("ven-1", None)
+
+    def test_unknown_types_share_one_bucket(self):
+        limiter = RateLimiter(
+            {"oadrPoll": (1.0, 1)}, default_rate=(1.0, 2), clock=FakeClock()
+        )
+
+        limiter.check("ven-1", "oadrFoo1")
+        limiter.check("ven-1", None)
+        with pytest.raises(RateLimited):
+            limiter.check("ven-1", "oadrFoo2")
+        limiter.check("ven-1", "oadrPoll")
+        limiter.check("ven-2", "oadrFoo3")
+
+        assert len(limiter) == 3
+        assert dict(limiter.allowed) == {"other": 3, "oadrPoll": 1}
+        assert dict(limiter.rejected) == {"other": 1}
+        assert limiter.offenders() == [(("ven-1", "other"), 1)]
+
+    def test_idle_buckets_are_evicted(self):
+        clock = FakeClock()
+        limiter = RateLimiter({"oadrPoll": (1.0, 1)}, idle_timeout=60.0, clock=clock)
+        for i in range(100):
+            limiter.check(f"ven-{i}", "oadrPoll")
+
+        clock.now = 61.0
+        limiter.check("ven-new", "oadrPoll")
+
+        assert len(limiter) == 1
+
+    def test_max_buckets(self):
+        limiter = RateLimiter(
+            {"oadrPoll": (1.0, 1)}, max_buckets=10, clock=FakeClock()
+        )
+        for i in range(100):
+            limiter.check(f"ven-{i}", "oadrPoll")
+
+        assert len(limiter) == 10
+
+    def test_offenders(self):
+        limiter = RateLimiter({"oadrPoll": (1.0, 1)}, clock=FakeClock())
+        for _ in range(5):
+            try:
+                limiter.check("ven-1", "oadrPoll")
+            except RateLimited:
+                pass
+
+        assert limiter.offenders() == [(("ven-1", "oadrPoll"), 4)]
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+        self.remote = "10.0.0.1"
+
+    async def read(self):
+        return self._body
+
+
+class TestHandlerRateLimit:
+    @pytest.mark.asyncio
+    async def test_flooding_ven_gets_429_before_parsing(self, monkeypatch):
+        service = MyVTNService(vtn_id="test-vtn")
+        service.rate_limiter = RateLimiter(
+            {"oadrUpdateReport": (1.0, 2)}, clock=FakeClock()
+        )
+        validate_mock = Mock(side_effect=ValueError("stop after the limiter"))
+        monkeypatch.setattr(vtn_service, "validate_xml_schema", validate_mock)
+        body = create_message(
+            "oadrUpdateReport", ven_id="ven-1", request_id="req-1", reports=[]
+        ).encode()
+
+        statuses = []
+        for _ in range(5):
+            response = await service.handler(
+                DummyRequest({"content-type": "application/xml"}, body)
+            )
+            statuses.append(response.status)
+
+        assert statuses[:2] == [HTTPStatus.INTERNAL_SERVER_ERROR] * 2
+        assert statuses[2:] == [HTTPStatus.TOO_MANY_REQUESTS] * 3
+        assert validate_mock.call_count == 2
+        assert service.rate_limiter.rejected["oadrUpdateReport"] == 3
+
+    @pytest.mark.asyncio
+    async def test_429_has_retry_after(self, monkeypatch):
+        service = MyVTNService(vtn_id="test-vtn")
+        service.rate_limiter = RateLimiter(
+            {"oadrPoll": (0.1, 0)}, clock=FakeClock()
+        )
+        monkeypatch.setattr(
+            vtn_service.myUtils,
+            "get_certificate_fingerprint_from_alb_header",
+            lambda _request: "AA:BB",
+        )
+        body = create_message("oadrPoll", ven_id="ven-1").encode()
+
+        response = await service.handler(
+            DummyRequest(
+                {
+                    "content-type": "application/xml",
+                    "X-Amzn-Mtls-Clientcert-Leaf": "cert",
+                },
+                body,
+            )
+        )
+
+        assert response.status == HTTPStatus.TOO_MANY_REQUESTS
+        assert response.headers["Retry-After"] == "10"
+        assert service.rate_limiter.offenders() == [(("AA:BB", "oadrPoll"), 1)]
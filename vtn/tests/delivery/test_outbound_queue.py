@@ -0,0 +1,187 @@
+from datetime import timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from openleadr import objects
+from openleadr.messaging import create_message, parse_message, validate_xml_schema
+
+from openleadr_impl.delivery.outbound_queue import OutboundQueue
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.service.poll_service import PollService
+
+
+class TestOutboundQueue:
+    def test_pop_follows_priority(self):
+        queue = OutboundQueue()
+        queue.put("ven-1", "oadrCreateReport", {"n": 1})
+        queue.put("ven-1", "oadrCancelReport", {"n": 2})
+        queue.put("ven-1", "oadrRequestReregistration")
+        queue.put("ven-1", "oadrDistributeEvent", {"n": 3})
+
+        order = [queue.pop("ven-1").message_type for _ in range(4)]
+
+        assert order == [
+            "oadrDistributeEvent",
+            "oadrRequestReregistration",
+            "oadrCancelReport",
+            "oadrCreateReport",
+        ]
+        assert queue.pop("ven-1") is None
+
+    def test_same_priority_is_fifo(self):
+        queue = OutboundQueue()
+        queue.put("ven-1", "oadrCreateReport", {"n": 1})
+        queue.put("ven-1", "oadrCreateReport", {"n": 2})
+
+        assert queue.pop("ven-1").payload == {"n": 1}
+        assert queue.pop("ven-1").payload == {"n": 2}
+
+    def test_distributes_are_coalesced(self):
+        queue = OutboundQueue()
+
+        assert queue.put("ven-1", "oadrDistributeEvent", {"n": 1}) is True
+        assert queue.put("ven-1", "oadrDistributeEvent", {"n": 2}) is False
+        assert queue.put("ven-1", "oadrDistributeEvent", {"n": 3}) is False
+
+        assert queue.pending("ven-1") == 1
+        assert queue.pop("ven-1").payload == {"n": 3}
+        # once delivered, a new distribute is queued again
+        assert queue.put("ven-1", "oadrDistributeEvent", {"n": 4}) is True
+
+    def test_custom_coalesce_key(self):
+        queue = OutboundQueue()
+        queue.put("ven-1", "oadrCancelReport", {"id": "a"}, coalesce_key="a")
+        queue.put("ven-1", "oadrCancelReport", {"id": "a"}, coalesce_key="a")
+        queue.put("ven-1", "oadrCancelReport", {"id": "b"}, coalesce_key="b")
+
+        assert queue.pending("ven-1") == 2
+
+    def test_queues_are_per_ven(self):
+        queue = OutboundQueue()
+        queue.put("ven-1", "oadrCreateReport", {"n": 1})
+
+        assert queue.pop("ven-2") is None
+        assert len(queue) == 1
+
+    def test_pop_without_messages_skips_the_lock(self):
+        class CountingLock:
+            acquired = 0
+
+            def __enter__(self):
+                CountingLock.acquired += 1
+
+            def __exit__(self, *exc_info):
+                pass
+
+        queue = OutboundQueue(lock=CountingLock())
+        assert queue.pop("ven-1") is None
+        assert CountingLock.acquired == 0
+
+        queue.put("ven-1", "oadrCreateReport", {"n": 1})
+        assert queue.pop("ven-1").payload == {"n": 1}
+        assert CountingLock.acquired == 2
+
+    def test_discard(self):
+        queue = OutboundQueue()
+        queue.put("ven-1", "oadrDistributeEvent")
+        queue.put("ven-1", "oadrCreateReport", {"n": 1})
+
+        queue.discard("ven-1")
+
+        assert queue.pending("ven-1") == 0
+        assert queue.put("ven-1", "oadrDistributeEvent") is True
+
+    def test_unknown_message_type(self):
+        with pytest.raises(ValueError):
+            OutboundQueue().put("ven-1", "oadrPoll")
+
+
+class TestPollServiceOutboundQueue:
+    @pytest.mark.asyncio
+    async def test_poll_returns_queued_message(self):
+        service = PollService("vtn")
+        service.enqueue("ven-1", "oadrRequestReregistration")
+
+        result = await service.poll({"ven_id": "ven-1"})
+
+        assert result == ("oadrRequestReregistration", {})
+        assert await service.poll({"ven_id": "ven-1"}) == ("oadrResponse", {})
+
+    @pytest.mark.asyncio
+    async def test_distribute_without_payload_is_rendered_on_delivery(self):
+        service = PollService("vtn")
+        service.event_service = AsyncMock()
+        service.event_service.request_event.return_value = (
+            "oadrDistributeEvent",
+            {"events": ["ev"]},
+        )
+        service.enqueue("ven-1", "oadrDistributeEvent")
+        service.enqueue("ven-1", "oadrDistributeEvent")
+
+        result = await service.poll({"ven_id": "ven-1"})
+
+        assert result == ("oadrDistributeEvent", {"events": ["ev"]})
+        service.event_service.request_event.assert_awaited_once_with(
+            {"ven_id": "ven-1"}
+        )
+
+    @pytest.mark.asyncio
+    async def test_events_updated_goes_first(self):
+        service = PollService("vtn")
+        service.event_service = AsyncMock()
+        service.event_service.request_event.return_value = (
+            "oadrDistributeEvent",
+            {"events": []},
+        )
+        service.events_updated["ven-1"] = True
+        service.enqueue("ven-1", "oadrRequestReregistration")
+
+        first = await service.poll({"ven_id": "ven-1"})
+        second = await service.poll({"ven_id": "ven-1"})
+
+        assert first[0] == "oadrDistributeEvent"
+        assert second[0] == "oadrRequestReregistration"
+
+    def test_enqueue_refused_with_external_polling(self):
+        service = PollService("vtn", polling_method="external")
+
+        assert service.enqueue("ven-1", "oadrRequestReregistration") is False
+        assert service.outbound_queue.pending("ven-1") == 0
+
+
+class TestServerQueueHelpers:
+    @pytest.mark.asyncio
+    async def test_queued_messages_render_as_valid_openadr(self):
+        server = MyOpenADRServer(vtn_id="vtn")
+        poll_service = server.services["poll_service"]
+        report_request = objects.ReportRequest(
+            report_request_id="rr-1",
+            report_specifier=objects.ReportSpecifier(
+                report_specifier_id="rs-1",
+                granularity=timedelta(seconds=10),
+                report_back_duration=timedelta(seconds=10),
+                specifier_payloads=[
+                    objects.SpecifierPayload(r_id="r-1", reading_type="Direct Read")
+                ],
+            ),
+        )
+
+        server.request_report("ven-1", [report_request])
+        server.cancel_report("ven-1", "rr-0")
+        server.cancel_report("ven-1", "rr-0")
+        server.request_reregistration("ven-1")
+
+        rendered = []
+        while True:
+            message_type, payload = await poll_service.poll({"ven_id": "ven-1"})
+            if message_type == "oadrResponse":
+                break
+            xml = create_message(message_type, ven_id="ven-1", **payload)
+            validate_xml_schema(xml.encode("utf-8"))
+            rendered.append(parse_message(xml)[0])
+
+        assert rendered == [
+            "oadrRequestReregistration",
+            "oadrCancelReport",
+            "oadrCreateReport",
+        ]
@@ -0,0 +1,224 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from openleadr.messaging import create_message, parse_message
+
+from openleadr_impl.delivery.push import PushTransport
+from openleadr_impl.server import MyOpenADRServer
+
+
+class StandInVen:
+    """
+    push を受ける VEN の代わり。failures 回だけ 503 を返してから 200 を返す。
+    """
+
+    def __init__(self, failures=0, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.received = []
+        self.in_flight = 0
+        self.peak = 0
+        self.app = web.Application()
+        self.app.router.add_post("/{ven_id}/{service}", self.handle)
+
+    async def handle(self, request):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.failures > 0:
+                self.failures -= 1
+                return web.Response(status=503)
+            message_type, payload = parse_message(await request.read())
+            self.received.append(
+                (request.match_info["ven_id"], request.match_info["service"], message_type, payload)
+            )
+            return web.Response(status=200)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest_asyncio.fixture
+async def stand_in_ven():
+    ven = StandInVen()
+    server = TestServer(ven.app)
+    await server.start_server()
+    ven.base_url = str(server.make_url("")).rstrip("/")
+    yield ven
+    await server.close()
+
+
+def make_transport(stand_in_ven, **kwargs):
+    transport = PushTransport(
+        endpoint_lookup=lambda ven_id: f"{stand_in_ven.base_url}/{ven_id}",
+        retry_backoff=0.0,
+        create_message=create_message,
+        **kwargs,
+    )
+    transport.vtn_id = "test-vtn"
+    return transport
+
+
+class FakePollService:
+    def __init__(self):
+        self.events_updated = {}
+        self.enqueued = []
+
+    def enqueue(self, ven_id, message_type, payload=None, coalesce_key=None):
+        self.enqueued.append((ven_id, message_type, payload))
+        return True
+
+
+class TestPushTransport:
+    @pytest.mark.asyncio
+    async def test_send_posts_to_service_path(self, stand_in_ven):
+        transport = make_transport(stand_in_ven)
+        await transport.start()
+        try:
+            delivered = await transport.send("ven-1", "oadrRequestReregistration")
+        finally:
+            await transport.close()
+
+        assert delivered is True
+        ven_id, service, message_type, payload = stand_in_ven.received[0]
+        assert (ven_id, service, message_type) == (
+            "ven-1",
+            "EiRegisterParty",
+            "oadrRequestReregistration",
+        )
+        assert payload["ven_id"] == "ven-1"
+
+    @pytest.mark.asyncio
+    async def test_retries_until_delivered(self, stand_in_ven):
+        stand_in_ven.failures = 2
+        transport = make_transport(stand_in_ven, retries=2)
+        await transport.start()
+        try:
+            delivered = await transport.send("ven-1", "oadrRequestReregistration")
+        finally:
+            await transport.close()
+
+        assert delivered is True
+        assert len(stand_in_ven.received) == 1
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_poll_queue(self, stand_in_ven):
+        stand_in_ven.failures = 10
+        transport = make_transport(stand_in_ven, retries=1)
+        transport.poll_service = FakePollService()
+        await transport.start()
+        try:
+            delivered = await transport.send("ven-1", "oadrRequestReregistration")
+        finally:
+            await transport.close()
+
+        assert delivered is False
+        assert transport.poll_service.enqueued == [
+            ("ven-1", "oadrRequestReregistration", None)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_unknown_endpoint_falls_back_without_request(self, stand_in_ven):
+        transport = make_transport(stand_in_ven)
+        transport.endpoint_lookup = lambda ven_id: None
+        transport.poll_service = FakePollService()
+        await transport.start()
+        try:
+            delivered = await transport.send("ven-1", "oadrRequestReregistration")
+        finally:
+            await transport.close()
+
+        assert delivered is False
+        assert stand_in_ven.received == []
+        assert len(transport.poll_service.enqueued) == 1
+
+    @pytest.mark.asyncio
+    async def test_fan_out_is_bounded(self, stand_in_ven):
+        stand_in_ven.delay = 0.01
+        transport = make_transport(stand_in_ven, max_concurrency=5)
+        await transport.start()
+        try:
+            results = await transport.fan_out(
+                [f"ven-{i}" for i in range(30)], "oadrRequestReregistration"
+            )
+        finally:
+            await transport.close()
+
+        assert all(results.values())
+        assert len(results) == 30
+        assert stand_in_ven.peak <= 5
+
+
+class TestServerPushEvents:
+    @pytest.mark.asyncio
+    async def test_push_events_delivers_and_clears_events_updated(self, stand_in_ven):
+        transport = make_transport(stand_in_ven, max_concurrency=1)
+        server = MyOpenADRServer(vtn_id="test-vtn", push_transport=transport)
+        for ven_id in ("ven-1", "ven-2"):
+            server.add_event(
+                ven_id=ven_id,
+                signal_name="simple",
+                signal_type="level",
+                intervals=[
+                    {
+                        "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                        "duration": timedelta(minutes=5),
+                        "signal_payload": 1,
+                    }
+                ],
+            )
+        stand_in_ven.failures = transport.retries + 1
+
+        await transport.start()
+        try:
+            results = await server.push_events(["ven-1", "ven-2", "ven-3"])
+        finally:
+            await transport.close()
+
+        # 1 台目は再試行を使い切って届かず、次回の oadrPoll に回る
+        assert sorted(results.values()) == [False, True]
+        assert "ven-3" not in results
+        events_updated = server.services["poll_service"].events_updated
+        for ven_id, delivered in results.items():
+            assert events_updated[ven_id] is not delivered
+        ven_id, service, message_type, payload = stand_in_ven.received[0]
+        assert service == "EiEvent"
+        assert message_type == "oadrDistributeEvent"
+        assert payload["vtn_id"] == "test-vtn"
+        assert len(payload["events"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_distribute_is_rendered_at_poll_time(self, stand_in_ven):
+        transport = make_transport(stand_in_ven, retries=0)
+        server = MyOpenADRServer(vtn_id="test-vtn", push_transport=transport)
+        server.add_event(
+            ven_id="ven-1",
+            signal_name="simple",
+            signal_type="level",
+            intervals=[
+                {
+                    "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                    "duration": timedelta(minutes=5),
+                    "signal_payload": 1,
+                }
+            ],
+        )
+        poll_service = server.services["poll_service"]
+        poll_service.set_events_updated("ven-1", False)
+        stand_in_ven.failures = 1
+
+        await transport.start()
+        try:
+            results = await transport.fan_out(["ven-1"], "oadrDistributeEvent")
+        finally:
+            await transport.close()
+
+        # 積み直したメッセージは oadrPoll の時点のイベントで組み立てる
+        assert results == {"ven-1": False}
+        message_type, payload = await poll_service.poll({"ven_id": "ven-1"})
+        assert message_type == "oadrDistributeEvent"
+        assert len(payload["events"]) == 1
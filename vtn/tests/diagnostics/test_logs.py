@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+
+import pytest
+
+from openleadr_impl.context import RequestContext, current_request
+from openleadr_impl.diagnostics.logs import (
+    JsonFormatter,
+    QueueLogHandler,
+    SamplingFilter,
+)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.threads.add(threading.current_thread().name)
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def test_logger():
+    logger = logging.getLogger("openleadr.test_logs")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    yield logger
+    logger.handlers.clear()
+    logger.propagate = True
+
+
+class TestQueueLogHandler:
+    def test_formats_on_the_listener_thread(self, test_logger):
+        target = RecordingHandler()
+        target.setFormatter(JsonFormatter())
+        handler = QueueLogHandler([target])
+        handler.start()
+        test_logger.addHandler(handler)
+
+        token = current_request.set(RequestContext(None))
+        try:
+            current_request.get().message_type = "oadrUpdateReport"
+            current_request.get().ven_id = "ven-1"
+            test_logger.info("value %s=%s", "energy", 1.5, extra={"r_id": "energy"})
+        finally:
+            current_request.reset(token)
+        handler.close()
+
+        (line,) = target.lines
+        entry = json.loads(line)
+        assert entry["message"] == "value energy=1.5"
+        assert entry["level"] == "INFO"
+        assert entry["r_id"] == "energy"
+        assert entry["message_type"] == "oadrUpdateReport"
+        assert entry["ven_id"] == "ven-1"
+        assert threading.current_thread().name not in target.threads
+
+    def test_drops_records_when_the_queue_is_full(self, test_logger):
+        entered = threading.Event()
+        release = threading.Event()
+
+        class BlockingHandler(RecordingHandler):
+            def emit(self, record):
+                entered.set()
+                release.wait(5)
+                super().emit(record)
+
+        target = BlockingHandler()
+        handler = QueueLogHandler([target], max_queue=1)
+        handler.start()
+        test_logger.addHandler(handler)
+
+        test_logger.info("first")
+        assert entered.wait(5)
+        test_logger.info("second")
+        test_logger.info("third")
+        release.set()
+        handler.close()
+
+        assert target.lines == ["first", "second"]
+        assert handler.dropped == 1
+
+    def test_restarts_the_listener_in_a_forked_child(self, tmp_path, test_logger):
+        path = tmp_path / "vtn.log"
+        handler = QueueLogHandler([logging.FileHandler(path)])
+        handler.start()
+        test_logger.addHandler(handler)
+
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                test_logger.info("from the child")
+                handler.close()
+                code = 0
+            finally:
+                os._exit(code)
+        _pid, status = os.waitpid(pid, 0)
+        handler.close()
+
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert path.read_text() == "from the child\n"
+
+
+class TestSamplingFilter:
+    def test_passes_the_given_fraction_of_low_levels(self, test_logger):
+        sampler = SamplingFilter(0.25)
+        records = [
+            test_logger.makeRecord(test_logger.name, level, "", 0, "", (), None)
+            for level in [logging.INFO] * 100 + [logging.WARNING] * 10
+        ]
+
+        passed = [record for record in records if sampler.filter(record)]
+
+        assert len([r for r in passed if r.levelno == logging.INFO]) == 25
+        assert len([r for r in passed if r.levelno == logging.WARNING]) == 10
+        assert sampler.sampled_out == 75
+
+    def test_rejects_invalid_rate(self):
+        with pytest.raises(ValueError):
+            SamplingFilter(1.5)
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+from openleadr.messaging import create_message
+
+from openleadr_impl.diagnostics.histogram import Histogram
+from openleadr_impl.diagnostics.loop_monitor import LoopMonitor
+from openleadr_impl.service.report_service import ReportService
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+        self.remote = "10.0.0.1"
+
+    async def read(self):
+        return self._body
+
+
+class TestHistogram:
+    def test_buckets_and_quantiles(self):
+        histogram = Histogram((0.01, 0.1, 1.0))
+        for value in (0.005, 0.01, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+        assert histogram.cumulative() == [
+            (0.01, 2),
+            (0.1, 3),
+            (1.0, 4),
+            (float("inf"), 5),
+        ]
+        assert histogram.quantile(0.5) == 0.1
+        assert histogram.quantile(1.0) == float("inf")
+        assert histogram.count == 5
+
+
+class TestLoopMonitor:
+    @pytest.mark.asyncio
+    async def test_records_blocking_handler_with_request(self):
+        monitor = LoopMonitor(interval=0.01, slow_callback_threshold=0.05)
+        monitor_task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0)
+
+        service = ReportService("test-vtn")
+        service._create_message = create_message
+
+        async def handle_message(message_type, payload):
+            time.sleep(0.1)
+            return "oadrRegisteredReport", {"report_requests": []}
+
+        service.handle_message = handle_message
+        body = create_message(
+            "oadrRegisterReport", ven_id="ven-1", request_id="req-1", reports=[]
+        ).encode()
+        try:
+            await asyncio.create_task(
+                service.handler(DummyRequest({"content-type": "application/xml"}, body))
+            )
+            await asyncio.sleep(0.05)
+        finally:
+            monitor_task.cancel()
+            await asyncio.gather(monitor_task, return_exceptions=True)
+
+        (record,) = [
+            record
+            for record in monitor.slow_callbacks
+            if record["callback"] == "MyVTNService.handler"
+        ]
+        assert record["seconds"] >= 0.1
+        assert record["message_type"] == "oadrRegisterReport"
+        assert record["ven_id"] == "ven-1"
+        assert monitor.max_lag >= 0.05
+        assert monitor.lag.count > 0
+
+    @pytest.mark.asyncio
+    async def test_uninstalls_when_stopped(self):
+        original = asyncio.events.Handle._run
+        monitor = LoopMonitor()
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0)
+        assert asyncio.events.Handle._run is not original
+
+        with pytest.raises(RuntimeError):
+            LoopMonitor().install()
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert asyncio.events.Handle._run is original
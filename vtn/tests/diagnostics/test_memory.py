@@ -0,0 +1,87 @@
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from openleadr_impl.diagnostics.memory import (
+    AllocationTracker,
+    deep_size,
+    memory_report,
+)
+from openleadr_impl.server import MyOpenADRServer
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def add_event(server, ven_id):
+    return server.add_event(
+        ven_id=ven_id,
+        signal_name="simple",
+        signal_type="level",
+        intervals=[
+            {
+                "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                "duration": timedelta(minutes=5),
+                "signal_payload": 1,
+            }
+        ],
+        callback=on_event_response,
+    )
+
+
+class TestDeepSize:
+    def test_counts_nested_objects_once(self):
+        shared = "x" * 1000
+        value = {"a": [shared, shared], "b": (shared,)}
+
+        size = deep_size(value)
+
+        assert size >= sys.getsizeof(shared) + sys.getsizeof(value)
+        assert size < 2 * sys.getsizeof(shared)
+        seen = set()
+        deep_size(shared, seen)
+        assert deep_size(value, seen) == size - sys.getsizeof(shared)
+
+    def test_does_not_follow_functions(self):
+        assert deep_size(on_event_response) == sys.getsizeof(on_event_response)
+
+
+class TestMemoryReport:
+    @pytest.mark.asyncio
+    async def test_reports_structures_and_largest_vens(self):
+        server = MyOpenADRServer(vtn_id="test-vtn")
+        for _ in range(3):
+            add_event(server, "ven-1")
+        add_event(server, "ven-2")
+
+        report = await memory_report(server, top_vens=1, chunk=2)
+
+        events = report["structures"]["event_service.events"]
+        assert events["entries"] == 2
+        assert events["bytes"] > 0
+        assert report["structures"]["event_service.event_callbacks"]["entries"] == 4
+        assert report["vens"]["count"] == 2
+        (largest,) = report["vens"]["top"]
+        assert largest["ven_id"] == "ven-1"
+        assert largest["structures"]["event_service.event_callbacks"] > 0
+        assert largest["bytes"] == sum(largest["structures"].values())
+        assert report["max_rss_bytes"] > 0
+
+
+class TestAllocationTracker:
+    def test_reports_growth_between_marks(self):
+        tracker = AllocationTracker()
+        try:
+            assert tracker.mark() == []
+            kept = [bytearray(1000) for _ in range(1000)]
+            diff = tracker.mark(top=5)
+        finally:
+            tracker.stop()
+
+        assert kept
+        assert any(
+            "test_memory.py" in entry["location"] and entry["size_diff"] >= 1_000_000
+            for entry in diff
+        )
@@ -0,0 +1,238 @@
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+
+from openleadr_impl.cluster.migration import (
+    export_ven_state,
+    forget_ven_state,
+    import_ven_state,
+)
+from openleadr_impl.diagnostics.histogram import Histogram
+from openleadr_impl.diagnostics.metrics import (
+    MetricsRegistry,
+    VtnMetrics,
+    add_metrics_routes,
+    state_counts,
+)
+from openleadr_impl.repository import dynamodb
+from openleadr_impl.server import STATE_GAUGES_NAMESPACE, MyOpenADRServer
+from openleadr_impl.service.report_service import ReportService
+from openleadr_impl.service.vtn_service import MyVTNService
+from openleadr_impl.state.store import MemoryStore
+
+TOKEN = "secret"
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def add_event(server, ven_id):
+    return server.add_event(
+        ven_id=ven_id,
+        signal_name="simple",
+        signal_type="level",
+        intervals=[
+            {
+                "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                "duration": timedelta(minutes=5),
+                "signal_payload": 1,
+            }
+        ],
+        callback=on_event_response,
+    )
+
+
+def gauges(metrics):
+    return {
+        "events_active": metrics.events_active.value(),
+        "events_updated_pending": metrics.events_updated_pending.value(),
+        "event_callbacks_outstanding": metrics.event_callbacks_outstanding.value(),
+        "report_callbacks": metrics.report_callbacks.value(),
+    }
+
+
+class FakeDynamoClient:
+    def transact_write_items(self, TransactItems, ReturnConsumedCapacity):
+        assert ReturnConsumedCapacity == "TOTAL"
+        return {
+            "ConsumedCapacity": [
+                {"TableName": "telemetry", "CapacityUnits": 4.0},
+                {"TableName": "status", "CapacityUnits": 2.0},
+            ]
+        }
+
+    def scan(self, **params):
+        raise ConnectionError("unreachable")
+
+
+class TestVtnMetrics:
+    @pytest.mark.asyncio
+    async def test_state_gauges_follow_the_event_lifecycle(self):
+        server = MyOpenADRServer(vtn_id="test-vtn", metrics=VtnMetrics())
+        event_id = add_event(server, "ven-1")
+        add_event(server, "ven-1")
+        cancelled_event_id = add_event(server, "ven-2")
+
+        assert gauges(server.metrics) == {
+            "events_active": 3,
+            "events_updated_pending": 2,
+            "event_callbacks_outstanding": 3,
+            "report_callbacks": 0,
+        }
+
+        await server.services["poll_service"].poll({"ven_id": "ven-1"})
+        await server.services["event_service"].created_event(
+            {
+                "ven_id": "ven-1",
+                "event_responses": [
+                    {
+                        "event_id": event_id,
+                        "modification_number": 0,
+                        "opt_type": "optIn",
+                    }
+                ],
+            }
+        )
+        server.cancel_event("ven-2", cancelled_event_id)
+
+        assert server.metrics.event_callbacks_outstanding.value() == 2
+        assert server.metrics.events_updated_pending.value() == 1
+        assert gauges(server.metrics) == state_counts(server)
+
+    @pytest.mark.asyncio
+    async def test_migration_moves_the_gauges(self):
+        source = MyOpenADRServer(vtn_id="source", metrics=VtnMetrics())
+        target = MyOpenADRServer(vtn_id="target", metrics=VtnMetrics())
+        add_event(source, "ven-1")
+        add_event(source, "ven-2")
+
+        state = export_ven_state(source, ["ven-1"])
+        state["report_callbacks"] = {("rr-1", "energy"): print}
+        import_ven_state(target, state)
+        forget_ven_state(source, ["ven-1"])
+
+        assert gauges(target.metrics) == state_counts(target)
+        assert gauges(target.metrics)["events_active"] == 1
+        assert gauges(target.metrics)["report_callbacks"] == 1
+        assert gauges(source.metrics) == state_counts(source)
+        assert gauges(source.metrics)["events_active"] == 1
+
+    @pytest.mark.asyncio
+    async def test_state_gauges_are_shared_by_the_workers(self, monkeypatch):
+        # サーバーが MyVTNService に設定する state_lock を、テストの後に元に戻す
+        monkeypatch.setattr(MyVTNService, "state_lock", MyVTNService.state_lock)
+        store = MemoryStore()
+        # 同じストアを使う 2 つのワーカー
+        first = MyOpenADRServer(vtn_id="test-vtn", state_store=store, metrics=VtnMetrics())
+        second = MyOpenADRServer(vtn_id="test-vtn", state_store=store, metrics=VtnMetrics())
+        event_id = add_event(first, "ven-1")
+
+        second.cancel_event("ven-1", event_id)
+        await second.services["poll_service"].poll({"ven_id": "ven-1"})
+
+        # ワーカーごとの増減だけでは second の vtn_events_updated_pending が -1 になる
+        for server in (first, second):
+            lines = server.metrics.render().splitlines()
+            assert "vtn_events_active 1" in lines
+            assert "vtn_events_updated_pending 0" in lines
+            assert "vtn_event_callbacks_outstanding 1" in lines
+            assert gauges(server.metrics) == state_counts(server)
+        # 出力時は共有の値を読むだけで、状態はたどらない
+        assert store.namespace(STATE_GAUGES_NAMESPACE)["vtn_events_active"] == 1
+
+    @pytest.mark.asyncio
+    async def test_counts_telemetry_values(self):
+        service = ReportService("test-vtn")
+        service.metrics = VtnMetrics()
+        dtstart = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+        await service.update_report(
+            {
+                "ven_id": "ven-1",
+                "reports": [
+                    {
+                        "report_request_id": "rr-1",
+                        "intervals": [
+                            {
+                                "dtstart": dtstart + timedelta(seconds=i),
+                                "report_payload": {"r_id": "r1", "value": i},
+                            }
+                            for i in range(3)
+                        ],
+                    }
+                ],
+            }
+        )
+
+        assert service.metrics.telemetry_values.value() == 3
+
+    def test_counts_dynamodb_calls_and_capacity(self, monkeypatch):
+        monkeypatch.setattr(dynamodb, "get_dynamodb_client", FakeDynamoClient)
+        metrics = VtnMetrics()
+        repository = dynamodb.BaseDynamoRepository(metrics)
+
+        repository.transact_put_and_delete(
+            [{"TableName": "telemetry", "Item": {}}],
+            [{"TableName": "status", "Key": {}}],
+        )
+        with pytest.raises(ConnectionError):
+            repository._call("scan", ["vens"], TableName="vens")
+
+        assert metrics.dynamodb_calls.value(("transact_write_items", "ok")) == 1
+        assert metrics.dynamodb_calls.value(("scan", "ConnectionError")) == 1
+        assert metrics.dynamodb_consumed_capacity.value(("telemetry",)) == 4.0
+        assert metrics.dynamodb_consumed_capacity.value(("status",)) == 2.0
+
+
+class TestMetricsRegistry:
+    def test_renders_prometheus_text(self):
+        registry = MetricsRegistry()
+        calls = registry.counter("calls_total", "Calls.", ("operation",))
+        calls.inc(labels=('say "hi"',))
+        registry.gauge("queued", "Queued items.").inc(2)
+        histogram = Histogram((0.1, 1.0))
+        histogram.observe(0.5)
+        registry.histogram("latency_seconds", "Latency.", histogram)
+
+        assert registry.render() == (
+            "# HELP calls_total Calls.\n"
+            "# TYPE calls_total counter\n"
+            'calls_total{operation="say \\"hi\\""} 1\n'
+            "# HELP queued Queued items.\n"
+            "# TYPE queued gauge\n"
+            "queued 2\n"
+            "# HELP latency_seconds Latency.\n"
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{le="0.1"} 0\n'
+            'latency_seconds_bucket{le="1"} 1\n'
+            'latency_seconds_bucket{le="+Inf"} 1\n'
+            "latency_seconds_sum 0.5\n"
+            "latency_seconds_count 1\n"
+        )
+
+    @pytest.mark.asyncio
+    async def test_route_requires_token(self):
+        server = MyOpenADRServer(vtn_id="test-vtn", metrics=VtnMetrics())
+        add_metrics_routes(server, TOKEN, server.metrics)
+        add_event(server, "ven-1")
+        test_server = TestServer(server.app)
+        await test_server.start_server()
+        url = test_server.make_url("/metrics")
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    assert response.status == 403
+                async with session.get(
+                    url, headers={"Authorization": f"Bearer {TOKEN}"}
+                ) as response:
+                    assert response.status == 200
+                    assert response.content_type == "text/plain"
+                    lines = (await response.text()).splitlines()
+        finally:
+            await test_server.close()
+
+        assert "vtn_events_active 1" in lines
+        assert "vtn_event_callbacks_outstanding 1" in lines
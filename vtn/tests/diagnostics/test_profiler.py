@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+
+from openleadr_impl.diagnostics.profiler import (
+    ProfilerBusy,
+    SamplingProfiler,
+    add_profiler_routes,
+)
+from openleadr_impl.server import MyOpenADRServer
+
+TOKEN = "test-token"
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def busy_task(seconds):
+    # ループを止めながら、少しずつ譲る
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        busy_wait(0.01)
+        await asyncio.sleep(0)
+
+
+class TestSamplingProfiler:
+    @pytest.mark.asyncio
+    async def test_attributes_samples_to_the_running_task(self):
+        profiler = SamplingProfiler(interval=0.001)
+        task = asyncio.create_task(busy_task(0.3))
+
+        stacks = await profiler.profile(0.2)
+        await task
+
+        busy = sum(
+            count
+            for stack, count in stacks.items()
+            if stack.startswith("task busy_task;") and "busy_wait" in stack
+        )
+        assert busy > 0
+        assert busy >= sum(stacks.values()) / 2
+
+    @pytest.mark.asyncio
+    async def test_only_one_profile_at_a_time(self):
+        profiler = SamplingProfiler()
+        first = asyncio.create_task(profiler.profile(0.05))
+        await asyncio.sleep(0)
+
+        with pytest.raises(ProfilerBusy):
+            await profiler.profile(0.05)
+        await first
+
+
+class TestProfilerRoute:
+    @pytest.mark.asyncio
+    async def test_requires_token_and_returns_collapsed_stacks(self):
+        server = MyOpenADRServer(vtn_id="test-vtn")
+        add_profiler_routes(server, TOKEN)
+        test_server = TestServer(server.app)
+        await test_server.start_server()
+        url = test_server.make_url("/debug/profile")
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, params={"seconds": "0.1"}) as response:
+                    assert response.status == 403
+                async with session.get(
+                    url,
+                    params={"seconds": "1000"},
+                    headers={"Authorization": f"Bearer {TOKEN}"},
+                ) as response:
+                    assert response.status == 400
+                async with session.get(
+                    url,
+                    params={"seconds": "0.1", "interval": "0.001"},
+                    headers={"Authorization": f"Bearer {TOKEN}"},
+                ) as response:
+                    assert response.status == 200
+                    lines = (await response.text()).splitlines()
+        finally:
+            await test_server.close()
+
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0
+            assert stack.split(";")[0] == "loop" or stack.startswith("task ")
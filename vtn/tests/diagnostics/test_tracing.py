@@ -0,0 +1,253 @@
+import asyncio
+import json
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from openleadr import enums, objects
+from openleadr.messaging import create_message
+
+from openleadr_impl.control.fair_scheduler import FairScheduler
+from openleadr_impl.diagnostics import tracing
+from openleadr_impl.diagnostics.tracing import SpanExporter, Tracer
+from openleadr_impl.repository import dynamodb
+from openleadr_impl.service.report_service import ReportService
+
+
+class DummyRequest:
+    def __init__(self, body):
+        self.headers = {"content-type": "application/xml"}
+        self._body = body
+        self.remote = "10.0.0.1"
+
+    async def read(self):
+        return self._body
+
+
+class FakeDynamoClient:
+    def __init__(self):
+        self.calls = []
+
+    def transact_write_items(self, TransactItems):
+        self.calls.append(TransactItems)
+        return {}
+
+
+def update_report_message(report_request_id, values):
+    dtstart = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return create_message(
+        "oadrUpdateReport",
+        request_id="req-1",
+        ven_id="ven-1",
+        reports=[
+            objects.Report(
+                report_request_id=report_request_id,
+                report_specifier_id="TelemetryUsage",
+                report_name=enums.REPORT_NAME.TELEMETRY_USAGE,
+                intervals=[
+                    objects.ReportInterval(
+                        dtstart=dtstart + timedelta(seconds=i),
+                        report_payload=objects.ReportPayload(r_id="energy", value=float(i)),
+                    )
+                    for i in range(values)
+                ],
+            )
+        ],
+    ).encode()
+
+
+def read_spans(path):
+    spans = []
+    with open(path) as file:
+        for line in file:
+            for resource_spans in json.loads(line)["resourceSpans"]:
+                for scope_spans in resource_spans["scopeSpans"]:
+                    spans.extend(scope_spans["spans"])
+    return {span["name"]: span for span in spans}
+
+
+def attributes(span):
+    return {
+        attribute["key"]: next(iter(attribute["value"].values()))
+        for attribute in span["attributes"]
+    }
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    client = FakeDynamoClient()
+    monkeypatch.setattr(dynamodb, "get_dynamodb_client", lambda: client)
+    return dynamodb.BaseDynamoRepository()
+
+
+def report_service(repository):
+    service = ReportService("test-vtn")
+    service._create_message = create_message
+
+    async def store_values(values):
+        await asyncio.to_thread(
+            repository.transact_put_and_delete,
+            [{"TableName": "telemetry", "Item": {"id": {"S": "1"}}}],
+        )
+
+    service.report_callbacks[("rr-1", "energy")] = store_values
+    return service
+
+
+class TestTracer:
+    @pytest.mark.asyncio
+    async def test_traces_request_through_callback_and_repository(
+        self, tmp_path, repository
+    ):
+        path = tmp_path / "spans.jsonl"
+        tracer = Tracer(SpanExporter(path=str(path)))
+        tracer.start()
+        try:
+            service = report_service(repository)
+            response = await service.handler(
+                DummyRequest(update_report_message("rr-1", 3))
+            )
+        finally:
+            await tracer.close()
+
+        assert response.status == 200
+        spans = read_spans(path)
+        root = spans["oadrUpdateReport"]
+        handler = spans["ReportService.oadrUpdateReport"]
+        callback = spans["ReportService.report_callback"]
+        call = spans["DynamoDB.transact_write_items"]
+        assert root["kind"] == tracing.SPAN_KIND_SERVER
+        assert "parentSpanId" not in root
+        assert attributes(root)["openadr.ven_id"] == "ven-1"
+        assert attributes(root)["openadr.request_id"] == "req-1"
+        assert attributes(root)["http.response.status_code"] == "200"
+        assert handler["parentSpanId"] == root["spanId"]
+        assert callback["parentSpanId"] == handler["spanId"]
+        assert attributes(callback)["openadr.values"] == "3"
+        assert call["parentSpanId"] == callback["spanId"]
+        assert call["kind"] == tracing.SPAN_KIND_CLIENT
+        assert attributes(call)["aws.dynamodb.table_names"] == {
+            "values": [{"stringValue": "telemetry"}]
+        }
+        assert {span["traceId"] for span in spans.values()} == {root["traceId"]}
+
+    @pytest.mark.asyncio
+    async def test_scheduled_callbacks_join_the_request_trace(
+        self, tmp_path, repository
+    ):
+        path = tmp_path / "spans.jsonl"
+        tracer = Tracer(SpanExporter(path=str(path)))
+        tracer.start()
+        service = report_service(repository)
+        service.report_scheduler = FairScheduler(workers=1)
+        worker = asyncio.create_task(service.report_scheduler.run())
+        try:
+            await service.handler(DummyRequest(update_report_message("rr-1", 3)))
+            async with asyncio.timeout(5):
+                while (
+                    service.report_scheduler.pending or service.report_scheduler.running
+                ):
+                    await asyncio.sleep(0.01)
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            await tracer.close()
+
+        spans = read_spans(path)
+        assert (
+            spans["ReportService.report_callback"]["parentSpanId"]
+            == spans["ReportService.oadrUpdateReport"]["spanId"]
+        )
+        assert (
+            spans["DynamoDB.transact_write_items"]["parentSpanId"]
+            == spans["ReportService.report_callback"]["spanId"]
+        )
+
+    @pytest.mark.asyncio
+    async def test_slow_threshold_keeps_only_slow_or_failed_traces(self, tmp_path):
+        path = tmp_path / "spans.jsonl"
+        tracer = Tracer(SpanExporter(path=str(path)), slow_threshold=10.0)
+        tracer.start()
+        try:
+            with tracing.span("fast"):
+                with tracing.span("fast.child"):
+                    pass
+            with pytest.raises(RuntimeError):
+                with tracing.span("failed"):
+                    raise RuntimeError("boom")
+        finally:
+            await tracer.close()
+
+        spans = read_spans(path)
+        assert list(spans) == ["failed"]
+        assert spans["failed"]["status"] == {
+            "code": tracing.STATUS_ERROR,
+            "message": "RuntimeError: boom",
+        }
+        assert tracer.discarded_traces == 1
+
+    @pytest.mark.asyncio
+    async def test_unsampled_traces_record_nothing(self, tmp_path):
+        exporter = SpanExporter(path=str(tmp_path / "spans.jsonl"))
+        tracer = Tracer(exporter, sample_rate=0.0)
+        tracer.start()
+        try:
+            with tracing.span("root") as root:
+                with tracing.span("child") as child:
+                    assert tracing.get_current_span() is child
+        finally:
+            await tracer.close()
+
+        assert root is child is tracing.NON_RECORDING_SPAN
+        assert exporter.exported == 0
+
+    def test_span_is_a_no_op_without_a_tracer(self):
+        with tracing.span("anything") as span:
+            span.set_attribute("key", "value")
+
+        assert span is tracing.NON_RECORDING_SPAN
+        assert tracing.get_current_span() is tracing.NON_RECORDING_SPAN
+
+
+class TestSpanExporter:
+    @pytest.mark.asyncio
+    async def test_sends_lines_over_tcp(self):
+        server = socket.create_server(("127.0.0.1", 0))
+        received = []
+
+        def accept():
+            connection, _address = server.accept()
+            with connection, connection.makefile("rb") as file:
+                received.extend(file)
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+        tracer = Tracer(
+            SpanExporter(address=server.getsockname(), service_name="test-vtn")
+        )
+        tracer.start()
+        try:
+            with tracing.span("root", {"count": 1, "ratio": 0.5, "ok": True}):
+                pass
+        finally:
+            await tracer.close()
+            thread.join(5)
+            server.close()
+
+        (line,) = received
+        (resource_spans,) = json.loads(line)["resourceSpans"]
+        assert resource_spans["resource"]["attributes"] == [
+            {"key": "service.name", "value": {"stringValue": "test-vtn"}}
+        ]
+        (span,) = resource_spans["scopeSpans"][0]["spans"]
+        assert span["attributes"] == [
+            {"key": "count", "value": {"intValue": "1"}},
+            {"key": "ratio", "value": {"doubleValue": 0.5}},
+            {"key": "ok", "value": {"boolValue": True}},
+        ]
+        assert int(span["endTimeUnixNano"]) >= int(span["startTimeUnixNano"])
+
+    def test_requires_a_destination(self):
+        with pytest.raises(ValueError):
+            SpanExporter()
@@ -0,0 +1,212 @@
+import asyncio
+from http import HTTPStatus
+from unittest.mock import AsyncMock
+
+import pytest
+
+from openleadr_impl.registry.liveness import LivenessTracker
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.service import vtn_service
+from openleadr_impl.service.vtn_service import MyVTNService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_tracker(**kwargs):
+    clock = FakeClock()
+    tracker = LivenessTracker(offline_after=60.0, tick=1.0, clock=clock, **kwargs)
+    return tracker, clock
+
+
+class TestLivenessTracker:
+    def test_goes_offline_after_silence(self):
+        offline = []
+        tracker, clock = make_tracker(on_offline=offline.append)
+        tracker.seen("ven-1")
+
+        clock.now = 59.0
+        assert tracker.expire() == []
+        clock.now = 60.0
+        assert tracker.expire() == ["ven-1"]
+
+        assert offline == ["ven-1"]
+        assert tracker.is_offline("ven-1")
+        assert not tracker.is_online("ven-1")
+
+    def test_activity_pushes_deadline_back_lazily(self):
+        tracker, clock = make_tracker()
+        tracker.seen("ven-1")
+        clock.now = 50.0
+        tracker.seen("ven-1")
+
+        clock.now = 60.0
+        assert tracker.expire() == []
+        clock.now = 109.0
+        assert tracker.expire() == []
+        clock.now = 110.0
+        assert tracker.expire() == ["ven-1"]
+
+    def test_comes_back_online(self):
+        online = []
+        tracker, clock = make_tracker(on_online=online.append)
+        tracker.seen("ven-1")
+        clock.now = 100.0
+        tracker.expire()
+
+        tracker.seen("ven-1")
+
+        assert online == ["ven-1"]
+        assert tracker.is_online("ven-1")
+        # 再びアクセスが途絶えればオフラインになる
+        clock.now = 160.0
+        assert tracker.expire() == ["ven-1"]
+
+    def test_unknown_ven_is_neither_online_nor_offline(self):
+        tracker, _clock = make_tracker()
+
+        assert not tracker.is_online("ven-1")
+        assert not tracker.is_offline("ven-1")
+        assert tracker.seconds_since_seen("ven-1") is None
+
+    def test_forget(self):
+        tracker, clock = make_tracker()
+        tracker.seen("ven-1")
+        tracker.forget("ven-1")
+
+        clock.now = 100.0
+        assert tracker.expire() == []
+        assert not tracker.is_offline("ven-1")
+
+    @pytest.mark.asyncio
+    async def test_async_callback_runs_as_task(self):
+        called = asyncio.Event()
+
+        async def on_offline(ven_id):
+            called.set()
+
+        tracker, clock = make_tracker(on_offline=on_offline)
+        tracker.seen("ven-1")
+        clock.now = 60.0
+        tracker.expire()
+
+        await asyncio.wait_for(called.wait(), timeout=1)
+
+    def test_many_vens_expire_in_one_pass(self):
+        tracker, clock = make_tracker()
+        for i in range(10_000):
+            clock.now = i * 0.001
+            tracker.seen(f"ven-{i}")
+
+        clock.now = 100.0
+        assert len(tracker.expire()) == 10_000
+        assert len(tracker.offline_ven_ids()) == 10_000
+
+
+class DummyRequest:
+    def __init__(self, headers, body=b""):
+        self.headers = headers
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+
+class TestHandlerRecordsLiveness:
+    @pytest.mark.asyncio
+    async def test_authenticated_request_marks_ven_seen(self, monkeypatch):
+        service = MyVTNService(vtn_id="test-vtn")
+        service._create_message = lambda *_args, **_kwargs: "<xml/>"
+        service.ven_lookup = AsyncMock(
+            return_value={"ven_id": "ven-1", "registration_id": "reg-1"}
+        )
+        service.handle_message = AsyncMock(return_value=("oadrResponse", {}))
+        service.liveness_tracker, _clock = make_tracker()
+        monkeypatch.setattr(vtn_service, "authenticate_message", AsyncMock())
+        monkeypatch.setattr(vtn_service, "validate_xml_schema", lambda _content: None)
+        monkeypatch.setattr(
+            vtn_service,
+            "parse_message",
+            lambda _content: ("oadrPoll", {"ven_id": "ven-1"}),
+        )
+
+        response = await service.handler(
+            DummyRequest(headers={"content-type": "application/xml"})
+        )
+
+        assert response.status == HTTPStatus.OK
+        assert service.liveness_tracker.is_online("ven-1")
+
+    @pytest.mark.asyncio
+    async def test_unregistered_ven_is_not_recorded(self, monkeypatch):
+        service = MyVTNService(vtn_id="test-vtn")
+        service._create_message = lambda *_args, **_kwargs: "<xml/>"
+        service.ven_lookup = AsyncMock(return_value=None)
+        service.liveness_tracker, _clock = make_tracker()
+        monkeypatch.setattr(vtn_service, "validate_xml_schema", lambda _content: None)
+        monkeypatch.setattr(
+            vtn_service,
+            "parse_message",
+            lambda _content: ("oadrPoll", {"ven_id": "ven-1"}),
+        )
+
+        await service.handler(DummyRequest(headers={"content-type": "application/xml"}))
+
+        assert not service.liveness_tracker.is_online("ven-1")
+
+
+class TestServerSkipsOfflineVens:
+    def _make_server(self, push_transport=None):
+        tracker, clock = make_tracker()
+        server = MyOpenADRServer(
+            vtn_id="test-vtn",
+            push_transport=push_transport,
+            liveness_tracker=tracker,
+        )
+        tracker.seen("ven-online")
+        tracker.seen("ven-offline")
+        clock.now = 30.0
+        tracker.seen("ven-online")
+        clock.now = 60.0
+        tracker.expire()
+        return server
+
+    @pytest.mark.asyncio
+    async def test_push_events_skips_offline(self):
+        push_transport = AsyncMock()
+        push_transport.distribute_events.return_value = {}
+        server = self._make_server(push_transport)
+        events_updated = server.services["poll_service"].events_updated
+        events_updated["ven-online"] = True
+        events_updated["ven-offline"] = True
+
+        await server.push_events(["ven-online", "ven-offline"])
+
+        push_transport.distribute_events.assert_awaited_once_with(["ven-online"])
+        # オフラインの VEN のイベントは次回の oadrPoll まで残る
+        assert events_updated["ven-offline"] is True
+
+    @pytest.mark.asyncio
+    async def test_pushes_held_back_events_when_ven_returns(self):
+        push_transport = AsyncMock()
+        push_transport.distribute_events.return_value = {}
+        server = self._make_server(push_transport)
+        server.services["poll_service"].events_updated["ven-offline"] = True
+
+        server.liveness_tracker.seen("ven-offline")
+        await asyncio.sleep(0)
+
+        push_transport.distribute_events.assert_awaited_once_with(["ven-offline"])
+
+    def test_request_report_skip_offline(self):
+        server = self._make_server()
+
+        assert server.request_report("ven-offline", [], skip_offline=True) is False
+        assert server.request_report("ven-offline", []) is True
+        assert server.request_report("ven-online", [], skip_offline=True) is True
+        assert len(server.services["poll_service"].outbound_queue) == 2
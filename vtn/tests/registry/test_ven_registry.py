@@ -0,0 +1,322 @@
+import asyncio
+
+import boto3
+import pytest
+from moto import mock_aws
+from openleadr.messaging import create_message
+
+from openleadr_impl.diagnostics.metrics import VtnMetrics
+from openleadr_impl.registry.ven_registry import VenRegistry
+from openleadr_impl.repository import dynamodb
+from openleadr_impl.repository.ven_repository import UPDATED_PARTITION, VenRepository
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.service.vtn_service import MyVTNService
+from openleadr_impl.utils import utils
+
+
+class FakeVenRepository:
+    def __init__(self, vens):
+        self.vens = vens
+        self.calls = []
+        self.saved = 0
+
+    def save_registration(self, ven_id, registration_id, fingerprint=None):
+        self.saved += 1
+        current = next((v for v in self.vens if v["ven_id"] == ven_id), None)
+        if current is None:
+            if registration_id is None:
+                return None
+            current = make_ven(ven_id, fingerprint, None, ven_name=None)
+            self.vens.append(current)
+        current["registration_id"] = registration_id
+        if fingerprint is not None:
+            current["fingerprint"] = fingerprint
+        current["updated_at"] = f"2025-02-01T00:00:{self.saved:02d}Z"
+        return dict(current)
+
+    def scan_vens(self, updated_since=None):
+        self.calls.append(updated_since)
+        return [
+            v
+            for v in self.vens
+            if updated_since is None or v["updated_at"] >= updated_since
+        ]
+
+
+def make_ven(ven_id, fingerprint, updated_at, **kwargs):
+    return {
+        "ven_id": ven_id,
+        "ven_name": f"name-{ven_id}",
+        "fingerprint": fingerprint,
+        "registration_id": f"reg-{ven_id}",
+        "updated_at": updated_at,
+        "deleted": False,
+        **kwargs,
+    }
+
+
+class TestVenRegistry:
+    def test_load_builds_both_indexes(self):
+        repo = FakeVenRepository(
+            [
+                make_ven("ven-1", "AA", "2025-01-01T00:00:00Z"),
+                make_ven("ven-2", "BB", "2025-01-02T00:00:00Z"),
+            ]
+        )
+        registry = VenRegistry(repo)
+
+        registry.load()
+
+        assert len(registry) == 2
+        assert registry.lookup("ven-1") == {
+            "ven_id": "ven-1",
+            "ven_name": "name-ven-1",
+            "fingerprint": "AA",
+            "registration_id": "reg-ven-1",
+            "transport_address": None,
+        }
+        assert registry.lookup_by_fingerprint("BB")["ven_id"] == "ven-2"
+        assert registry.lookup("unknown") is None
+        assert registry.marker == "2025-01-02T00:00:00Z"
+        assert registry.registered == 2
+
+    def test_refresh_uses_marker_and_applies_changes(self):
+        repo = FakeVenRepository(
+            [
+                make_ven("ven-1", "AA", "2025-01-01T00:00:00Z"),
+                make_ven("ven-2", "BB", "2025-01-01T00:00:00Z"),
+            ]
+        )
+        registry = VenRegistry(repo)
+        registry.load()
+
+        repo.vens = [
+            make_ven("ven-1", "CC", "2025-01-03T00:00:00Z"),
+            make_ven("ven-2", "BB", "2025-01-03T00:00:00Z", deleted=True),
+            make_ven("ven-3", "DD", "2025-01-03T00:00:00Z"),
+            make_ven("ven-4", "EE", "2025-01-03T00:00:00Z", revoked=True),
+        ]
+        registry.refresh()
+
+        assert repo.calls == [None, "2025-01-01T00:00:00Z"]
+        assert registry.lookup_by_fingerprint("AA") is None
+        assert registry.lookup_by_fingerprint("CC")["ven_id"] == "ven-1"
+        assert registry.lookup("ven-2") is None
+        assert registry.lookup_by_fingerprint("BB") is None
+        assert registry.lookup("ven-3")["fingerprint"] == "DD"
+        assert registry.lookup_by_fingerprint("EE") is None
+        assert registry.marker == "2025-01-03T00:00:00Z"
+        # ven-1 と ven-3（ven-2 は削除、ven-4 は失効）
+        assert registry.registered == 2
+
+    @pytest.mark.asyncio
+    async def test_run_refreshes_in_background(self):
+        repo = FakeVenRepository([])
+        registry = VenRegistry(repo, refresh_interval=0.01)
+        registry.load()
+        repo.vens = [make_ven("ven-1", "AA", "2025-01-01T00:00:00Z")]
+
+        task = asyncio.create_task(registry.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        assert registry.lookup("ven-1")["fingerprint"] == "AA"
+
+
+class TestVenRepository:
+    @pytest.fixture
+    def dynamodb_client(self, monkeypatch):
+        with mock_aws():
+            client = boto3.client("dynamodb", region_name="ap-northeast-1")
+            client.create_table(
+                TableName="vens",
+                KeySchema=[{"AttributeName": "ven_id", "KeyType": "HASH"}],
+                AttributeDefinitions=[
+                    {"AttributeName": "ven_id", "AttributeType": "S"},
+                    {"AttributeName": "updated_partition", "AttributeType": "S"},
+                    {"AttributeName": "updated_at", "AttributeType": "S"},
+                ],
+                GlobalSecondaryIndexes=[
+                    {
+                        "IndexName": "updated_at-index",
+                        "KeySchema": [
+                            {"AttributeName": "updated_partition", "KeyType": "HASH"},
+                            {"AttributeName": "updated_at", "KeyType": "RANGE"},
+                        ],
+                        "Projection": {"ProjectionType": "ALL"},
+                    }
+                ],
+                BillingMode="PAY_PER_REQUEST",
+            )
+            monkeypatch.setattr(dynamodb, "get_dynamodb_client", lambda: client)
+            yield client
+
+    def test_scan_vens_converts_items(self, dynamodb_client):
+        dynamodb_client.put_item(
+            TableName="vens",
+            Item={
+                "ven_id": {"S": "ven-1"},
+                "ven_name": {"S": "ven123"},
+                "fingerprint": {"S": "AA"},
+                "registration_id": {"S": "reg-1"},
+                "updated_at": {"S": "2025-01-01T00:00:00Z"},
+            },
+        )
+
+        vens = VenRepository().scan_vens()
+
+        assert vens == [
+            {
+                "ven_id": "ven-1",
+                "ven_name": "ven123",
+                "fingerprint": "AA",
+                "registration_id": "reg-1",
+                "transport_address": None,
+                "updated_at": "2025-01-01T00:00:00Z",
+                "deleted": False,
+                "revoked": False,
+            }
+        ]
+
+    def test_save_registration_is_picked_up_by_the_delta(self, dynamodb_client):
+        repository = VenRepository()
+        assert repository.save_registration("ven-1", None) is None
+
+        saved = repository.save_registration("ven-1", "reg-1", "AA")
+        vens = repository.scan_vens(updated_since=saved["updated_at"])
+        cancelled = repository.save_registration("ven-1", None)
+
+        assert saved["registration_id"] == "reg-1"
+        assert [(v["ven_id"], v["fingerprint"]) for v in vens] == [("ven-1", "AA")]
+        assert cancelled["registration_id"] is None
+        assert cancelled["fingerprint"] == "AA"
+
+    def test_scan_vens_filters_by_marker(self, dynamodb_client):
+        for i, updated_at in enumerate(
+            ["2025-01-01T00:00:00Z", "2025-01-02T00:00:00Z", "2025-01-03T00:00:00Z"]
+        ):
+            dynamodb_client.put_item(
+                TableName="vens",
+                Item={
+                    "ven_id": {"S": f"ven-{i}"},
+                    "updated_at": {"S": updated_at},
+                    "updated_partition": {"S": UPDATED_PARTITION},
+                },
+            )
+        metrics = VtnMetrics()
+
+        vens = VenRepository(metrics=metrics).scan_vens(
+            updated_since="2025-01-02T00:00:00Z"
+        )
+        scanned = VenRepository(metrics=metrics, updated_index=None).scan_vens(
+            updated_since="2025-01-02T00:00:00Z"
+        )
+
+        # 差分は GSI への Query で取得する（updated_index=None の場合だけ Scan）
+        assert [v["ven_id"] for v in vens] == ["ven-1", "ven-2"]
+        assert sorted(v["ven_id"] for v in scanned) == ["ven-1", "ven-2"]
+        assert metrics.dynamodb_calls.value(("query", "ok")) == 1
+        assert metrics.dynamodb_calls.value(("scan", "ok")) == 1
+
+
+class DummyRequest:
+    def __init__(self, body):
+        self.headers = {
+            "content-type": "application/xml",
+            "X-Amzn-Mtls-Clientcert-Leaf": "leaf",
+        }
+        self._body = body
+        self.remote = "10.0.0.1"
+
+    async def read(self):
+        return self._body
+
+
+class TestRegistrationUpdatesRegistry:
+    @pytest.fixture
+    def repository(self):
+        return FakeVenRepository([])
+
+    @pytest.fixture
+    def other_registry(self, repository):
+        # 同じリポジトリを読む、別のワーカーの VenRegistry
+        registry = VenRegistry(repository)
+        registry.load()
+        return registry
+
+    @pytest.fixture
+    def server(self, monkeypatch, repository):
+        monkeypatch.setattr(
+            utils, "get_certificate_fingerprint_from_alb_header", lambda _request: "AA"
+        )
+        # サーバーが MyVTNService に設定する ven_registry / ven_lookup を、テストの後に元に戻す
+        monkeypatch.setattr(MyVTNService, "ven_registry", None)
+        monkeypatch.setattr(MyVTNService, "ven_lookup", None, raising=False)
+        registry = VenRegistry(repository)
+        registry.load()
+        server = MyOpenADRServer(vtn_id="test-vtn", ven_registry=registry)
+        server.add_handler(
+            "on_create_party_registration", lambda payload: ("ven-1", "reg-1")
+        )
+        server.add_handler(
+            "on_cancel_party_registration",
+            lambda payload: (
+                "oadrCanceledPartyRegistration",
+                {"registration_id": payload["registration_id"]},
+            ),
+        )
+        return server
+
+    @pytest.mark.asyncio
+    async def test_registered_ven_can_poll_before_the_next_refresh(
+        self, server, other_registry
+    ):
+        registration = server.services["registration_service"]
+        poll = server.services["poll_service"]
+        poll_body = create_message("oadrPoll", ven_id="ven-1").encode()
+
+        response = await registration.handler(
+            DummyRequest(
+                create_message(
+                    "oadrCreatePartyRegistration",
+                    request_id="req-1",
+                    ven_name="ven123",
+                    profile_name="2.0b",
+                    transport_name="simpleHttp",
+                    transport_address=None,
+                    report_only=False,
+                    xml_signature=False,
+                    http_pull_model=True,
+                ).encode()
+            )
+        )
+        assert "reg-1" in response.text
+        assert server.ven_registry.lookup("ven-1")["fingerprint"] == "AA"
+        # 他のワーカーは次の差分取得で登録を取り込む
+        assert other_registry.lookup_by_fingerprint("AA") is None
+        other_registry.refresh()
+        assert other_registry.lookup_by_fingerprint("AA")["registration_id"] == "reg-1"
+
+        response = await poll.handler(DummyRequest(poll_body))
+        assert response.status == 200
+        assert "oadrResponse" in response.text
+        assert "Not Registered" not in response.text
+
+        await registration.handler(
+            DummyRequest(
+                create_message(
+                    "oadrCancelPartyRegistration",
+                    request_id="req-2",
+                    ven_id="ven-1",
+                    registration_id="reg-1",
+                ).encode()
+            )
+        )
+        assert server.ven_registry.lookup("ven-1")["registration_id"] is None
+        assert server.ven_registry.registered == 0
+        other_registry.refresh()
+        assert other_registry.lookup("ven-1")["registration_id"] is None
+
+        response = await poll.handler(DummyRequest(poll_body))
+        assert "oadrResponse" in response.text
+        assert "<ei:responseCode>200" not in response.text
@@ -337,3 +337,92 @@ class TestMyVTNServiceHandler:
         auth_mock.assert_awaited_once()
         assert auth_mock.await_args.kwargs["ven_lookup"] is ven_lookup
         ven_lookup.assert_awaited_once()
+
+
+class FakeVenRegistry:
+    def __init__(self, vens):
+        self.vens = {v["fingerprint"]: v for v in vens}
+
+    def lookup_by_fingerprint(self, fingerprint):
+        return self.vens.get(fingerprint)
+
+
+class TestMyVTNServiceFingerprintFirst:
+    def _make_service(self, monkeypatch, fingerprint):
+        service = MyVTNService(vtn_id="test-vtn")
+        service._create_message = lambda *_args, **_kwargs: "<xml/>"
+        service.ven_registry = FakeVenRegistry(
+            [{"ven_id": "ven-123", "fingerprint": "AA:BB", "registration_id": "reg-1"}]
+        )
+        service.ven_lookup = AsyncMock()
+        monkeypatch.setattr(
+            vtn_service.myUtils,
+            "get_certificate_fingerprint_from_alb_header",
+            lambda _request: fingerprint,
+        )
+        return service
+
+    @pytest.mark.asyncio
+    async def test_unknown_certificate_rejected_before_reading_body(
+        self, monkeypatch
+    ):
+        service = self._make_service(monkeypatch, "CC:DD")
+        parse_mock = Mock()
+        monkeypatch.setattr(vtn_service, "parse_message", parse_mock)
+        request = DummyRequest(headers={"content-type": "application/xml"})
+        request.read = AsyncMock()
+
+        response = await service.handler(request)
+
+        assert response.status == HTTPStatus.FORBIDDEN
+        request.read.assert_not_called()
+        parse_mock.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_known_certificate_skips_ven_lookup(self, monkeypatch):
+        service = self._make_service(monkeypatch, "AA:BB")
+        service.handle_message = AsyncMock(return_value=("oadrResponse", {}))
+        auth_mock = AsyncMock()
+        monkeypatch.setattr(vtn_service, "authenticate_message", auth_mock)
+        monkeypatch.setattr(
+            vtn_service, "validate_xml_schema", lambda _content: "mocked-tree"
+        )
+        monkeypatch.setattr(
+            vtn_service,
+            "parse_message",
+            lambda _content: ("oadrPoll", {"ven_id": "ven-123"}),
+        )
+
+        response = await service.handler(
+            DummyRequest(headers={"content-type": "application/xml"}, body=b"<oadr/>")
+        )
+
+        assert response.status == HTTPStatus.OK
+        service.handle_message.assert_awaited_once()
+        service.ven_lookup.assert_not_called()
+        auth_mock.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_known_certificate_with_foreign_ven_id(self, monkeypatch):
+        service = self._make_service(monkeypatch, "AA:BB")
+        service.handle_message = AsyncMock()
+        service.error_response = Mock(
+            return_value=("oadrResponse", {"response": {"response_code": 463}})
+        )
+        monkeypatch.setattr(
+            vtn_service, "validate_xml_schema", lambda _content: "mocked-tree"
+        )
+        monkeypatch.setattr(
+            vtn_service,
+            "parse_message",
+            lambda _content: ("oadrPoll", {"ven_id": "ven-999"}),
+        )
+
+        response = await service.handler(
+            DummyRequest(headers={"content-type": "application/xml"}, body=b"<oadr/>")
+        )
+
+        assert response.status == HTTPStatus.OK
+        service.handle_message.assert_not_called()
+        service.error_response.assert_called_once()
+        assert service.error_response.call_args.args[1] == 463
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+import pytest
+
+from openleadr_impl.server import MyOpenADRServer
+from openleadr_impl.state.snapshot import (
+    CallbackRegistry,
+    MissingCallback,
+    Snapshotter,
+    dump_state,
+    load_state,
+)
+
+
+async def on_update_report(data, r_id):
+    pass
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def make_registry():
+    registry = CallbackRegistry()
+    registry.register("report.update", on_update_report)
+    registry.register("event.response", on_event_response)
+    return registry
+
+
+def make_server_with_state():
+    server = MyOpenADRServer(vtn_id="test-vtn")
+    event_id = server.add_event(
+        ven_id="ven-1",
+        signal_name="simple",
+        signal_type="level",
+        intervals=[
+            {
+                "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                "duration": timedelta(minutes=5),
+                "signal_payload": 1,
+            }
+        ],
+        callback=on_event_response,
+    )
+    report_service = server.services["report_service"]
+    report_service.report_callbacks[("rr-1", "r1")] = partial(on_update_report, r_id="r1")
+    report_service.created_reports["ven-1"] = ["rr-1"]
+    server.request_reregistration("ven-1")
+    return server, event_id
+
+
+class TestSnapshot:
+    def test_roundtrip_rebinds_callbacks_by_name(self):
+        server, event_id = make_server_with_state()
+        data = dump_state(server, make_registry())
+
+        # 再起動後は関数が別のオブジェクトになっていても、同じ名前で結び直される
+        async def moved_on_update_report(data, r_id):
+            pass
+
+        registry = CallbackRegistry()
+        registry.register("report.update", moved_on_update_report)
+        registry.register("event.response", on_event_response)
+        restored = MyOpenADRServer(vtn_id="test-vtn")
+        load_state(restored, data, registry)
+
+        callback = restored.services["report_service"].report_callbacks[("rr-1", "r1")]
+        assert callback.func is moved_on_update_report
+        assert callback.keywords == {"r_id": "r1"}
+        event, event_callback = restored.services["event_service"].event_callbacks[event_id]
+        assert event_callback is on_event_response
+        # イベントは events と event_callbacks で同じオブジェクトのまま復元される
+        assert event is restored.events["ven-1"][0]
+        assert restored.services["poll_service"].events_updated["ven-1"] is True
+        assert restored.services["poll_service"].outbound_queue.pending("ven-1") == 1
+
+    def test_unknown_callback_name(self):
+        server, event_id = make_server_with_state()
+        data = dump_state(server, make_registry())
+
+        restored = MyOpenADRServer(vtn_id="test-vtn")
+        load_state(restored, data, CallbackRegistry())
+
+        callback = restored.services["report_service"].report_callbacks[("rr-1", "r1")]
+        assert isinstance(callback.func, MissingCallback)
+        assert callback.func.name == "report.update"
+
+    @pytest.mark.asyncio
+    async def test_unsaved_callbacks_are_replaced_per_entry(self, caplog):
+        server, event_id = make_server_with_state()
+        event_service = server.services["event_service"]
+        report_service = server.services["report_service"]
+
+        class Locked:
+            def __init__(self):
+                self.lock = threading.Lock()
+
+            def __call__(self, data):
+                pass
+
+        event = event_service.event_callbacks[event_id][0]
+        event_service.event_callbacks["future"] = (event, asyncio.get_running_loop().create_future())
+        event_service.event_delivery_callbacks[event_id] = lambda: None
+        report_service.report_callbacks[("rr-2", "r1")] = Locked()
+
+        registry = make_registry()
+        with caplog.at_level(logging.WARNING, logger="openleadr"):
+            data = dump_state(server, registry)
+            dump_state(server, registry)
+        restored = MyOpenADRServer(vtn_id="test-vtn")
+        load_state(restored, data, make_registry())
+
+        restored_callbacks = restored.services["event_service"].event_callbacks
+        assert restored_callbacks[event_id][1] is on_event_response
+        restored_event, future = restored_callbacks["future"]
+        assert restored_event is restored.events["ven-1"][0]
+        assert isinstance(future, MissingCallback)
+        delivery = restored.services["event_service"].event_delivery_callbacks[event_id]
+        assert isinstance(delivery, MissingCallback) and "<lambda>" in delivery.name
+        restored_reports = restored.services["report_service"].report_callbacks
+        assert isinstance(restored_reports[("rr-2", "r1")], MissingCallback)
+        assert restored_reports[("rr-1", "r1")].func is on_update_report
+        # 名前ごとに一度だけ警告する（同じレジストリなら二度目の保存では警告しない）
+        assert caplog.text.count("<lambda>") == 1
+
+    @pytest.mark.asyncio
+    async def test_background_save_with_unsaved_callback(self, tmp_path, caplog):
+        server, event_id = make_server_with_state()
+        server.services["event_service"].event_delivery_callbacks[event_id] = lambda: None
+        snapshotter = Snapshotter(str(tmp_path / "state.snapshot"), make_registry())
+
+        with caplog.at_level(logging.WARNING, logger="openleadr"):
+            assert await snapshotter.save_in_background(server) is True
+        assert "<lambda>" in caplog.text
+        restored = MyOpenADRServer(vtn_id="test-vtn")
+        assert snapshotter.restore(restored) is True
+        assert list(restored.events) == ["ven-1"]
+
+    @pytest.mark.asyncio
+    async def test_save_and_restore_file(self, tmp_path):
+        server, event_id = make_server_with_state()
+        snapshotter = Snapshotter(str(tmp_path / "state.snapshot"), make_registry())
+
+        assert await snapshotter.save_in_background(server) is True
+        restored = MyOpenADRServer(vtn_id="test-vtn")
+
+        assert snapshotter.restore(restored) is True
+        assert list(restored.events) == ["ven-1"]
+
+    def test_missing_or_broken_file(self, tmp_path):
+        path = tmp_path / "state.snapshot"
+        snapshotter = Snapshotter(str(path))
+        server = MyOpenADRServer(vtn_id="test-vtn")
+
+        assert snapshotter.restore(server) is False
+        path.write_bytes(b"not a snapshot")
+        assert snapshotter.restore(server) is False
+        assert server.events == {}
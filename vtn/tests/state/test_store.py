@@ -0,0 +1,84 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from openleadr_impl.server import STATE_NAMESPACES, MyOpenADRServer
+from openleadr_impl.state.store import MemoryStore, SharedStore
+
+
+async def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+@pytest.fixture
+def shared_store():
+    store = SharedStore(STATE_NAMESPACES)
+    yield store
+    store.shutdown()
+
+
+def add_event(server, ven_id):
+    return server.add_event(
+        ven_id=ven_id,
+        signal_name="simple",
+        signal_type="level",
+        intervals=[
+            {
+                "dtstart": datetime.now(timezone.utc) + timedelta(minutes=1),
+                "duration": timedelta(minutes=5),
+                "signal_payload": 1,
+            }
+        ],
+        callback=on_event_response,
+    )
+
+
+class TestMemoryStore:
+    def test_namespaces_are_dicts(self):
+        store = MemoryStore()
+
+        store.namespace("a")["x"] = 1
+
+        assert store.namespace("a") == {"x": 1}
+        with store.lock():
+            pass
+
+
+class TestSharedStore:
+    def test_undeclared_namespace(self, shared_store):
+        with pytest.raises(KeyError):
+            shared_store.namespace("unknown")
+
+    def test_visible_across_fork(self, shared_store):
+        events_updated = shared_store.namespace("poll_service.events_updated")
+
+        pid = os.fork()
+        if pid == 0:
+            events_updated["ven-1"] = True
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert events_updated["ven-1"] is True
+
+    @pytest.mark.asyncio
+    async def test_any_server_serves_any_ven(self, shared_store):
+        # 2 つのワーカーの代わりに、同じストアを使う 2 つのサーバー
+        adding = MyOpenADRServer(vtn_id="test-vtn", state_store=shared_store)
+        event_id = add_event(adding, "ven-1")
+        adding.request_report("ven-1", [])
+        serving = MyOpenADRServer(vtn_id="test-vtn", state_store=shared_store)
+        poll_service = serving.services["poll_service"]
+
+        assert await poll_service.poll({"ven_id": "ven-1"}) == (
+            "oadrDistributeEvent",
+            {"events": [serving.events["ven-1"][0]]},
+        )
+        message_type, _payload = await poll_service.poll({"ven_id": "ven-1"})
+        assert message_type == "oadrCreateReport"
+        assert await poll_service.poll({"ven_id": "ven-1"}) == ("oadrResponse", {})
+
+        serving.cancel_event("ven-1", event_id)
+        event = adding.events["ven-1"][0]
+        assert event.event_descriptor.event_status == "cancelled"
+        assert adding.event_callbacks[event_id][1] is on_event_response
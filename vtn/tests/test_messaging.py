@@ -1,9 +1,16 @@
+from http import HTTPStatus
 import types
 import pytest
 from types import SimpleNamespace
 from openleadr import errors, utils
-
-from openleadr_impl.messaging import authenticate_message
+from openleadr.messaging import create_message
+
+from openleadr_impl.messaging import (
+    authenticate_fingerprint,
+    authenticate_message,
+    sniff_message_type,
+    verify_ven_id,
+)
 from openleadr_impl.utils import utils as myUtils
 
 
@@ -112,3 +119,73 @@ def ven_lookup_正常系(ven_id):
 
 def make_request(headers: dict):
     return SimpleNamespace(headers=headers)
+
+
+class FakeRegistry:
+    def __init__(self, vens):
+        self.vens = {v["fingerprint"]: v for v in vens}
+
+    def lookup_by_fingerprint(self, fingerprint):
+        return self.vens.get(fingerprint)
+
+
+def test_authenticate_fingerprint_returns_known_ven(monkeypatch):
+    monkeypatch.setattr(
+        myUtils, "get_certificate_fingerprint_from_alb_header", lambda req: "AA:BB"
+    )
+    ven = {"ven_id": "VEN-1", "fingerprint": "AA:BB", "registration_id": "123"}
+
+    result = authenticate_fingerprint(make_request(headers={}), FakeRegistry([ven]))
+
+    assert result is ven
+
+
+def test_authenticate_fingerprint_rejects_unknown_certificate(monkeypatch):
+    monkeypatch.setattr(
+        myUtils, "get_certificate_fingerprint_from_alb_header", lambda req: "CC:DD"
+    )
+    ven = {"ven_id": "VEN-1", "fingerprint": "AA:BB", "registration_id": "123"}
+
+    with pytest.raises(errors.HTTPError) as excinfo:
+        authenticate_fingerprint(make_request(headers={}), FakeRegistry([ven]))
+
+    assert excinfo.value.response_code == HTTPStatus.FORBIDDEN
+
+
+@pytest.mark.parametrize(
+    "ven_info",
+    [
+        {"ven_id": "VEN-2", "fingerprint": "AA:BB", "registration_id": "123"},
+        {"ven_id": "VEN-1", "fingerprint": "AA:BB", "registration_id": None},
+    ],
+)
+def test_verify_ven_id_rejects_foreign_or_unregistered_ven(ven_info):
+    with pytest.raises(errors.NotRegisteredOrAuthorizedError):
+        verify_ven_id(ven_info, {"ven_id": "VEN-1"})
+
+
+def test_verify_ven_id_accepts_own_ven_id():
+    verify_ven_id(
+        {"ven_id": "VEN-1", "fingerprint": "AA:BB", "registration_id": "123"},
+        {"ven_id": "VEN-1"},
+    )
+
+
+@pytest.mark.parametrize(
+    "message_type, payload",
+    [
+        ("oadrPoll", {"ven_id": "VEN-1"}),
+        (
+            "oadrUpdateReport",
+            {"ven_id": "VEN-1", "request_id": "req-1", "reports": []},
+        ),
+    ],
+)
+def test_sniff_message_type(message_type, payload):
+    content = create_message(message_type, **payload).encode()
+
+    assert sniff_message_type(content) == message_type
+
+
+def test_sniff_message_type_unknown():
+    assert sniff_message_type(b"<notOpenADR/>") is None
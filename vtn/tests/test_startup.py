@@ -0,0 +1,62 @@
+import logging
+import os
+import subprocess
+import sys
+
+from openleadr.messaging import TEMPLATES
+
+from openleadr_impl import startup
+from openleadr_impl.startup import StartupTimer, prewarm
+
+VTN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestStartupTimer:
+    def test_records_phases_and_reports(self, caplog):
+        timer = StartupTimer(started=0.0)
+        timer.mark("import")
+        timer.mark("prewarm")
+
+        assert [name for name, _seconds in timer.phases] == ["import", "prewarm"]
+        assert timer.elapsed == sum(seconds for _name, seconds in timer.phases)
+        with caplog.at_level(logging.INFO, logger="openleadr"):
+            timer.report()
+        assert "import" in caplog.text and "prewarm" in caplog.text
+
+
+class TestPrewarm:
+    def test_compiles_all_templates(self):
+        prewarm()
+
+        assert TEMPLATES.auto_reload is False
+        cached = {key[1] for key in TEMPLATES.cache.keys()}
+        assert set(TEMPLATES.list_templates()) <= cached
+
+    def test_validates_and_parses_a_message(self, monkeypatch):
+        monkeypatch.setattr(startup, "_prewarmed", False)
+        calls = []
+        monkeypatch.setattr(
+            startup,
+            "validate_xml_schema",
+            lambda content: calls.append(("validate", content)),
+        )
+        monkeypatch.setattr(
+            startup, "parse_message", lambda content: calls.append(("parse", content))
+        )
+
+        prewarm()
+
+        assert [step for step, _content in calls] == ["validate", "parse"]
+        assert calls[0][1] == calls[1][1]
+        assert b"oadrPoll" in calls[0][1]
+
+    def test_main_does_not_import_boto3(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, main; print('boto3' in sys.modules)"],
+            cwd=VTN_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        assert result.stdout.strip() == "False"
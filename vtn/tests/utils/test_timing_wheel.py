@@ -0,0 +1,45 @@
+from openleadr_impl.utils.timing_wheel import TimingWheel
+
+
+class TestTimingWheel:
+    def test_expires_at_deadline(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.schedule("a", 3.0)
+        wheel.schedule("b", 5.0)
+
+        assert wheel.advance(2.9) == []
+        assert wheel.advance(3.0) == ["a"]
+        assert wheel.advance(10.0) == ["b"]
+        assert len(wheel) == 0
+
+    def test_deadline_beyond_one_revolution(self):
+        wheel = TimingWheel(tick=1.0, slots=4)
+        wheel.schedule("a", 10.0)
+
+        # スロットを 2 回通過するが、期限までは残る
+        assert wheel.advance(9.0) == []
+        assert "a" in wheel
+        assert wheel.advance(10.0) == ["a"]
+
+    def test_large_jump_visits_every_slot_once(self):
+        wheel = TimingWheel(tick=1.0, slots=4)
+        for i in range(10):
+            wheel.schedule(i, float(i + 1))
+
+        assert sorted(wheel.advance(1000.0)) == list(range(10))
+
+    def test_reschedule_and_cancel(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.schedule("a", 2.0)
+        wheel.schedule("a", 6.0)
+        wheel.schedule("b", 2.0)
+        wheel.cancel("b")
+
+        assert wheel.advance(5.0) == []
+        assert wheel.advance(6.0) == ["a"]
+
+    def test_past_deadline_expires_on_next_tick(self):
+        wheel = TimingWheel(tick=1.0, slots=8, now=5.0)
+        wheel.schedule("a", 1.0)
+
+        assert wheel.advance(6.0) == ["a"]
@@ -49,6 +49,28 @@ class TestGetCerificateFingerprintFromAlbHeader:
         )
 
 
+    def test_正常系_同じ証明書はパースを省略する(self, monkeypatch):
+        cert = (Path(__file__).parent / "client_cert_for_test.crt").read_text(
+            encoding="utf-8"
+        )
+        utils._fingerprint_from_leaf.cache_clear()
+        calls = []
+        original = utils.x509.load_pem_x509_certificate
+
+        def counting_load(data):
+            calls.append(data)
+            return original(data)
+
+        monkeypatch.setattr(utils.x509, "load_pem_x509_certificate", counting_load)
+        req = make_request({"X-Amzn-Mtls-Clientcert-Leaf": cert})
+
+        first = utils.get_certificate_fingerprint_from_alb_header(req)
+        second = utils.get_certificate_fingerprint_from_alb_header(req)
+
+        assert first == second
+        assert len(calls) == 1
+
+
 # 以下はヘルパー関数
 def make_request(headers: dict):
     return SimpleNamespace(headers=headers)